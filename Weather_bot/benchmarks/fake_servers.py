@@ -0,0 +1,154 @@
+import asyncio
+import json
+import random
+import time
+import zlib
+from collections import Counter
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+async def _start(app: web.Application) -> tuple:
+    """Запускает приложение на свободном локальном порту; возвращает (runner, базовый URL)."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+class FakeOpenWeatherMap:
+    """Заглушка OpenWeatherMap (weather, forecast, group) с настраиваемыми задержкой и долей ошибок."""
+
+    def __init__(self, latency: float = 0.1, jitter: float = 0.05, error_rate: float = 0.0):
+        """
+        Args:
+            latency: Средняя задержка ответа, сек.
+            jitter: Разброс задержки, сек (равномерно в ±jitter).
+            error_rate: Доля ответов с ошибкой 500.
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls: Counter = Counter()
+        self.errors = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> str:
+        """Запускает сервер и возвращает базовый URL API (аналог .../data/2.5/)."""
+        app = web.Application()
+        app.router.add_get('/data/2.5/weather', self._weather)
+        app.router.add_get('/data/2.5/forecast', self._forecast)
+        app.router.add_get('/data/2.5/group', self._group)
+        self._runner, url = await _start(app)
+        return url + '/data/2.5/'
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _delay(self, endpoint: str) -> None:
+        self.calls[endpoint] += 1
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if random.random() < self.error_rate:
+            self.errors += 1
+            raise web.HTTPInternalServerError()
+
+    @staticmethod
+    def _city(query) -> Dict:
+        """Детерминированный город по названию, ID или координатам."""
+        if 'id' in query:
+            city_id = int(query['id'])
+            name = f"City{city_id}"
+        elif 'lat' in query:
+            # Ближайший «город» - один на квадрат 0.1° x 0.1°
+            place = f"{float(query['lat']):.1f},{float(query['lon']):.1f}"
+            city_id = zlib.crc32(place.encode()) % 10_000_000
+            name = f"Place{city_id}"
+        else:
+            name = query['q'].strip()
+            city_id = zlib.crc32(name.lower().encode()) % 10_000_000
+        return {'id': city_id, 'name': name, 'coord': {'lat': city_id % 180 - 90.0, 'lon': city_id % 360 - 180.0}}
+
+    @staticmethod
+    def _conditions(seed: int) -> Dict:
+        return {
+            'weather': [{'id': 800, 'main': 'Clear', 'description': 'ясно', 'icon': '01d'}],
+            'main': {'temp': seed % 30 - 5.0, 'feels_like': seed % 30 - 7.0, 'humidity': seed % 100,
+                     'temp_min': seed % 30 - 6.0, 'temp_max': seed % 30 - 4.0, 'pressure': 1013},
+            'wind': {'speed': seed % 10 + 0.5},
+        }
+
+    def _current(self, city: Dict) -> Dict:
+        return {**city, **self._conditions(city['id']), 'cod': 200, 'dt': int(time.time()),
+                'timezone': 10800, 'sys': {'country': 'RU'}}
+
+    async def _weather(self, request: web.Request) -> web.Response:
+        await self._delay('weather')
+        return web.json_response(self._current(self._city(request.query)))
+
+    async def _forecast(self, request: web.Request) -> web.Response:
+        await self._delay('forecast')
+        city = self._city(request.query)
+        start = int(time.time()) // 10800 * 10800 + 10800
+        items = []
+        for i in range(int(request.query.get('cnt', 40))):
+            dt = start + i * 10800
+            items.append({'dt': dt, 'dt_txt': time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(dt)),
+                          **self._conditions(city['id'] + i)})
+        return web.json_response({'cod': '200', 'cnt': len(items), 'list': items,
+                                  'city': {**city, 'timezone': 10800, 'country': 'RU'}})
+
+    async def _group(self, request: web.Request) -> web.Response:
+        await self._delay('group')
+        ids = request.query['id'].split(',')
+        items = []
+        for city_id in ids:
+            item = self._current(self._city({'id': city_id}))
+            # Как в OpenWeatherMap: в ответе group смещение от UTC лежит в sys.timezone
+            item['sys']['timezone'] = item.pop('timezone')
+            del item['cod']
+            items.append(item)
+        return web.json_response({'cnt': len(ids), 'list': items})
+
+
+class FakeTelegram:
+    """Заглушка Bot API: принимает любые методы и отвечает успешно."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self._message_id = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self) -> str:
+        """Запускает сервер и возвращает базовый URL для TelegramAPIServer.from_base."""
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner, url = await _start(app)
+        return url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method in ('sendMessage', 'editMessageText'):
+            self._message_id += 1
+            chat_id = int(params.get('chat_id', 0))
+            result = {
+                'message_id': int(params.get('message_id', self._message_id)),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        else:
+            result = True
+        return web.Response(text=json.dumps({'ok': True, 'result': result}), content_type='application/json')
@@ -0,0 +1,264 @@
+"""
+Нагрузочный тест бота без сети: синтетические обновления подаются в диспетчер `dp`,
+а OpenWeatherMap и Telegram заменены локальными заглушками.
+
+Запуск из каталога Weather_bot:
+    python -m benchmarks.load_test --rate 200 --duration 30 --users 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.append(str(Path(__file__).parent.parent))
+from benchmarks.fake_servers import FakeOpenWeatherMap, FakeTelegram
+
+ADMIN_ID = 1
+CITIES = ['Москва', 'Санкт-Петербург', 'Новосибирск', 'Екатеринбург', 'Казань', 'London', 'Paris',
+          'Berlin', 'Madrid', 'Rome', 'Tokyo', 'New York', 'Минск', 'Алматы', 'Ташкент']
+# Центры городов для запросов по местоположению: точки разбросаны на ±0.25° вокруг центра
+LOCATIONS = [(55.75, 37.62), (59.94, 30.31), (51.51, -0.13), (40.71, -74.01)]
+
+# Сценарии и их доля в потоке обновлений
+SCENARIOS = {
+    'weather': 0.35,
+    'location': 0.10,
+    'forecast': 0.25,
+    'change_city': 0.15,
+    'start': 0.05,
+    'help': 0.10,
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Weather bot с заглушками API")
+    parser.add_argument('--rate', type=float, default=100, help="обновлений в секунду")
+    parser.add_argument('--duration', type=float, default=20, help="длительность теста, сек")
+    parser.add_argument('--users', type=int, default=1000, help="число пользователей в хранилище")
+    parser.add_argument('--storage', choices=['sqlite', 'json', 'snapshot'], default='sqlite', help="бэкенд хранилища")
+    parser.add_argument('--owm-latency', type=float, default=0.15, help="задержка OpenWeatherMap, сек")
+    parser.add_argument('--owm-jitter', type=float, default=0.05, help="разброс задержки OpenWeatherMap, сек")
+    parser.add_argument('--owm-error-rate', type=float, default=0.0, help="доля ошибок OpenWeatherMap")
+    parser.add_argument('--owm-calls-per-minute', type=int, default=1_000_000,
+                        help="квота OpenWeatherMap на ключ в минуту")
+    parser.add_argument('--tg-latency', type=float, default=0.0, help="задержка Telegram API, сек")
+    parser.add_argument('--tg-rate', type=float, default=1000,
+                        help="общий лимит отправки в Telegram, сообщений в секунду (у заглушки лимита нет)")
+    parser.add_argument('--broadcast', action='store_true', help="запустить /broadcast в начале теста")
+    parser.add_argument('--json', action='store_true', help="вывести отчет в JSON")
+    return parser.parse_args()
+
+
+class UpdateFactory:
+    """Создает синтетические обновления Telegram."""
+
+    def __init__(self):
+        self._next_id = 0
+
+    def _ids(self) -> int:
+        self._next_id += 1
+        return self._next_id
+
+    def message(self, user_id: int, text: str):
+        from aiogram.types import Chat, Message, Update, User
+        update_id = self._ids()
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), text=text,
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}")))
+
+    def location(self, user_id: int, latitude: float, longitude: float):
+        from aiogram.types import Chat, Location, Message, Update, User
+        update_id = self._ids()
+        return Update(update_id=update_id, message=Message(
+            message_id=update_id, date=datetime.now(), location=Location(latitude=latitude, longitude=longitude),
+            chat=Chat(id=user_id, type='private'),
+            from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}")))
+
+    def callback(self, user_id: int, data: str):
+        from aiogram.types import CallbackQuery, Chat, Message, Update, User
+        update_id = self._ids()
+        return Update(update_id=update_id, callback_query=CallbackQuery(
+            id=str(update_id), chat_instance=str(user_id), data=data,
+            from_user=User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+            message=Message(message_id=update_id, date=datetime.now(), text='-',
+                            chat=Chat(id=user_id, type='private'))))
+
+
+def count_storage_writes(storage) -> Dict[str, int]:
+    """Оборачивает бэкенд хранилища, чтобы считать число и объем записей."""
+    counters = {'flushes': 0, 'rows': 0, 'bytes': 0}
+    backend = storage.backend
+    save_users = backend.save_users
+
+    def counting_save_users(users, all_users):
+        written = save_users(users, all_users)
+        counters['flushes'] += 1
+        counters['rows'] += len(users)
+        counters['bytes'] += written
+        return written
+
+    backend.save_users = counting_save_users
+    return counters
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    owm = FakeOpenWeatherMap(args.owm_latency, args.owm_jitter, args.owm_error_rate)
+    telegram = FakeTelegram(args.tg_latency)
+    owm_url = await owm.start()
+    telegram_url = await telegram.start()
+
+    data_dir = tempfile.mkdtemp(prefix='weather_bot_bench_')
+    os.environ.update({
+        'BOT_TOKEN': '123456:BENCHMARK',
+        'WEATHER_API_KEY': 'benchmark',
+        'ADMIN_ID': str(ADMIN_ID),
+        'WEATHER_API_BASE_URL': owm_url,
+        'TELEGRAM_API_URL': telegram_url,
+        'DATA_DIR': data_dir,
+        'STORAGE_BACKEND': args.storage,
+        'PREFETCH_ENABLED': '0',
+        'WEATHER_API_CALLS_PER_MINUTE': str(args.owm_calls_per_minute),
+        'TELEGRAM_RATE': str(args.tg_rate),
+    })
+    # Импорт после настройки окружения: конфигурация читается при импорте
+    import bot as bot_module
+    # Ошибки заглушки OpenWeatherMap ожидаемы и считаются в отчете, в лог их не выводим
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    app = bot_module.create_app()
+    storage = bot_module.user_storage
+    storage.load()
+    storage.start_write_behind()
+    for user_id in range(1000, 1000 + args.users):
+        await storage.set_user_language(user_id, random.choice(['ru', 'en']))
+        await storage.set_user_city(user_id, random.choice(CITIES))
+    storage.flush()
+    writes = count_storage_writes(storage)
+
+    factory = UpdateFactory()
+    dp, bot = app.dp, app.bot
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    handled = Counter()
+    errors = Counter()
+
+    async def feed(kind: str, updates) -> None:
+        started = time.perf_counter()
+        try:
+            for update in updates:
+                await dp.feed_update(bot, update)
+        except Exception as e:
+            errors[type(e).__name__] += 1
+        latencies[kind].append(time.perf_counter() - started)
+        handled[kind] += len(updates)
+
+    def scenario(kind: str, user_id: int) -> list:
+        if kind == 'weather':
+            return [factory.message(user_id, '/weather')]
+        if kind == 'location':
+            lat, lon = random.choice(LOCATIONS)
+            return [factory.location(user_id, lat + random.uniform(-0.25, 0.25), lon + random.uniform(-0.25, 0.25))]
+        if kind == 'forecast':
+            return [factory.message(user_id, '/forecast')]
+        if kind == 'help':
+            return [factory.message(user_id, '/help')]
+        if kind == 'change_city':
+            return [factory.message(user_id, '/change_city'), factory.message(user_id, random.choice(CITIES))]
+        if kind == 'start':
+            return [factory.message(user_id, '/start'), factory.callback(user_id, random.choice(['lang_ru', 'lang_en']))]
+        raise ValueError(kind)
+
+    if args.broadcast:
+        await feed('broadcast', [factory.message(ADMIN_ID, '/broadcast Нагрузочный тест')])
+
+    kinds, weights = zip(*SCENARIOS.items())
+    tasks = []
+    interval = 1.0 / args.rate
+    started = time.perf_counter()
+    next_at = started
+    while next_at - started < args.duration:
+        kind = random.choices(kinds, weights)[0]
+        user_id = random.randrange(1000, 1000 + args.users)
+        tasks.append(asyncio.create_task(feed(kind, scenario(kind, user_id))))
+        next_at += interval
+        await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    await app.broadcaster.stop()
+    await storage.stop_write_behind()
+    await bot_module.weather_api.close()
+    await bot.session.close()
+    await owm.stop()
+    await telegram.stop()
+
+    total_updates = sum(handled.values())
+    all_latencies = [value for values in latencies.values() for value in values]
+    return {
+        'updates': total_updates,
+        'updates_per_sec': round(total_updates / elapsed, 1),
+        'latency_ms': {
+            name: {
+                'count': len(values),
+                'p50': round(percentile(values, 0.50) * 1000, 1),
+                'p95': round(percentile(values, 0.95) * 1000, 1),
+                'p99': round(percentile(values, 0.99) * 1000, 1),
+            }
+            for name, values in [('all', all_latencies), *sorted(latencies.items())]
+        },
+        'upstream_calls': dict(owm.calls),
+        'upstream_calls_per_update': round(sum(owm.calls.values()) / max(total_updates, 1), 3),
+        'upstream_errors': owm.errors,
+        'geo_cells': len(bot_module.geo_grid),
+        'quota_rejected': bot_module.weather_api.quota.rejected,
+        'telegram_calls': dict(telegram.calls),
+        'telegram_calls_per_update': round(sum(telegram.calls.values()) / max(total_updates, 1), 3),
+        'storage_writes': writes,
+        'errors': dict(errors),
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"Обновлений: {report['updates']} ({report['updates_per_sec']}/с)")
+    print("Задержка обработки, мс:")
+    for name, values in report['latency_ms'].items():
+        print(f"  {name:<12} n={values['count']:<6} p50={values['p50']:<8} p95={values['p95']:<8} p99={values['p99']}")
+    print(f"Запросов к OpenWeatherMap: {report['upstream_calls']} "
+          f"({report['upstream_calls_per_update']} на обновление, ошибок: {report['upstream_errors']}, "
+          f"отклонено квотой: {report['quota_rejected']})")
+    print(f"Ячеек геосетки с запросами по местоположению: {report['geo_cells']}")
+    print(f"Запросов к Telegram: {sum(report['telegram_calls'].values())} "
+          f"({report['telegram_calls_per_update']} на обновление)")
+    writes = report['storage_writes']
+    print(f"Записи в хранилище: {writes['flushes']} сбросов, {writes['rows']} строк, {writes['bytes']} байт")
+    if report['errors']:
+        print(f"Ошибки: {report['errors']}")
+
+
+def main() -> None:
+    args = parse_args()
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Сравнение представлений пользователей в памяти: прежняя модель (словарь строковых ID со словарями
+пользователей из JSON) и записи UserRecord, загруженные из JSON, SQLite и двоичного снимка.
+Каждая модель загружается в отдельном процессе; измеряются время загрузки и сохранения и прирост RSS
+после загрузки (для загрузки из JSON в него входит и память, оставшаяся от разбора файла).
+
+Запуск из каталога Weather_bot:
+    python -m benchmarks.storage_bench --users 1000000
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+sys.path.append(str(Path(__file__).parent.parent))
+from storage.backends import JSONBackend, SQLiteBackend, SnapshotBackend, atomic_write_json
+
+MODELS = ('dict', 'json', 'sqlite', 'snapshot')
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Память и время загрузки данных пользователей Weather bot")
+    parser.add_argument('--users', type=int, default=1_000_000, help="число пользователей")
+    parser.add_argument('--cities', type=int, default=5000, help="число разных городов")
+    parser.add_argument('--models', default=','.join(MODELS), help=f"модели через запятую: {', '.join(MODELS)}")
+    parser.add_argument('--json', action='store_true', help="вывести отчет в JSON")
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def current_rss() -> Optional[int]:
+    """Текущий RSS процесса в байтах (только Linux)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def generate(directory: str, users: int, cities: int) -> None:
+    """Создает данные пользователей в прежнем формате JSON и те же данные в SQLite и снимке."""
+    rng = random.Random(1)
+    names = [f"Город {i}" for i in range(cities)]
+    data = {}
+    for user_id in range(100_000_000, 100_000_000 + users):
+        city = rng.randrange(cities)
+        user = {'city': names[city], 'city_id': 500_000 + city, 'lat': city % 180 - 90.0 + 0.5,
+                'lon': city % 360 - 180.0 + 0.25, 'language': 'ru' if rng.random() < 0.7 else 'en'}
+        if rng.random() < 0.01:
+            user['banned'] = True
+        if rng.random() < 0.03:
+            user['blocked'] = True
+        if rng.random() < 0.05:
+            user['notify_at'], user['utc_offset'] = '07:00', 10800
+        data[str(user_id)] = user
+    atomic_write_json(os.path.join(directory, 'user_data.json'), data)
+    del data
+    records = JSONBackend(os.path.join(directory, 'user_data.json')).load_users()
+    SnapshotBackend(os.path.join(directory, 'user_data.bin')).save_users(records, records)
+    sqlite = SQLiteBackend(os.path.join(directory, 'user_data.db'))
+    sqlite.save_users(records, records)
+    sqlite.close()
+
+
+def measure(model: str, directory: str) -> Dict:
+    """Загружает и сохраняет данные одной модели (выполняется в отдельном процессе)."""
+    json_path = os.path.join(directory, 'user_data.json')
+    out_dir = tempfile.mkdtemp(dir=directory)
+    gc.collect()
+    rss_before = current_rss()
+    started = time.perf_counter()
+    if model == 'dict':
+        with open(json_path, 'r', encoding='utf-8') as f:
+            users = json.load(f)
+    elif model == 'json':
+        users = JSONBackend(json_path).load_users()
+    elif model == 'sqlite':
+        backend = SQLiteBackend(os.path.join(directory, 'user_data.db'))
+        users = backend.load_users()
+        backend.close()
+    else:
+        users = SnapshotBackend(os.path.join(directory, 'user_data.bin')).load_users()
+    load_seconds = time.perf_counter() - started
+    gc.collect()
+    rss_after = current_rss()
+
+    # SQLite сохраняет только измененных пользователей, полная перезапись для него не показательна
+    save_seconds = None
+    if model != 'sqlite':
+        started = time.perf_counter()
+        if model == 'dict':
+            atomic_write_json(os.path.join(out_dir, 'user_data.json'), users)
+        elif model == 'json':
+            JSONBackend(os.path.join(out_dir, 'user_data.json')).save_users(users, users)
+        else:
+            SnapshotBackend(os.path.join(out_dir, 'user_data.bin')).save_users(users, users)
+        save_seconds = time.perf_counter() - started
+
+    retained = rss_after - rss_before if rss_before is not None and rss_after is not None else None
+    return {
+        'model': model,
+        'users': len(users),
+        'load_seconds': round(load_seconds, 3),
+        'save_seconds': round(save_seconds, 3) if save_seconds is not None else None,
+        'rss_mb': round(rss_after / 2 ** 20, 1) if rss_after is not None else None,
+        'retained_mb': round(retained / 2 ** 20, 1) if retained is not None else None,
+        'bytes_per_user': round(retained / len(users)) if retained is not None and users else None,
+    }
+
+
+def print_report(report: Dict) -> None:
+    print(f"Пользователей: {report['users']}, файлы: JSON {report['sizes_mb']['json']} МБ, "
+          f"SQLite {report['sizes_mb']['sqlite']} МБ, снимок {report['sizes_mb']['snapshot']} МБ")
+    print(f"  {'модель':<10} {'загрузка, с':>12} {'сохранение, с':>14} {'RSS, МБ':>9} "
+          f"{'данные, МБ':>11} {'байт/польз.':>12}")
+    for row in report['models']:
+        save = row['save_seconds'] if row['save_seconds'] is not None else '-'
+        print(f"  {row['model']:<10} {row['load_seconds']:>12} {save:>14} {row['rss_mb']:>9} "
+              f"{row['retained_mb']:>11} {row['bytes_per_user']:>12}")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.child:
+        print(json.dumps(measure(args.child, args.dir)))
+        return
+
+    directory = tempfile.mkdtemp(prefix='weather_bot_storage_bench_')
+    try:
+        generate(directory, args.users, args.cities)
+        sizes = {name: round(os.path.getsize(os.path.join(directory, f"user_data.{ext}")) / 2 ** 20, 1)
+                 for name, ext in (('json', 'json'), ('sqlite', 'db'), ('snapshot', 'bin'))}
+        results = []
+        for model in args.models.split(','):
+            # Отдельный процесс: RSS одной модели не смешивается с остальными
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.storage_bench', '--child', model, '--dir', directory],
+                cwd=str(Path(__file__).parent.parent), capture_output=True, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    report = {'users': args.users, 'sizes_mb': sizes, 'models': results}
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
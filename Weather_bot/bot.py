@@ -1,349 +1,530 @@
+import time
+
+# Отсчет холодного запуска: от начала импорта модулей бота
+STARTED_AT = time.perf_counter()
+
+if __name__ == '__main__':
+    # keys.env читается только при запуске бота и до импорта конфигурации: импорт модуля (тесты,
+    # нагрузочный тест) не обращается к диску, а процессы-обработчики наследуют окружение
+    from config.env import load_env
+    load_env()
+
 import logging
 import asyncio
-from aiogram import Bot, Dispatcher, types, F
+import multiprocessing
+import signal
+from typing import NamedTuple, Optional
+from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
-
-from config.config import BOT_TOKEN, LOG_FILE, LOG_FORMAT, ADMINS
-from storage.storage import user_storage
-from services.weather_api import WeatherAPI
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format=LOG_FORMAT,
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config.config import (
+    BOT_TOKEN, ADMINS, PREFETCH_ENABLED, TELEGRAM_API_URL,
+    BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT,
+    WORKERS, FSM_STORAGE, SHARED_DB_PATH, REDIS_URL, BACKGROUND_JOBS, THROTTLE_ENABLED,
+    METRICS_ENABLED, METRICS_HOST, METRICS_PORT, SUBSCRIPTIONS_ENABLED, STARTUP_BUDGET,
+    missing_settings,
 )
+from storage.fsm import create_fsm_storage
+from storage.storage import UserSettings, user_storage
+from services.weather_api import CityQuery, weather_api
+from services.render import renderer
+from services.throttle import UserThrottler
+from services.geocoding import CityResolver
+from services.geogrid import geo_grid
+from services.broadcast import Broadcaster
+from services.prefetch import Prefetcher
+from services.subscriptions import SubscriptionScheduler, parse_notify_time
+from services.webhook import WebhookServer
+from services.metrics import metrics, MetricsServer, LoopLagMonitor
+from services.logs import setup_logging, update_id_var
+from services.outbound import OutboundLimiter, reply_with_progress
+
 logger = logging.getLogger(__name__)
 
-# Инициализация основных компонентов бота
-bot = Bot(
-    token=BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher(storage=MemoryStorage())
-
-# Локализация текстовых сообщений
-TEXTS = {
-    'ru': {
-        'welcome': "Привет, {name}! Выберите язык:",
-        'language_set': "Язык установлен: Русский",
-        'current_city': "Твой текущий город: <b>{city}</b>",
-        'weather_buttons': "Используй кнопки ниже для работы с ботом.",
-        'ask_city': "Я бот погоды. Для начала скажи, в каком городе ты живешь?\n\nПожалуйста, введите название города:",
-        'weather_request': "⏳ Запрашиваю данные о погоде...",
-        'forecast_request': "⏳ Запрашиваю прогноз погоды...",
-        'no_city': "Сначала укажите город, нажав кнопку 'Сменить город 🏙️'",
-        'weather_error': "Не удалось получить данные о погоде. Попробуйте позже.",
-        'forecast_error': "Не удалось получить прогноз погоды. Попробуйте позже.",
-        'change_city_prompt': "Введите название вашего города:",
-        'city_check': "⏳ Проверяю город...",
-        'city_invalid': "Не удалось найти такой город. Попробуйте еще раз.",
-        'city_saved': "Город <b>{city}</b> сохранен!\nТеперь вы можете узнать погоду.",
-        'help_text': (
-            "📝 <b>Доступные команды:</b>\n\n"
-            "🌤️ <b>Узнать погоду</b> - текущая погода в вашем городе\n"
-            "📅 <b>Прогноз на 4 дня</b> - прогноз погоды на ближайшие дни\n"
-            "🏙️ <b>Сменить город</b> - изменить город для прогноза погоды\n"
-            "🌐 <b>Сменить язык</b> - изменить язык интерфейса\n"
-            "❓ <b>Помощь</b> - показать это сообщение\n\n"
-            "Вы также можете использовать команды:\n"
-            "/weather, /forecast, /change_city, /change_language, /help\n"
-        ),
-        'admin_help': (
-            "\n<b>Админские команды:</b>\n\n"
-            "/stats - статистика бота\n"
-            "/ban (user_id) - заблокировать пользователя\n"
-            "/unban (user_id) - разблокировать пользователя\n"
-            "/broadcast (сообщение) - рассылка всем пользователям\n"
-        ),
-        'buttons': {
-            'weather': "Узнать погоду 🌤️",
-            'forecast': "Прогноз на 4 дня 📅",
-            'change_city': "Сменить город 🏙️",
-            'change_language': "Сменить язык 🌐",
-            'help': "Помощь ❓"
-        }
-    },
-    'en': {
-        'welcome': "Hello, {name}! Choose your language:",
-        'language_set': "Language set to: English",
-        'current_city': "Your current city: <b>{city}</b>",
-        'weather_buttons': "Use the buttons below to interact with the bot.",
-        'ask_city': "I'm a weather bot. First, tell me what city you live in?\n\nPlease enter your city name:",
-        'weather_request': "⏳ Requesting weather data...",
-        'forecast_request': "⏳ Requesting weather forecast...",
-        'no_city': "Please set your city first by clicking 'Change city 🏙️'",
-        'weather_error': "Failed to get weather data. Please try again later.",
-        'forecast_error': "Failed to get weather forecast. Please try again later.",
-        'change_city_prompt': "Enter your city name:",
-        'city_check': "⏳ Checking city...",
-        'city_invalid': "Couldn't find this city. Please try again.",
-        'city_saved': "City <b>{city}</b> saved!\nNow you can check the weather.",
-        'help_text': (
-            "📝 <b>Available commands:</b>\n\n"
-            "🌤️ <b>Get weather</b> - current weather in your city\n"
-            "📅 <b>4-day forecast</b> - weather forecast for upcoming days\n"
-            "🏙️ <b>Change city</b> - change city for weather forecast\n"
-            "🌐 <b>Change language</b> - change interface language\n"
-            "❓ <b>Help</b> - show this message\n\n"
-            "You can also use commands:\n"
-            "/weather, /forecast, /change_city, /change_language, /help"
-        ),
-        'admin_help': (
-            "\n\n<b>Admin commands:</b>\n"
-            "/stats - bot statistics\n"
-            "/ban (user_id) - ban user\n"
-            "/unban (user_id) - unban user\n"
-            "/broadcast (message) - send message to all users"
-        ),
-        'buttons': {
-            'weather': "Get weather 🌤️",
-            'forecast': "4-day forecast 📅",
-            'change_city': "Change city 🏙️",
-            'change_language': "Change language 🌐",
-            'help': "Help ❓"
-        }
-    }
-}
+# Импорт модуля ничего не запускает: обработчики регистрируются в роутере,
+# а бот, диспетчер и фоновые сервисы создаются в create_app()
+router = Router(name='weather_bot')
+city_resolver = CityResolver(weather_api)
+throttler = UserThrottler()
+loop_lag = LoopLagMonitor(metrics)
+
+# Метрики обработчиков и запросов к Telegram
+HANDLER_SECONDS = metrics.histogram('bot_handler_seconds', 'Длительность обработки сообщений и нажатий', ['handler'])
+HANDLER_ERRORS = metrics.counter('bot_handler_errors_total', 'Ошибок в обработчиках', ['handler'])
+TELEGRAM_SECONDS = metrics.histogram('telegram_request_seconds', 'Длительность запросов к Telegram Bot API', ['method'])
+TELEGRAM_REQUESTS = metrics.counter('telegram_requests_total', 'Запросов к Telegram Bot API по результату',
+                                    ['method', 'status'])
+metrics.callback('render_cache_hits_total', 'Ответов, взятых из кэша отформатированных текстов', 'counter',
+                 lambda: {(name,): cache['hits'] for name, cache in renderer.get_cache_stats().items()}, ['cache'])
+metrics.callback('throttle_rejected_total', 'Запросов, отклоненных ограничителем частоты', 'counter',
+                 lambda: {(action,): count for action, count in throttler.counts.items()}, ['action'])
+metrics.callback('throttle_users', 'Пользователей в памяти ограничителя частоты', 'gauge', lambda: len(throttler))
+STARTUP_SECONDS = metrics.gauge('bot_startup_seconds', 'Время от начала запуска до этапа', ['phase'])
+
 
 # Состояния FSM
 class WeatherStates(StatesGroup):
     """Состояния конечного автомата для бота."""
     waiting_for_city = State()
     waiting_for_language = State()
+    waiting_for_subscription_time = State()
+
+
+async def get_city_query(user_id: int, settings: UserSettings) -> CityQuery:
+    """
+    Возвращает ID города пользователя для запросов к API. Для городов, сохраненных
+    до появления ID, город определяется один раз и ID сохраняется.
+    """
+    if settings.city_id is not None:
+        return settings.city_id
+    resolved = await city_resolver.resolve(settings.city, settings.language)
+    if resolved is None:
+        return settings.city
+    await user_storage.set_user_city(user_id, settings.city, resolved['id'], resolved['lat'], resolved['lon'])
+    return resolved['id']
+
+
+# Внешний middleware обновлений: ID обновления попадает во все записи лога, сделанные при его обработке
+# (и в задачах, созданных обработчиками). Подключается в create_app
+async def correlation_middleware(handler, event, data):
+    token = update_id_var.set(event.update_id)
+    try:
+        return await handler(event, data)
+    finally:
+        update_id_var.reset(token)
 
 
-# Создание клавиатуры
-def get_main_keyboard(lang: str = 'ru'):
-    texts = TEXTS[lang]['buttons']
-    return ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text=texts['weather']), KeyboardButton(text=texts['forecast'])],
-            [KeyboardButton(text=texts['change_city']), KeyboardButton(text=texts['change_language'])],
-            [KeyboardButton(text=texts['help'])]
-        ],
-        resize_keyboard=True
-    )
+# Middleware метрик: регистрируется первым, поэтому учитывает время всех остальных middleware
+@router.message.middleware()
+@router.callback_query.middleware()
+async def metrics_middleware(handler, event, data):
+    name = data['handler'].callback.__name__
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    except Exception:
+        HANDLER_ERRORS.labels(name).inc()
+        raise
+    finally:
+        HANDLER_SECONDS.labels(name).observe(time.perf_counter() - started)
+
+
+# Middleware сессии: длительность и результат каждого запроса к Telegram (подключается в create_app)
+async def telegram_metrics_middleware(make_request, bot, method):
+    name = type(method).__name__
+    status = 'ok'
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    except Exception as e:
+        status = type(e).__name__
+        raise
+    finally:
+        TELEGRAM_SECONDS.labels(name).observe(time.perf_counter() - started)
+        TELEGRAM_REQUESTS.labels(name, status).inc()
+
+
+def format_latency(metric_name: str, *labels) -> str:
+    """Медиана и 95-й процентиль гистограммы длительностей для /stats."""
+    histogram = metrics.get(metric_name)
+    p50, p95 = histogram.quantile(0.5, *labels), histogram.quantile(0.95, *labels)
+    if p50 is None:
+        return "нет данных"
+    return f"p50 {p50 * 1000:.0f} мс, p95 {p95 * 1000:.0f} мс"
+
+
+# Middleware для проверки бана (для сообщений и нажатий inline-кнопок).
+# Заодно передает обработчикам настройки пользователя в аргументе user_settings.
+@router.message.middleware()
+@router.callback_query.middleware()
+async def check_ban_middleware(handler, event, data):
+    if event.from_user is None:
+        return await handler(event, data)
+    user_id = event.from_user.id
+    # Пока пользователи загружаются в фоне, данные этого пользователя подгружаются отдельно
+    await user_storage.ensure_user(user_id)
+    if user_id in user_storage.banned_users:
+        lang = user_storage.get_user_settings(user_id).language
+        await event.answer(renderer.text(lang, 'banned'))
+        return
+    settings = user_storage.get_user_settings(user_id)
+    if settings.blocked:
+        # Пользователь снова пишет боту, значит, разблокировал его
+        await user_storage.set_user_blocked(user_id, False)
+    data['user_settings'] = settings
+    return await handler(event, data)
 
 
-def get_language_keyboard():
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
-            [InlineKeyboardButton(text="Русский", callback_data="lang_ru"),
-             InlineKeyboardButton(text="English", callback_data="lang_en")]
-        ]
-    )
+# Типы команд с отдельными лимитами частоты (все остальное - 'default')
+THROTTLE_KINDS = {text: kind for kind in ('weather', 'forecast')
+                  for text in renderer.button_texts(kind, f"/{kind}")}
 
 
-# Middleware для проверки бана
-@dp.message.middleware()
-async def check_ban_middleware(handler, event, data):
+# Middleware ограничения частоты запросов: регистрируется после проверки бана,
+# поэтому заблокированные пользователи до него не доходят
+@router.message.middleware()
+@router.callback_query.middleware()
+async def throttle_middleware(handler, event, data):
+    if not THROTTLE_ENABLED or event.from_user is None or event.from_user.id in ADMINS:
+        return await handler(event, data)
     user_id = event.from_user.id
-    if user_storage.is_banned(user_id):
-        lang = user_storage.get_user_language(user_id)
-        await event.answer(
-            "🚫 Вы заблокированы и не можете использовать бота" if lang == 'ru' else "🚫 You are banned and cannot use the bot")
-        return
-    return await handler(event, data)
+    if isinstance(event, types.CallbackQuery):
+        kind, key = 'default', ('callback', event.data)
+    elif event.location is not None:
+        # Погода по местоположению стоит запроса к API, как и кнопка погоды
+        kind, key = 'weather', ('location', round(event.location.latitude, 3), round(event.location.longitude, 3))
+    else:
+        kind, key = THROTTLE_KINDS.get(event.text, 'default'), ('message', event.text)
+    decision = throttler.check(user_id, kind, key)
+    if decision.action == throttler.ALLOW:
+        return await handler(event, data)
+    lang = data['user_settings'].language
+    if decision.action == throttler.BAN:
+        logger.warning(f"Пользователь {user_id} автоматически заблокирован за флуд")
+        await user_storage.ban_user(user_id)
+        await event.answer(renderer.text(lang, 'banned'))
+    elif decision.action == throttler.WARN:
+        await event.answer(renderer.text(lang, 'throttled', seconds=max(1, round(decision.retry_after))))
+    elif isinstance(event, types.CallbackQuery):
+        # Без ответа у пользователя будет крутиться индикатор загрузки на кнопке
+        await event.answer()
 
 
 # Команда /start
-@dp.message(Command("start"))
+@router.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     await message.answer(
-        TEXTS['ru']['welcome'].format(name=message.from_user.first_name),
-        reply_markup=get_language_keyboard()
+        renderer.text(renderer.default_language, 'welcome', name=message.from_user.first_name),
+        reply_markup=renderer.language_keyboard
     )
     await state.set_state(WeatherStates.waiting_for_language)
 
 
 
 # Обработка выбора языка
-@dp.callback_query(F.data.startswith("lang_"))
-async def set_language(callback: types.CallbackQuery, state: FSMContext):
+@router.callback_query(F.data.startswith("lang_"))
+async def set_language(callback: types.CallbackQuery, state: FSMContext, user_settings: UserSettings):
     lang = callback.data.split("_")[1]
     user_id = callback.from_user.id
-    user_storage.set_user_language(user_id, lang)
+    await user_storage.set_user_language(user_id, lang)
 
     await callback.message.edit_text(
-        TEXTS[lang]['language_set']
+        renderer.text(lang, 'language_set')
     )
 
-    city = user_storage.get_user_city(user_id)
+    city = user_settings.city
     if city:
         await callback.message.answer(
-            f"{TEXTS[lang]['current_city'].format(city=city)}\n"
-            f"{TEXTS[lang]['weather_buttons']}",
-            reply_markup=get_main_keyboard(lang)
+            f"{renderer.text(lang, 'current_city', city=city)}\n"
+            f"{renderer.text(lang, 'weather_buttons')}",
+            reply_markup=renderer.main_keyboard(lang)
         )
     else:
         await callback.message.answer(
-            TEXTS[lang]['ask_city'],
-            reply_markup=types.ReplyKeyboardRemove()
+            renderer.text(lang, 'ask_city'),
+            reply_markup=renderer.location_keyboard(lang)
         )
         await state.set_state(WeatherStates.waiting_for_city)
     await callback.answer()
 
 
 # Команда смены языка
-@dp.message(F.text.in_(
-    [TEXTS['ru']['buttons']['change_language'], TEXTS['en']['buttons']['change_language'], "/change_language"]))
-async def change_language(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    current_lang = user_storage.get_user_language(user_id)
+@router.message(F.text.in_(renderer.button_texts('change_language', "/change_language")))
+async def change_language(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    current_lang = user_settings.language
 
     await message.answer(
-        TEXTS[current_lang]['welcome'].format(name=message.from_user.first_name),
-        reply_markup=get_language_keyboard()
+        renderer.text(current_lang, 'welcome', name=message.from_user.first_name),
+        reply_markup=renderer.language_keyboard
     )
     await state.set_state(WeatherStates.waiting_for_language)
 
 
 # Обработка текстовых сообщений (кнопок)
-@dp.message(F.text.in_([TEXTS['ru']['buttons']['weather'], TEXTS['en']['buttons']['weather'], "/weather"]))
-async def get_weather(message: types.Message):
+@router.message(F.text.in_(renderer.button_texts('weather', "/weather")))
+async def get_weather(message: types.Message, user_settings: UserSettings):
     user_id = message.from_user.id
-    city = user_storage.get_user_city(user_id)
-    lang = user_storage.get_user_language(user_id)
+    lang = user_settings.language
 
-    if not city:
-        await message.answer(TEXTS[lang]['no_city'])
+    if not user_settings.city:
+        await message.answer(renderer.text(lang, 'no_city'))
         return
 
     user_storage.increment_stat('weather_requests')
-    await message.answer(TEXTS[lang]['weather_request'])
 
-    weather_data = WeatherAPI.get_weather(city, lang)
-    if weather_data:
-        await message.answer(WeatherAPI.format_weather(weather_data, lang))
-    else:
-        await message.answer(TEXTS[lang]['weather_error'])
+    async def answer() -> str:
+        weather_data = await weather_api.get_weather(await get_city_query(user_id, user_settings), lang)
+        return renderer.weather(weather_data, lang) if weather_data else renderer.text(lang, 'weather_error')
+
+    # Ответ из кэша - одно сообщение; при медленном API сообщение «Запрашиваю...» заменяется ответом
+    await reply_with_progress(message, answer(), renderer.text(lang, 'weather_request'))
 
 
-@dp.message(F.text.in_([TEXTS['ru']['buttons']['forecast'], TEXTS['en']['buttons']['forecast'], "/forecast"]))
-async def get_forecast(message: types.Message):
+@router.message(F.text.in_(renderer.button_texts('forecast', "/forecast")))
+async def get_forecast(message: types.Message, user_settings: UserSettings):
     user_id = message.from_user.id
-    city = user_storage.get_user_city(user_id)
-    lang = user_storage.get_user_language(user_id)
+    lang = user_settings.language
 
-    if not city:
-        await message.answer(TEXTS[lang]['no_city'])
+    if not user_settings.city:
+        await message.answer(renderer.text(lang, 'no_city'))
         return
 
     user_storage.increment_stat('forecast_requests')
-    await message.answer(TEXTS[lang]['forecast_request'])
 
-    forecast_data = WeatherAPI.get_forecast(city, lang)
-    if forecast_data:
-        await message.answer(WeatherAPI.format_forecast(forecast_data, lang))
-    else:
-        await message.answer(TEXTS[lang]['forecast_error'])
+    async def answer() -> str:
+        forecast_data = await weather_api.get_forecast(await get_city_query(user_id, user_settings), lang)
+        return renderer.forecast(forecast_data, lang) if forecast_data else renderer.text(lang, 'forecast_error')
 
+    await reply_with_progress(message, answer(), renderer.text(lang, 'forecast_request'))
 
-@dp.message(F.text.in_([TEXTS['ru']['buttons']['change_city'], TEXTS['en']['buttons']['change_city'], "/change_city"]))
-async def change_city(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    lang = user_storage.get_user_language(user_id)
+
+@router.message(F.text.in_(renderer.button_texts('change_city', "/change_city")))
+async def change_city(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    lang = user_settings.language
 
     await message.answer(
-        TEXTS[lang]['change_city_prompt'],
-        reply_markup=types.ReplyKeyboardRemove()
+        renderer.text(lang, 'change_city_prompt'),
+        reply_markup=renderer.location_keyboard(lang)
     )
     await state.set_state(WeatherStates.waiting_for_city)
 
 
-@dp.message(F.text.in_([TEXTS['ru']['buttons']['help'], TEXTS['en']['buttons']['help'], "/help"]))
-async def show_help(message: types.Message):
+@router.message(F.text.in_(renderer.button_texts('help', "/help")))
+async def show_help(message: types.Message, user_settings: UserSettings):
     user_id = message.from_user.id
-    lang = user_storage.get_user_language(user_id)
+    lang = user_settings.language
 
-    help_text = TEXTS[lang]['help_text']
+    help_text = renderer.text(lang, 'help_text')
     if user_id in ADMINS:
-        help_text += TEXTS[lang]['admin_help']
+        help_text += renderer.text(lang, 'admin_help')
 
     await message.answer(
         help_text,
-        reply_markup=get_main_keyboard(lang)
+        reply_markup=renderer.main_keyboard(lang)
+    )
+
+async def save_subscription(user_id: int, settings: UserSettings, notify_at: Optional[str]) -> str:
+    """
+    Сохраняет время ежедневной рассылки (None - отписка) и возвращает ответ пользователю.
+    Время задается по часовому поясу города, поэтому смещение от UTC берется из погоды города.
+    """
+    lang = settings.language
+    if notify_at is None:
+        await user_storage.set_user_subscription(user_id, None)
+        return renderer.text(lang, 'subscription_off')
+    weather_data = await weather_api.get_weather(await get_city_query(user_id, settings), lang)
+    if not weather_data or 'timezone' not in weather_data:
+        return renderer.text(lang, 'subscription_error')
+    await user_storage.set_user_subscription(user_id, notify_at, weather_data['timezone'])
+    return renderer.text(lang, 'subscription_set', time=notify_at)
+
+
+@router.message(F.text.in_(renderer.button_texts('subscription', "/subscribe")))
+async def subscription_menu(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    lang = user_settings.language
+
+    if not user_settings.city:
+        await message.answer(renderer.text(lang, 'no_city'))
+        return
+
+    notify_at = user_storage.get_user_subscription(message.from_user.id)
+    status = (renderer.text(lang, 'subscription_status_on', time=notify_at) if notify_at
+              else renderer.text(lang, 'subscription_status_off'))
+    await message.answer(
+        renderer.text(lang, 'subscription_prompt', status=status),
+        reply_markup=renderer.subscription_keyboard(lang)
+    )
+    await state.set_state(WeatherStates.waiting_for_subscription_time)
+
+
+@router.message(Command("unsubscribe"))
+async def cmd_unsubscribe(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    await state.clear()
+    await message.answer(
+        await save_subscription(message.from_user.id, user_settings, None),
+        reply_markup=renderer.main_keyboard(user_settings.language)
+    )
+
+
+# Обработка выбора времени рассылки кнопкой
+@router.callback_query(F.data.startswith("sub_"))
+async def set_subscription(callback: types.CallbackQuery, state: FSMContext, user_settings: UserSettings):
+    value = callback.data[len("sub_"):]
+    notify_at = None if value == "off" else parse_notify_time(value)
+    if notify_at is None and value != "off":
+        await callback.answer()
+        return
+    await state.clear()
+    await callback.message.edit_text(await save_subscription(callback.from_user.id, user_settings, notify_at))
+    await callback.answer()
+
+
+async def save_city(message: types.Message, state: FSMContext, lang: str,
+                    city: str, city_id: int, lat: float, lon: float) -> None:
+    """Сохраняет город пользователя, введенный названием или определенный по местоположению."""
+    user_id = message.from_user.id
+    await user_storage.set_user_city(user_id, city, city_id, lat, lon)
+    await state.clear()
+    await message.answer(
+        renderer.text(lang, 'city_saved', city=city),
+        reply_markup=renderer.main_keyboard(lang)
     )
+    notify_at = user_storage.get_user_subscription(user_id)
+    if notify_at:
+        # Рассылка идет по местному времени: у нового города может быть другой часовой пояс
+        await save_subscription(user_id, user_storage.get_user_settings(user_id), notify_at)
+
+
+# Погода по местоположению (кнопка «Погода рядом»). При вводе города (или если город еще
+# не задан) местоположение заменяет название: городом становится ближайший к центру ячейки.
+# Регистрируется до process_city, который ждет текст
+@router.message(F.location)
+async def process_location(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    lang = user_settings.language
+    # Соседние пользователи попадают в одну ячейку геосетки и получают один ответ API
+    cell = geo_grid.cell(message.location.latitude, message.location.longitude)
+    geo_grid.record(cell, lang)
+
+    if user_settings.city and await state.get_state() != WeatherStates.waiting_for_city.state:
+        user_storage.increment_stat('weather_requests')
+
+        async def answer() -> str:
+            weather_data = await weather_api.get_weather(cell, lang)
+            return renderer.weather(weather_data, lang) if weather_data else renderer.text(lang, 'weather_error')
+
+        await reply_with_progress(message, answer(), renderer.text(lang, 'weather_request'))
+        return
+
+    weather_data = await weather_api.get_weather(cell, lang)
+    if not weather_data or not weather_data.get('id') or not weather_data.get('name'):
+        await message.answer(renderer.text(lang, 'location_invalid'))
+        return
+    await save_city(message, state, lang, weather_data['name'], weather_data['id'], *cell)
+
 
 # Обработка ввода города
-@dp.message(WeatherStates.waiting_for_city)
-async def process_city(message: types.Message, state: FSMContext):
+@router.message(WeatherStates.waiting_for_city, F.text)
+async def process_city(message: types.Message, state: FSMContext, user_settings: UserSettings):
     city = message.text.strip()
-    user_id = message.from_user.id
-    lang = user_storage.get_user_language(user_id)
+    lang = user_settings.language
 
     if len(city) < 2:
-        await message.answer(TEXTS[lang]['city_invalid'])
+        await message.answer(renderer.text(lang, 'city_invalid'))
         return
 
-    await message.answer(TEXTS[lang]['city_check'])
+    if await city_resolver.lookup(city) is None:
+        # Проверка через API может занять время; город из индекса проверяется мгновенно
+        await message.answer(renderer.text(lang, 'city_check'))
 
-    weather_data = WeatherAPI.get_weather(city, lang)
-    if not weather_data or 'cod' not in weather_data or weather_data['cod'] != 200:
-        await message.answer(TEXTS[lang]['city_invalid'])
+    resolved = await city_resolver.resolve(city, lang)
+    if resolved is None:
+        await message.answer(renderer.text(lang, 'city_invalid'))
+        return
+
+    await save_city(message, state, lang, resolved['name'], resolved['id'], resolved['lat'], resolved['lon'])
+
+
+# Обработка ввода времени рассылки
+@router.message(WeatherStates.waiting_for_subscription_time)
+async def process_subscription_time(message: types.Message, state: FSMContext, user_settings: UserSettings):
+    lang = user_settings.language
+    notify_at = parse_notify_time(message.text)
+    if notify_at is None:
+        await message.answer(renderer.text(lang, 'subscription_invalid'))
         return
 
-    user_storage.set_user_city(user_id, city)
     await state.clear()
     await message.answer(
-        TEXTS[lang]['city_saved'].format(city=city),
-        reply_markup=get_main_keyboard(lang)
+        await save_subscription(message.from_user.id, user_settings, notify_at),
+        reply_markup=renderer.main_keyboard(lang)
     )
 
 
 # Админ-команды
-@dp.message(Command("stats"))
+@router.message(Command("stats"))
 async def cmd_stats(message: types.Message):
     if message.from_user.id not in ADMINS:
         return
 
     stats = user_storage.get_stats()
+    rates = user_storage.get_stat_rates()
+    cache = weather_api.get_cache_stats()
+    rendered = renderer.get_cache_stats()
+    throttled = throttler.get_stats()
+    quota_lines = "\n".join(
+        f"  {key['key']}: запросов {key['calls']}, осталось в минуту {key['minute_left']}, за сутки {key['day_used']}"
+        + (f" (осталось {key['day_left']})" if key['day_left'] is not None else "")
+        for key in cache['quota']['keys']
+    )
     await message.answer(
         f"📊 Статистика бота:\n\n"
         f"👥 Всего пользователей: {stats['total_users']}\n"
         f"🟢 Активных пользователей: {stats['active_users']}\n"
+        f"🔔 Подписчиков ежедневной рассылки: {stats['subscribers']}\n"
         f"🌤️ Запросов погоды: {stats['weather_requests']}\n"
-        f"📅 Запросов прогноза: {stats['forecast_requests']}"
+        f"📅 Запросов прогноза: {stats['forecast_requests']}\n"
+        f"⏱ Погода за минуту/час/сутки: "
+        f"{rates['weather_requests']['minute']}/{rates['weather_requests']['hour']}/{rates['weather_requests']['day']}\n"
+        f"⏱ Прогноз за минуту/час/сутки: "
+        f"{rates['forecast_requests']['minute']}/{rates['forecast_requests']['hour']}/{rates['forecast_requests']['day']}\n\n"
+        f"🗄 Кэш погоды: {cache['weather']['hits']} попаданий / {cache['weather']['misses']} промахов "
+        f"({cache['weather']['size']} записей)\n"
+        f"🗄 Кэш прогноза: {cache['forecast']['hits']} попаданий / {cache['forecast']['misses']} промахов "
+        f"({cache['forecast']['size']} записей)\n"
+        f"🔗 Объединено одновременных запросов: {cache['inflight']['shared']}\n"
+        f"📍 Ячеек геосетки с запросами погоды по местоположению: {len(geo_grid)}\n"
+        f"📝 Готовых ответов из кэша: {rendered['weather']['hits'] + rendered['forecast']['hits']}\n"
+        f"🛡 OpenWeatherMap: {cache['upstream']['state']}, размыканий: {cache['upstream']['opened']}, "
+        f"повторов: {cache['upstream']['retries']}, устаревших ответов: {cache['upstream']['stale_served']}\n"
+        f"🔑 Квота API (отклонено запросов: {cache['quota']['rejected']}):\n{quota_lines}\n"
+        f"🚦 Ограничение частоты: повторов {throttled['duplicate']}, предупреждений {throttled['warn']}, "
+        f"отброшено {throttled['drop']}, автобанов {throttled['ban']}\n\n"
+        f"⏲ Обработчики: {format_latency('bot_handler_seconds')}\n"
+        f"⏲ OpenWeatherMap погода: {format_latency('weather_api_request_seconds', 'weather')}\n"
+        f"⏲ OpenWeatherMap прогноз: {format_latency('weather_api_request_seconds', 'forecast')}\n"
+        f"⏲ Telegram: {format_latency('telegram_request_seconds')}\n"
+        f"⏲ Ожидание лимита отправки: ответы {format_latency('telegram_outbound_wait_seconds', 'interactive')}, "
+        f"рассылки {format_latency('telegram_outbound_wait_seconds', 'bulk')}\n"
+        f"⏲ Сохранение пользователей: {format_latency('storage_flush_seconds', 'users')}\n"
+        f"⏲ Задержка цикла событий: {format_latency('event_loop_lag_seconds')}, "
+        f"максимум {loop_lag.max_lag * 1000:.0f} мс"
     )
 
 
-@dp.message(Command("ban"))
+@router.message(Command("ban"))
 async def cmd_ban(message: types.Message):
     if message.from_user.id not in ADMINS:
         return
 
     try:
         user_id = int(message.text.split()[1])
-        user_storage.ban_user(user_id)
+        await user_storage.ban_user(user_id)
         await message.answer(f"✅ Пользователь {user_id} заблокирован")
     except (IndexError, ValueError):
         await message.answer("Использование: /ban <user_id>")
 
 
-@dp.message(Command("unban"))
+@router.message(Command("unban"))
 async def cmd_unban(message: types.Message):
     if message.from_user.id not in ADMINS:
         return
 
     try:
         user_id = int(message.text.split()[1])
-        user_storage.unban_user(user_id)
+        await user_storage.unban_user(user_id)
         await message.answer(f"✅ Пользователь {user_id} разблокирован")
     except (IndexError, ValueError):
         await message.answer("Использование: /unban <user_id>")
 
 
-@dp.message(Command("broadcast"))
-async def cmd_broadcast(message: types.Message):
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: types.Message, broadcaster: Broadcaster):
     if message.from_user.id not in ADMINS:
         return
 
@@ -353,37 +534,214 @@ async def cmd_broadcast(message: types.Message):
 
 
     broadcast_text = ' '.join(message.text.split()[1:])
-    users = user_storage.data.keys()
-    success = 0
-    failed = 0
+    if not broadcaster.start(broadcast_text, message.chat.id):
+        await message.answer("⏳ Предыдущая рассылка еще не завершена")
+
+
+# Создание приложения
+class StartupTimer:
+    """Время этапов холодного запуска от STARTED_AT; итог пишется в лог и в метрику bot_startup_seconds."""
+
+    def __init__(self, budget: float = STARTUP_BUDGET):
+        self.budget = budget
+        self.phases = {}
+        self.mark('imports')
+
+    def mark(self, phase: str) -> float:
+        seconds = time.perf_counter() - STARTED_AT
+        self.phases[phase] = seconds
+        STARTUP_SECONDS.labels(phase).set(seconds)
+        return seconds
+
+    async def report_ready(self) -> None:
+        """Отмечает готовность принимать обновления и сравнивает время запуска с бюджетом."""
+        ready = self.mark('ready')
+        phases = ", ".join(f"{phase} {seconds:.2f} с" for phase, seconds in self.phases.items())
+        if ready > self.budget:
+            logger.warning(f"Холодный запуск {ready:.2f} с превысил бюджет {self.budget:.1f} с ({phases})")
+        else:
+            logger.info(f"Холодный запуск {ready:.2f} с, бюджет {self.budget:.1f} с ({phases})")
+
+    async def report_loaded(self) -> None:
+        """Ждет окончания фоновой загрузки пользователей и пишет ее время в лог."""
+        await user_storage.wait_loaded()
+        loaded = self.mark('users_loaded')
+        logger.info(f"Данные пользователей загружены через {loaded:.2f} с после запуска "
+                    f"(загрузка {user_storage.load_seconds:.2f} с, пользователей: {len(user_storage.data)})")
+
+
+class App(NamedTuple):
+    """Компоненты запущенного бота."""
+    bot: Bot
+    dp: Dispatcher
+    broadcaster: Broadcaster
+    prefetcher: Prefetcher
+    subscriptions: SubscriptionScheduler
+
+
+def create_app() -> App:
+    """
+    Создает бота, диспетчер и фоновые сервисы. Данные пользователей здесь не загружаются:
+    main() загружает их в фоне, пока бот уже принимает обновления.
+    """
+    missing = missing_settings()
+    if missing:
+        raise RuntimeError(f"Не заданы обязательные настройки: {', '.join(missing)}")
+    bot = Bot(
+        token=BOT_TOKEN,
+        session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    # Ограничитель отправки подключается первым: время ожидания лимита не входит в длительность запросов
+    outbound = OutboundLimiter()
+    outbound.install(bot)
+    bot.session.middleware(telegram_metrics_middleware)
+    dp = Dispatcher(storage=create_fsm_storage(FSM_STORAGE, SHARED_DB_PATH, REDIS_URL))
+    dp.update.outer_middleware(correlation_middleware)
+    dp.include_router(router)
+    broadcaster = Broadcaster(bot, user_storage, limiter=outbound)
+    # Обработчики получают рассыльщика аргументом broadcaster
+    dp['broadcaster'] = broadcaster
+    return App(bot, dp, broadcaster, Prefetcher(weather_api, user_storage, geo_grid),
+               SubscriptionScheduler(weather_api, user_storage, broadcaster))
 
-    await message.answer(f"⏳ Рассылка начата для {len(users)} пользователей...")
 
-    for user_id in users:
+# Запуск бота
+async def run_webhook(app: App, worker: int = 0):
+    """
+    Принимает обновления через webhook до получения сигнала остановки.
+
+    Args:
+        app: Компоненты бота.
+        worker: Номер процесса бота; адрес webhook регистрирует только процесс 0.
+    """
+    bot, dp = app.bot, app.dp
+    server = WebhookServer(dp, bot)
+    metrics.callback('webhook_queue_size', 'Обновлений в очереди webhook', 'gauge', lambda: server.queue.qsize())
+    metrics.callback('webhook_rejected_total', 'Обновлений, отклоненных из-за переполнения очереди', 'counter',
+                     lambda: server.rejected)
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
         try:
-            await bot.send_message(user_id, broadcast_text)
-            success += 1
-        except Exception as e:
-            logger.error(f"Ошибка при рассылке для {user_id}: {e}")
-            failed += 1
-        await asyncio.sleep(0.1)
-
-    await message.answer(
-        f"✅ Рассылка завершена:\n"
-        f"Успешно: {success}\n"
-        f"Не удалось: {failed}"
-    )
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    await dp.emit_startup(bot=bot)
+    await server.start(WEBHOOK_HOST, WEBHOOK_PORT, reuse_port=WORKERS > 1)
+    if worker == 0:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await dp.emit_shutdown(bot=bot)
+        await bot.session.close()
+
+
+async def start_background_jobs(app: App) -> None:
+    """Запускает фоновые задачи после загрузки пользователей: им нужны данные всех пользователей."""
+    await user_storage.wait_loaded()
+    app.broadcaster.resume()
+    if PREFETCH_ENABLED:
+        app.prefetcher.start()
+    if SUBSCRIPTIONS_ENABLED:
+        app.subscriptions.start()
+
+
+async def main(worker: int = 0):
+    startup = StartupTimer()
+    app = create_app()
+    startup.mark('app')
+    # Фоновые задачи выполняет только один процесс, иначе они дублировались бы в каждом
+    background = BACKGROUND_JOBS and worker == 0
+    metrics_server = MetricsServer(metrics)
+    if METRICS_ENABLED:
+        # У каждого процесса бота свой порт метрик
+        await metrics_server.start(METRICS_HOST, METRICS_PORT + worker)
+        loop_lag.start()
+    user_storage.start_loading()
+    user_storage.start_write_behind()
+    startup.mark('storage_open')
+    # Офлайн-список городов может быть большим: читаем его в потоке, не задерживая запуск
+    city_resolver.start_loading()
+    tasks = [asyncio.create_task(startup.report_loaded())]
+    if background:
+        tasks.append(asyncio.create_task(start_background_jobs(app)))
+    app.dp.startup.register(startup.report_ready)
+    serving = asyncio.create_task(run_webhook(app, worker) if BOT_MODE == 'webhook'
+                                  else app.dp.start_polling(app.bot))
+    try:
+        # Без данных пользователей бот работать не может: при ошибке загрузки останавливаемся
+        await asyncio.wait((serving, tasks[0]), return_when=asyncio.FIRST_EXCEPTION)
+        if not serving.done():
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+            tasks[0].result()
+        serving.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await app.prefetcher.stop()
+        await app.subscriptions.stop()
+        await app.broadcaster.stop()
+        await user_storage.stop_write_behind()
+        await weather_api.close()
+        await city_resolver.flush()
+        user_storage.close()
+        await loop_lag.stop()
+        await metrics_server.stop()
+
+
+def run_worker(worker: int) -> None:
+    """Точка входа процесса бота при запуске нескольких процессов."""
+    setup_logging()
+    try:
+        asyncio.run(main(worker))
+    except KeyboardInterrupt:
+        pass
 
 
-# Запуск бота
-async def main():
-    await dp.start_polling(bot)
+def run_workers() -> None:
+    """Запускает WORKERS процессов, которые принимают webhook на одном порту и делят общее состояние."""
+    if BOT_MODE != 'webhook':
+        logger.error("Несколько процессов поддерживаются только в режиме webhook (BOT_MODE=webhook)")
+        return
+    if FSM_STORAGE == 'memory':
+        logger.error("Для нескольких процессов нужно общее хранилище FSM (FSM_STORAGE=sqlite или redis)")
+        return
+    missing = missing_settings()
+    if missing:
+        # Проверяем до запуска процессов, иначе каждый из них завершится с той же ошибкой
+        logger.error(f"Не заданы обязательные настройки: {', '.join(missing)}")
+        return
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_worker, args=(worker,), name=f"bot-worker-{worker}")
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    # SIGTERM передаем процессам бота: каждый корректно завершит свою работу
+    signal.signal(signal.SIGTERM, lambda *_: [process.terminate() for process in processes])
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()
 
 
 if __name__ == '__main__':
     """Основная функция запуска бота."""
+    setup_logging()
     try:
         print("Бот запущен")
-        asyncio.run(main())
+        if WORKERS > 1:
+            run_workers()
+        else:
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         print("\nБот остановлен.")
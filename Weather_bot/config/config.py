@@ -1,19 +1,171 @@
 import os
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import List
 
-# Загрузка переменных окружения из файла
+# Настройки читаются из переменных окружения; файл keys.env загружает config.env.load_env() при запуске бота.
+# Импорт конфигурации ничего не делает (не читает файлы, не создает каталоги и не падает без настроек):
+# обязательные настройки проверяет missing_settings()
 BASE_DIR = Path(__file__).parent.parent
-env_path = BASE_DIR / 'keys.env'
-load_dotenv(env_path)
 
 # Конфигурационные данные (с fallback)
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 WEATHER_API_KEY = os.getenv("WEATHER_API_KEY")
-ADMINS = [int(x) for x in os.getenv("ADMIN_ID").split(",")]
+# Можно указать несколько ключей OpenWeatherMap через запятую: запросы распределяются между ними
+WEATHER_API_KEYS = [key.strip() for key in (WEATHER_API_KEY or "").split(",") if key.strip()]
+ADMINS = [int(x) for x in os.getenv("ADMIN_ID", "").split(",") if x.strip()]
+# Без этих настроек бот не запускается
+REQUIRED_SETTINGS = ("BOT_TOKEN", "WEATHER_API_KEY", "ADMIN_ID")
 
-# Настройки логирования
+# Адреса внешних API (переопределяются, например, для нагрузочного тестирования с заглушками)
+WEATHER_API_BASE_URL = os.getenv("WEATHER_API_BASE_URL", "http://api.openweathermap.org/data/2.5/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # по умолчанию https://api.telegram.org
+
+# Каталог для файлов данных бота
+DATA_DIR = Path(os.getenv("DATA_DIR", BASE_DIR))
+
+# Режим получения обновлений: polling (long polling) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес бота, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))  # обновлений в очереди до отказа 503
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 50))  # одновременно обрабатываемых обновлений
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv("WEBHOOK_SHUTDOWN_TIMEOUT", 30))  # ожидание очереди при остановке, сек
+
+# Настройки HTTP-клиента OpenWeatherMap
+WEATHER_API_TIMEOUT = float(os.getenv("WEATHER_API_TIMEOUT", 10))  # таймаут одного запроса, сек
+WEATHER_API_MAX_CONNECTIONS = int(os.getenv("WEATHER_API_MAX_CONNECTIONS", 100))  # размер пула соединений
+WEATHER_API_MAX_CONCURRENCY = int(os.getenv("WEATHER_API_MAX_CONCURRENCY", 100))  # одновременных запросов
+WEATHER_API_KEEPALIVE = float(os.getenv("WEATHER_API_KEEPALIVE", 30))  # keep-alive соединений, сек
+WEATHER_API_RETRIES = int(os.getenv("WEATHER_API_RETRIES", 2))  # повторов при 429/5xx и сетевых ошибках
+WEATHER_API_RETRY_BASE = float(os.getenv("WEATHER_API_RETRY_BASE", 0.5))  # базовая пауза перед повтором, сек
+WEATHER_API_RETRY_MAX = float(os.getenv("WEATHER_API_RETRY_MAX", 5))  # максимальная пауза перед повтором, сек
+# Квоты OpenWeatherMap на один ключ (делятся между процессами бота, если их несколько)
+WEATHER_API_CALLS_PER_MINUTE = int(os.getenv("WEATHER_API_CALLS_PER_MINUTE", 60))
+WEATHER_API_CALLS_PER_DAY = int(os.getenv("WEATHER_API_CALLS_PER_DAY", 0))  # 0 - без суточного лимита
+WEATHER_API_BACKGROUND_RESERVE = float(os.getenv("WEATHER_API_BACKGROUND_RESERVE", 0.3))  # доля минутной квоты только для пользователей
+WEATHER_API_QUOTA_WAIT = float(os.getenv("WEATHER_API_QUOTA_WAIT", 2))  # сколько запрос пользователя ждет квоту, сек
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", 5))  # неудач подряд до размыкания
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", 30))  # пауза до пробного запроса, сек
+
+# Настройки кэша ответов OpenWeatherMap
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", 600))  # текущая погода, сек
+FORECAST_CACHE_TTL = float(os.getenv("FORECAST_CACHE_TTL", 1800))  # прогноз, сек
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 5000))  # записей в каждом кэше
+WEATHER_STALE_TTL = float(os.getenv("WEATHER_STALE_TTL", 3 * 3600))  # устаревшие данные отдаются при сбоях API, сек
+WEATHER_STALE_WAIT = float(os.getenv("WEATHER_STALE_WAIT", 2))  # сколько ждать API, если есть устаревшие данные, сек
+
+# Прогноз: OpenWeatherMap отдает 40 трехчасовых интервалов (5 суток), бот показывает сводку по дням
+FORECAST_DAYS = int(os.getenv("FORECAST_DAYS", 4))
+
+# Настройки упреждающего обновления кэша для популярных городов
+PREFETCH_ENABLED = os.getenv("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_TOP_N = int(os.getenv("PREFETCH_TOP_N", 50))  # сколько пар (город, язык) обновлять
+PREFETCH_INTERVAL = float(os.getenv("PREFETCH_INTERVAL", 300))  # период обновления, сек
+PREFETCH_MAX_CALLS = int(os.getenv("PREFETCH_MAX_CALLS", 30))  # бюджет запросов к API за один цикл
+
+# Погода по местоположению: координаты округляются до ячейки геосетки, и пользователи из одной ячейки
+# получают один ответ API; популярные ячейки обновляются вместе с популярными городами
+GEO_CELL_KM = float(os.getenv("GEO_CELL_KM", 10))  # сторона ячейки, км
+GEO_MAX_CELLS = int(os.getenv("GEO_MAX_CELLS", 10000))  # ячеек в счетчике популярности
+
+# Локализация: файлы locales/<язык>.json; новый язык добавляется новым файлом
+LOCALES_DIR = BASE_DIR / 'locales'
+DEFAULT_LANGUAGE = os.getenv("DEFAULT_LANGUAGE", "ru")
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", 10000))  # отформатированных ответов в кэше
+
+# Индекс городов: найденные через API и необязательный офлайн-список city.list.json от OpenWeatherMap
+CITY_INDEX_PATH = DATA_DIR / 'city_index.json'
+CITY_LIST_PATH = BASE_DIR / 'city.list.json'
+
+# Настройки хранилища пользовательских данных
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")  # sqlite, json или snapshot
+STORAGE_JSON_PATH = DATA_DIR / 'user_data.json'
+STORAGE_DB_PATH = DATA_DIR / 'user_data.db'
+STORAGE_SNAPSHOT_PATH = DATA_DIR / 'user_data.bin'  # двоичный снимок для STORAGE_BACKEND=snapshot
+# Пользователи загружаются при запуске пачками, бот отвечает на сообщения уже во время загрузки
+STORAGE_LOAD_BATCH = int(os.getenv("STORAGE_LOAD_BATCH", 2000))
+STORAGE_FLUSH_INTERVAL = float(os.getenv("STORAGE_FLUSH_INTERVAL", 5))  # не реже, сек
+STORAGE_FLUSH_MAX_CHANGES = int(os.getenv("STORAGE_FLUSH_MAX_CHANGES", 100))  # или после стольких изменений
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", 100000))  # пользователей в кэше настроек
+
+# Ограничение частоты запросов одного пользователя
+THROTTLE_ENABLED = os.getenv("THROTTLE_ENABLED", "1") == "1"
+# Лимиты по типам команд: тип=запросов/секунд; default - для всех остальных сообщений и кнопок
+THROTTLE_LIMITS = {
+    kind.strip(): tuple(float(x) for x in limit.split('/'))
+    for kind, limit in (item.split('=') for item in
+                        os.getenv("THROTTLE_LIMITS", "weather=5/60,forecast=5/60,default=30/60").split(','))
+}
+THROTTLE_DUPLICATE_WINDOW = float(os.getenv("THROTTLE_DUPLICATE_WINDOW", 2))  # повтор того же нажатия игнорируется, сек
+THROTTLE_AUTO_BAN = os.getenv("THROTTLE_AUTO_BAN", "0") == "1"  # банить пользователей, которые продолжают флуд
+THROTTLE_BAN_THRESHOLD = int(os.getenv("THROTTLE_BAN_THRESHOLD", 100))  # отклоненных запросов до бана
+THROTTLE_BAN_WINDOW = float(os.getenv("THROTTLE_BAN_WINDOW", 600))  # за сколько секунд, сек
+THROTTLE_IDLE_TTL = float(os.getenv("THROTTLE_IDLE_TTL", 600))  # состояние неактивного пользователя удаляется, сек
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", 100000))  # пользователей в памяти ограничителя
+
+# Отправка сообщений в Telegram: общий лимит бота, ответы пользователям идут раньше рассылок
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", 30))  # сообщений в секунду для всего бота (лимит Telegram ~30)
+# Если ответ на запрос погоды не готов за REPLY_PROGRESS_DELAY секунд, пользователь видит, что запрос выполняется:
+# edit - сообщение «Запрашиваю...», которое затем заменяется ответом, action - статус «печатает»
+REPLY_PROGRESS = os.getenv("REPLY_PROGRESS", "edit")
+REPLY_PROGRESS_DELAY = float(os.getenv("REPLY_PROGRESS_DELAY", 0.5))
+
+# Настройки рассылки
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # сообщений в секунду (часть TELEGRAM_RATE)
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))  # одновременных отправок
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", 3))  # повторов после RetryAfter
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 15))  # отчет админу, сек
+BROADCAST_STATE_PATH = DATA_DIR / 'broadcast_state.json'
+
+# Ежедневная рассылка погоды подписчикам
+SUBSCRIPTIONS_ENABLED = os.getenv("SUBSCRIPTIONS_ENABLED", "1") == "1"
+SUBSCRIPTION_SLOT = int(os.getenv("SUBSCRIPTION_SLOT", 15))  # шаг времени рассылки, мин (делитель 60)
+# Время рассылки на кнопках (пользователь может ввести и свое)
+SUBSCRIPTION_PRESETS = os.getenv("SUBSCRIPTION_PRESETS", "06:00,07:00,08:00,09:00").split(',')
+
+# Масштабирование на несколько процессов: общие состояние FSM, данные пользователей и кэш погоды
+WORKERS = int(os.getenv("WORKERS", 1))  # процессов бота (больше одного - только в режиме webhook)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory")  # memory, sqlite или redis
+SHARED_CACHE = os.getenv("SHARED_CACHE", "")  # общий кэш погоды: пусто (нет), sqlite или redis
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")  # Redis или совместимый сервер
+SHARED_DB_PATH = DATA_DIR / 'shared.db'  # файл SQLite для общих FSM и кэша на одном сервере
+# База пользователей общая для нескольких процессов (включается автоматически при WORKERS > 1)
+STORAGE_SHARED = os.getenv("STORAGE_SHARED", "0") == "1" or WORKERS > 1
+STORAGE_SYNC_INTERVAL = float(os.getenv("STORAGE_SYNC_INTERVAL", 1))  # подхват чужих изменений, сек
+BACKGROUND_JOBS = os.getenv("BACKGROUND_JOBS", "1") == "1"  # упреждающее обновление и возобновление рассылки
+
+# Метрики в формате Prometheus на локальном HTTP-сервере (при нескольких процессах порт увеличивается на номер процесса)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9101))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", 0.5))  # период замера задержки цикла событий, сек
+
+# Бюджет холодного запуска: если бот готов принимать обновления позже, в лог пишется предупреждение, сек
+STARTUP_BUDGET = float(os.getenv("STARTUP_BUDGET", 3))
+
+# Настройки логирования (каталог создается при настройке логирования в services/logs.py)
 LOG_DIR = BASE_DIR / 'logs'
-LOG_DIR.mkdir(exist_ok=True)
 LOG_FILE = LOG_DIR / 'bot.log'
-LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# update_id - ID обновления Telegram, при обработке которого сделана запись ("-" вне обработки обновлений)
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - [%(update_id)s] %(message)s'
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_ASYNC = os.getenv("LOG_ASYNC", "1") == "1"  # запись лога в фоновом потоке через очередь
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # записей в очереди; при переполнении новые отбрасываются
+LOG_JSON = os.getenv("LOG_JSON", "0") == "1"  # записи одной строкой JSON
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 10 * 2 ** 20))  # ротация файла лога по размеру, байт (0 - нет)
+LOG_ROTATE_INTERVAL = float(os.getenv("LOG_ROTATE_INTERVAL", 24 * 3600))  # и по времени, сек (0 - нет)
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", 7))  # хранимых старых файлов лога
+# Повторяющиеся предупреждения и ошибки: не больше N записей из одного места кода за M секунд (N=0 - без ограничения)
+LOG_RATE_LIMIT = tuple(float(x) for x in os.getenv("LOG_RATE_LIMIT", "10/60").split('/'))
+
+
+def missing_settings() -> List[str]:
+    """
+    Возвращает названия обязательных настроек, которые не заданы. В режиме webhook обязательны
+    и адрес webhook, и секрет: без секрета сервер принимал бы обновления от кого угодно.
+    """
+    required = REQUIRED_SETTINGS + (("WEBHOOK_URL", "WEBHOOK_SECRET") if BOT_MODE == 'webhook' else ())
+    return [name for name in required if not os.getenv(name)]
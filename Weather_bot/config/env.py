@@ -0,0 +1,11 @@
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Файл с токенами и ключами лежит рядом с bot.py
+ENV_PATH = Path(__file__).parent.parent / 'keys.env'
+
+
+def load_env(path: Path = ENV_PATH) -> None:
+    """Загружает переменные окружения из keys.env (уже заданные в окружении не перезаписываются)."""
+    load_dotenv(path)
@@ -0,0 +1,209 @@
+import asyncio
+import bisect
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter, TelegramAPIError
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    BROADCAST_RATE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_RETRIES,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_STATE_PATH,
+)
+from services.outbound import BULK, OutboundLimiter, outbound_lane
+from storage.backends import atomic_write_json
+from storage.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster:
+    """
+    Фоновая рассылка сообщения всем пользователям с учетом лимитов Telegram.
+
+    Состояние рассылки (текст, курсор по ID пользователей, счетчики) сохраняется в файл
+    после каждой пачки, поэтому прерванная рассылка продолжается после перезапуска.
+    Сообщения рассылки отправляются по полосе BULK общего ограничителя отправки: ответы
+    пользователям во время рассылки не ждут в общей очереди.
+    """
+
+    def __init__(self, bot: Bot, storage: Storage,
+                 limiter: Optional[OutboundLimiter] = None,
+                 state_path: str = str(BROADCAST_STATE_PATH),
+                 concurrency: int = BROADCAST_CONCURRENCY):
+        self.bot = bot
+        self.storage = storage
+        self.limiter = limiter or OutboundLimiter(bulk_rate=BROADCAST_RATE)
+        self.limiter.install(bot)
+        self.state_path = state_path
+        self.concurrency = concurrency
+        self.state: Optional[Dict] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, text: str, admin_chat_id: int) -> bool:
+        """Запускает рассылку в фоне; возвращает False, если уже идет другая рассылка."""
+        if self.is_running:
+            return False
+        self.state = {
+            'text': text,
+            'admin_chat_id': admin_chat_id,
+            'cursor': None,  # ID последнего обработанного пользователя
+            'success': 0,
+            'failed': 0,
+            'blocked': 0,
+            'started_at': time.time(),
+        }
+        self._save_state()
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    def resume(self) -> bool:
+        """Продолжает рассылку, прерванную перезапуском бота, если она есть."""
+        if self.is_running or not os.path.exists(self.state_path):
+            return False
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка чтения файла {self.state_path}, рассылка не возобновлена")
+            return False
+        logger.info(f"Возобновление рассылки с пользователя после {self.state['cursor']}")
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def stop(self) -> None:
+        """Останавливает рассылку; сохраненное состояние позволит продолжить ее позже."""
+        if self.is_running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def _save_state(self) -> None:
+        atomic_write_json(self.state_path, self.state)
+
+    def _pending_recipients(self) -> List[int]:
+        recipients = self.storage.get_broadcast_recipients()
+        cursor = self.state['cursor']
+        if cursor is None:
+            return recipients
+        return recipients[bisect.bisect_right(recipients, cursor):]
+
+    async def _run(self) -> None:
+        """
+        Фоновая задача рассылки. Если рассылка прервана ошибкой (хранилища, файла состояния и т.п.),
+        ошибка пишется в лог, а администратор получает отчет; файл состояния остается,
+        и рассылка продолжится с места остановки после перезапуска бота.
+        """
+        # Отчеты администратору и все сообщения рассылки идут по полосе рассылок
+        outbound_lane.set(BULK)
+        try:
+            await self._broadcast()
+        except Exception as e:
+            logger.exception("Рассылка прервана ошибкой")
+            state = self.state
+            await self._notify(
+                state['admin_chat_id'],
+                f"❌ Рассылка прервана ошибкой: {e!r}\n"
+                f"Успешно: {state['success']}\n"
+                f"Не удалось: {state['failed']}\n"
+                f"Заблокировали бота: {state['blocked']}\n"
+                f"Рассылка продолжится после перезапуска бота"
+            )
+        finally:
+            if self._task is asyncio.current_task():
+                self._task = None
+
+    async def _broadcast(self) -> None:
+        state = self.state
+        recipients = self._pending_recipients()
+        total = state['success'] + state['failed'] + state['blocked'] + len(recipients)
+        admin_chat_id = state['admin_chat_id']
+        progress = await self._notify(admin_chat_id, f"⏳ Рассылка начата для {total} пользователей...")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        sent_before = state['success'] + state['failed'] + state['blocked']
+        last_report = started
+
+        async def send(user_id: int) -> str:
+            async with semaphore:
+                return await self.send(user_id, state['text'])
+
+        chunk_size = self.concurrency * 5
+        for start in range(0, len(recipients), chunk_size):
+            chunk = recipients[start:start + chunk_size]
+            for result in await asyncio.gather(*(send(user_id) for user_id in chunk)):
+                state[result] += 1
+            state['cursor'] = chunk[-1]
+            self._save_state()
+
+            now = time.monotonic()
+            if progress is not None and now - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                last_report = now
+                done = state['success'] + state['failed'] + state['blocked']
+                rate = (done - sent_before) / (now - started)
+                await self._edit(progress, f"⏳ Рассылка: {done} из {total} ({rate:.1f} сообщ./с)")
+
+        elapsed = time.monotonic() - started
+        os.remove(self.state_path)
+        await self._notify(
+            admin_chat_id,
+            f"✅ Рассылка завершена:\n"
+            f"Успешно: {state['success']}\n"
+            f"Не удалось: {state['failed']}\n"
+            f"Заблокировали бота: {state['blocked']}\n"
+            f"Время: {elapsed:.0f} с"
+        )
+
+    async def send(self, user_id: int, text: str) -> str:
+        """
+        Отправляет сообщение одному пользователю с учетом лимитов Telegram (используется и ежедневной
+        рассылкой подписчикам); возвращает success, blocked или failed.
+        """
+        token = outbound_lane.set(BULK)
+        try:
+            for _ in range(BROADCAST_MAX_RETRIES + 1):
+                try:
+                    await self.bot.send_message(user_id, text)
+                    return 'success'
+                except TelegramRetryAfter:
+                    # Ограничитель отправки уже приостановил отправку на retry_after, повторяем после паузы
+                    continue
+                except TelegramForbiddenError:
+                    await self.storage.set_user_blocked(user_id)
+                    return 'blocked'
+                except TelegramAPIError as e:
+                    logger.error(f"Ошибка при рассылке для {user_id}: {e}")
+                    return 'failed'
+            return 'failed'
+        finally:
+            outbound_lane.reset(token)
+
+    async def _notify(self, chat_id: int, text: str):
+        try:
+            return await self.bot.send_message(chat_id, text)
+        except TelegramAPIError as e:
+            logger.error(f"Не удалось отправить отчет о рассылке: {e}")
+            return None
+
+    async def _edit(self, message, text: str) -> None:
+        try:
+            await self.bot.edit_message_text(text, chat_id=message.chat.id, message_id=message.message_id)
+        except TelegramAPIError as e:
+            logger.error(f"Не удалось обновить отчет о рассылке: {e}")
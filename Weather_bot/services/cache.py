@@ -0,0 +1,70 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+
+class TTLCache:
+    """LRU-кэш с ограниченным размером и временем жизни записей."""
+
+    def __init__(self, ttl: float, max_size: int = 1000):
+        """
+        Инициализация кэша.
+
+        Args:
+            ttl: Время жизни записи в секундах.
+            max_size: Максимальное число записей; при переполнении вытесняется самая давняя по использованию.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает значение по ключу или None, если записи нет или она устарела."""
+        entry = self._data.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def get_stale(self, key: Hashable, max_age: float) -> Optional[Tuple[Any, float]]:
+        """
+        Возвращает (значение, возраст) даже для устаревшей записи, если она не старше max_age.
+        Не учитывается в статистике попаданий.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[1]
+        return (entry[0], age) if age <= max_age else None
+
+    def age(self, key: Hashable) -> Optional[float]:
+        """Возраст записи в секундах (без учета в статистике) или None, если записи нет."""
+        entry = self._data.get(key)
+        return None if entry is None else time.monotonic() - entry[1]
+
+    def set(self, key: Hashable, value: Any, age: float = 0.0) -> None:
+        """
+        Сохраняет значение и при необходимости вытесняет самые давние записи.
+
+        Args:
+            age: Возраст значения в секундах, если оно взято из другого кэша.
+        """
+        self._data[key] = (value, time.monotonic() - age)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Очищает кэш."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Возвращает счетчики попаданий и промахов."""
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self._data)}
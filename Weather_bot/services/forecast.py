@@ -0,0 +1,131 @@
+import time
+from array import array
+from collections import Counter
+from datetime import date, datetime, timezone
+from typing import Dict, List, NamedTuple, Optional
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import FORECAST_DAYS
+
+
+class DaySummary(NamedTuple):
+    """Сводка прогноза за один день по местному времени города."""
+    date: date
+    temp_min: float
+    temp_max: float
+    temp_mean: float
+    humidity: int  # средняя за день, %
+    wind_max: float  # м/с
+    code: int  # самое частое за день состояние погоды (код OpenWeatherMap)
+    description: str
+
+
+class Forecast:
+    """
+    Прогноз погоды по трехчасовым интервалам в компактном виде.
+
+    Вместо списка вложенных словарей из ответа API значения хранятся столбцами в массивах:
+    время, температура, влажность, скорость ветра и код состояния погоды. Описание каждого
+    состояния (на языке запроса) хранится один раз.
+    """
+
+    __slots__ = ('city_id', 'city_name', 'utc_offset', 'dt', 'times', 'temps', 'humidity', 'wind',
+                 'codes', 'descriptions', 'stale_age')
+
+    # Остаток текущего дня короче этого числа интервалов не считается отдельным днем прогноза
+    MIN_DAY_SLOTS = 4
+
+    def __init__(self, city_id: Optional[int], city_name: str, utc_offset: int = 0, dt: Optional[float] = None):
+        self.city_id = city_id
+        self.city_name = city_name
+        self.utc_offset = utc_offset  # смещение местного времени города от UTC, сек
+        self.dt = time.time() if dt is None else dt  # время получения прогноза
+        self.times = array('q')
+        self.temps = array('f')
+        self.humidity = array('B')
+        self.wind = array('f')
+        self.codes = array('H')
+        self.descriptions: Dict[int, str] = {}
+        self.stale_age: Optional[float] = None  # возраст, если прогноз отдан устаревшим из-за сбоя API
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def append(self, dt: int, temp: float, humidity: int, wind: float, code: int, description: str) -> None:
+        """Добавляет трехчасовой интервал."""
+        self.times.append(dt)
+        self.temps.append(temp)
+        self.humidity.append(humidity)
+        self.wind.append(wind)
+        self.codes.append(code)
+        self.descriptions.setdefault(code, description)
+
+    @classmethod
+    def from_api(cls, data: Dict) -> 'Forecast':
+        """Разбирает ответ /forecast; вложенные словари интервалов после разбора не хранятся."""
+        city = data.get('city', {})
+        # В прогнозе нет времени данных; время получения отличает новый прогноз от прежнего
+        forecast = cls(city.get('id'), city.get('name', ''), city.get('timezone', 0), data.get('dt'))
+        for item in data.get('list', []):
+            main, weather = item['main'], item['weather'][0]
+            forecast.append(item['dt'], main['temp'], int(main['humidity']), item.get('wind', {}).get('speed', 0.0),
+                            weather['id'], weather['description'])
+        return forecast
+
+    def to_dict(self) -> Dict:
+        """Представление для JSON (общий кэш процессов бота)."""
+        return {
+            'city_id': self.city_id, 'city_name': self.city_name, 'utc_offset': self.utc_offset, 'dt': self.dt,
+            'times': self.times.tolist(), 'temps': self.temps.tolist(), 'humidity': self.humidity.tolist(),
+            'wind': self.wind.tolist(), 'codes': self.codes.tolist(),
+            'descriptions': {str(code): text for code, text in self.descriptions.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'Forecast':
+        forecast = cls(data['city_id'], data['city_name'], data['utc_offset'], data['dt'])
+        forecast.times.extend(data['times'])
+        forecast.temps.extend(data['temps'])
+        forecast.humidity.extend(data['humidity'])
+        forecast.wind.extend(data['wind'])
+        forecast.codes.extend(data['codes'])
+        forecast.descriptions = {int(code): text for code, text in data['descriptions'].items()}
+        return forecast
+
+    def with_stale_age(self, age: float) -> 'Forecast':
+        """Копия с отметкой об устаревании; массивы не копируются."""
+        forecast = Forecast(self.city_id, self.city_name, self.utc_offset, self.dt)
+        for name in ('times', 'temps', 'humidity', 'wind', 'codes', 'descriptions'):
+            setattr(forecast, name, getattr(self, name))
+        forecast.stale_age = age
+        return forecast
+
+    def daily(self, days: int = FORECAST_DAYS) -> List[DaySummary]:
+        """Минимум, максимум и среднее по дням (по местному времени города), не больше days дней."""
+        groups: Dict[date, List[int]] = {}
+        for i, ts in enumerate(self.times):
+            day = datetime.fromtimestamp(ts + self.utc_offset, timezone.utc).date()
+            groups.setdefault(day, []).append(i)
+        dates = list(groups)
+        if len(dates) > days and len(groups[dates[0]]) < self.MIN_DAY_SLOTS:
+            dates = dates[1:]
+        summaries = []
+        for day in dates[:days]:
+            slots = groups[day]
+            temps = [self.temps[i] for i in slots]
+            code = Counter(self.codes[i] for i in slots).most_common(1)[0][0]
+            summaries.append(DaySummary(
+                date=day,
+                temp_min=min(temps),
+                temp_max=max(temps),
+                temp_mean=sum(temps) / len(temps),
+                humidity=round(sum(self.humidity[i] for i in slots) / len(slots)),
+                wind_max=max(self.wind[i] for i in slots),
+                code=code,
+                description=self.descriptions[code],
+            ))
+        return summaries
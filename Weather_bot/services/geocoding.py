@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+import os
+import re
+from typing import TYPE_CHECKING, Dict, Optional
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import CITY_INDEX_PATH, CITY_LIST_PATH
+from storage.backends import atomic_write_json
+
+if TYPE_CHECKING:
+    from services.weather_api import WeatherAPI
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_city_name(name: str) -> str:
+    """Приводит название города к виду для сравнения: без регистра, лишних пробелов и «ё»."""
+    return re.sub(r'\s+', ' ', name.strip()).casefold().replace('ё', 'е')
+
+
+class CityResolver:
+    """
+    Определение города по введенному пользователем названию.
+
+    Название нормализуется и ищется в локальном индексе {название: город}. Если его там нет,
+    город один раз запрашивается у API текущей погоды (ответ заодно попадает в кэш погоды),
+    а найденные ID, каноническое название и координаты сохраняются в индексе.
+    """
+
+    def __init__(self, weather_api: "WeatherAPI",
+                 index_path: str = str(CITY_INDEX_PATH),
+                 city_list_path: str = str(CITY_LIST_PATH)):
+        """
+        Args:
+            weather_api: Клиент API для определения неизвестных городов.
+            index_path: Файл, в котором сохраняется индекс найденных городов.
+            city_list_path: Необязательный офлайн-список городов в формате city.list.json OpenWeatherMap.
+        """
+        self.weather_api = weather_api
+        self.index_path = index_path
+        self.city_list_path = city_list_path
+        self.index: Dict[str, Dict] = {}  # города, найденные через API (сохраняются в index_path)
+        self.offline: Dict[str, Dict] = {}  # города из офлайн-списка
+        self._loaded = False
+        self._load_task: Optional[asyncio.Task] = None
+        self._index_changed = False
+        self._save_task: Optional[asyncio.Task] = None
+
+    def load(self) -> None:
+        """
+        Читает индекс и офлайн-список городов (один раз). Таблицы собираются целиком и только потом
+        подменяют текущие, поэтому поиск никогда не видит их наполовину загруженными.
+        """
+        if self._loaded:
+            return
+        offline = self._read_city_list(self.city_list_path)
+        index = self._read_index()
+        # Города, найденные через API во время загрузки, новее сохраненных
+        index.update(self.index)
+        self.offline, self.index = offline, index
+        self._loaded = True
+
+    def start_loading(self) -> None:
+        """Начинает чтение файлов в потоке, не задерживая цикл событий; создание объекта файлы не читает."""
+        if not self._loaded and self._load_task is None:
+            self._load_task = asyncio.create_task(asyncio.to_thread(self.load))
+
+    async def wait_loaded(self) -> None:
+        """Ждет окончания загрузки (запуская ее при первом поиске)."""
+        if not self._loaded:
+            self.start_loading()
+            # Отмена обработчика, ждущего загрузку, не должна отменять саму загрузку
+            await asyncio.shield(self._load_task)
+
+    def _read_city_list(self, path: str) -> Dict[str, Dict]:
+        """Читает офлайн-список городов, если он положен рядом с ботом."""
+        offline: Dict[str, Dict] = {}
+        if not os.path.exists(path):
+            return offline
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cities = json.load(f)
+        except (OSError, ValueError):
+            logger.error(f"Ошибка чтения файла {path}, офлайн-список городов не загружен")
+            return offline
+        ambiguous = set()
+        for item in cities:
+            city = {
+                'id': item['id'],
+                'name': item['name'],
+                'lat': item['coord']['lat'],
+                'lon': item['coord']['lon'],
+                'country': item.get('country'),
+            }
+            key = normalize_city_name(item['name'])
+            if key in offline and offline[key]['id'] != city['id']:
+                ambiguous.add(key)
+            offline.setdefault(key, city)
+        # В списке нет населения, поэтому город с неоднозначным названием («London», «Paris») по списку
+        # не выбираем: такие названия определяет API, который отдает самый известный город
+        for key in ambiguous:
+            del offline[key]
+        logger.info(f"Загружено {len(cities)} городов из {path}, неоднозначных названий: {len(ambiguous)}")
+        return offline
+
+    def _read_index(self) -> Dict[str, Dict]:
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except (OSError, ValueError):
+            logger.error(f"Ошибка чтения файла {self.index_path}, индекс городов будет собран заново")
+        return {}
+
+    def _save_index(self, index: Dict[str, Dict]) -> None:
+        try:
+            atomic_write_json(self.index_path, index)
+        except OSError as e:
+            logger.error(f"Не удалось сохранить индекс городов: {e}")
+
+    def _schedule_save(self) -> None:
+        """Отмечает индекс измененным; файл перезаписывается в потоке, не задерживая цикл событий."""
+        self._index_changed = True
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.create_task(self._save_loop())
+
+    async def _save_loop(self) -> None:
+        # Города, найденные во время записи, сохраняются следующей записью, а не отдельной на каждый
+        while self._index_changed:
+            self._index_changed = False
+            await asyncio.to_thread(self._save_index, dict(self.index))
+
+    async def flush(self) -> None:
+        """Дожидается сохранения индекса (при остановке бота)."""
+        if self._save_task is not None:
+            await self._save_task
+
+    async def lookup(self, name: str) -> Optional[Dict]:
+        """Ищет город только в локальном индексе, без обращения к API."""
+        await self.wait_loaded()
+        key = normalize_city_name(name)
+        return self.index.get(key) or self.offline.get(key)
+
+    async def resolve(self, name: str, lang: str = 'ru') -> Optional[Dict]:
+        """
+        Возвращает город {'id', 'name', 'lat', 'lon', 'country'} по названию
+        или None, если такого города нет или API недоступно.
+        """
+        city = await self.lookup(name)
+        if city is not None:
+            return city
+
+        data = await self.weather_api.get_weather(name, lang)
+        if not data or data.get('cod') != 200 or 'id' not in data:
+            return None
+        city = {
+            'id': data['id'],
+            'name': data['name'],
+            'lat': data['coord']['lat'],
+            'lon': data['coord']['lon'],
+            'country': data.get('sys', {}).get('country'),
+        }
+        self.index[normalize_city_name(name)] = city
+        self.index.setdefault(normalize_city_name(data['name']), city)
+        self._schedule_save()
+        return city
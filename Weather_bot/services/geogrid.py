@@ -0,0 +1,78 @@
+import heapq
+import math
+from typing import Dict, List, Tuple
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import GEO_CELL_KM, GEO_MAX_CELLS
+from services.metrics import metrics
+
+# Ячейка задается координатами своего центра (широта, долгота)
+Cell = Tuple[float, float]
+
+KM_PER_DEGREE = 111.32  # длина градуса меридиана, км
+
+
+class GeoGrid:
+    """
+    Сетка ячеек примерно cell_km x cell_km на поверхности Земли.
+
+    Широта делится на полосы высотой cell_km, каждая полоса - на целое число ячеек шириной
+    около cell_km на широте ее середины, поэтому ячейки почти квадратные и у полюсов.
+    Погода запрашивается для центра ячейки: все пользователи из одной ячейки получают
+    одну запись кэша и один запрос к API. Сетка заодно считает, из каких ячеек чаще
+    всего запрашивают погоду, чтобы их обновлял Prefetcher.
+    """
+
+    def __init__(self, cell_km: float = GEO_CELL_KM, max_cells: int = GEO_MAX_CELLS):
+        """
+        Args:
+            cell_km: Сторона ячейки, км.
+            max_cells: Сколько пар (ячейка, язык) хранить в счетчике популярности.
+        """
+        self.lat_step = cell_km / KM_PER_DEGREE
+        self.rows = max(1, math.ceil(180 / self.lat_step))
+        self.max_cells = max_cells
+        self.counts: Dict[Tuple[Cell, str], float] = {}
+        metrics.callback('geo_cells', 'Ячеек геосетки в счетчике популярности', 'gauge', lambda: len(self.counts))
+
+    def cell(self, lat: float, lon: float) -> Cell:
+        """Центр ячейки, в которую попадает точка (lat, lon)."""
+        row = min(max(int((lat + 90) / self.lat_step), 0), self.rows - 1)
+        center_lat = min(-90 + (row + 0.5) * self.lat_step, 90.0)
+        columns = max(1, int(360 * math.cos(math.radians(center_lat)) / self.lat_step))
+        lon_step = 360 / columns
+        column = int((lon + 180) / lon_step) % columns
+        # Округление делает ключ кэша одинаковым в разных процессах
+        return round(center_lat, 4), round(-180 + (column + 0.5) * lon_step, 4)
+
+    def record(self, cell: Cell, lang: str) -> None:
+        """Учитывает запрос погоды из ячейки на языке lang."""
+        key = (cell, lang)
+        if key not in self.counts and len(self.counts) >= self.max_cells:
+            # Освобождаем место: удаляем четверть наименее популярных ячеек
+            for old, _ in heapq.nsmallest(max(1, len(self.counts) // 4), self.counts.items(), key=lambda item: item[1]):
+                del self.counts[old]
+        self.counts[key] = self.counts.get(key, 0) + 1
+
+    def popular(self, limit: int) -> List[Tuple[Cell, str, float]]:
+        """Самые популярные пары (ячейка, язык) по убыванию числа запросов."""
+        top = heapq.nlargest(limit, self.counts.items(), key=lambda item: item[1])
+        return [(cell, lang, count) for (cell, lang), count in top]
+
+    def decay(self, factor: float = 0.5) -> None:
+        """
+        Уменьшает счетчики в factor раз (вызывается после каждого цикла прогрева):
+        популярность отражает недавние запросы, а ячейки без запросов удаляются.
+        """
+        self.counts = {key: count * factor for key, count in self.counts.items() if count * factor >= 0.5}
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+
+# Глобальный экземпляр для использования в проекте
+geo_grid = GeoGrid()
@@ -0,0 +1,183 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import time
+import traceback
+from typing import Dict, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    LOG_DIR, LOG_FILE, LOG_FORMAT, LOG_LEVEL, LOG_ASYNC, LOG_QUEUE_SIZE, LOG_JSON,
+    LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, LOG_BACKUP_COUNT, LOG_RATE_LIMIT,
+)
+from services.metrics import metrics
+
+LOG_DROPPED = metrics.counter('log_records_dropped_total', 'Записей лога, отброшенных из-за переполнения очереди')
+LOG_SUPPRESSED = metrics.counter('log_records_suppressed_total', 'Повторяющихся предупреждений и ошибок, не записанных в лог')
+
+# ID обновления Telegram, которое сейчас обрабатывается (задается middleware в bot.py)
+update_id_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar('update_id', default=None)
+
+
+class CorrelationFilter(logging.Filter):
+    """Добавляет в запись лога ID обрабатываемого обновления (update_id), чтобы связать все записи одного запроса."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        update_id = update_id_var.get()
+        record.update_id = update_id if update_id is not None else '-'
+        return True
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Ограничивает повторяющиеся предупреждения и ошибки: из одного места кода записывается
+    не больше limit записей за window секунд. Число пропущенных записей добавляется
+    к первой записи следующего окна.
+    """
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        # (файл, строка) -> [начало окна, записано в окне, пропущено в окне]
+        self._sites: Dict[Tuple[str, int], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        site = self._sites.get(key)
+        if site is None or now - site[0] >= self.window:
+            suppressed = site[2] if site is not None else 0
+            if len(self._sites) > 10000:
+                self._sites.clear()
+            self._sites[key] = [now, 1, 0]
+            if suppressed and not getattr(record, 'repeats_noted', False):
+                record.msg = f"{record.msg} (пропущено похожих записей: {suppressed})"
+                record.repeats_noted = True
+            return True
+        if site[1] < self.limit:
+            site[1] += 1
+            return True
+        site[2] += 1
+        LOG_SUPPRESSED.inc()
+        return False
+
+
+class JSONFormatter(logging.Formatter):
+    """Записи лога одной строкой JSON: время, уровень, логгер, сообщение, update_id и трассировка."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        update_id = getattr(record, 'update_id', '-')
+        if update_id != '-':
+            data['update_id'] = update_id
+        if record.exc_info:
+            data['exception'] = ''.join(traceback.format_exception(*record.exc_info))
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class RotatingLogHandler(logging.handlers.RotatingFileHandler):
+    """Файл лога с ротацией по размеру (max_bytes) и по времени (раз в interval секунд)."""
+
+    def __init__(self, file_path: str, max_bytes: int, interval: float, backup_count: int):
+        super().__init__(file_path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.interval = interval
+        self.rollover_at = time.time() + interval if interval > 0 else None
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if self.rollover_at is not None and time.time() >= self.rollover_at:
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        if self.rollover_at is not None:
+            self.rollover_at = time.time() + self.interval
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Кладет записи в ограниченную очередь; если очередь заполнена, запись отбрасывается, а не ждет."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Сообщение и трассировка переводятся в текст здесь: аргументы и объект исключения
+        # могут измениться, пока запись ждет в очереди. Остальное форматирование - в фоновом потоке
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_DROPPED.inc()
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def setup_logging() -> None:
+    """
+    Настраивает логирование в файл с ротацией и в консоль.
+
+    В асинхронном режиме (LOG_ASYNC) обработчики в цикле событий только кладут запись в очередь,
+    а форматирование и запись на диск выполняет фоновый поток, поэтому всплеск ошибок во время
+    сбоя не замедляет обработку обновлений.
+    """
+    global _listener
+    LOG_DIR.mkdir(exist_ok=True)
+    formatter = JSONFormatter() if LOG_JSON else logging.Formatter(LOG_FORMAT)
+    handlers = [
+        RotatingLogHandler(str(LOG_FILE), LOG_MAX_BYTES, LOG_ROTATE_INTERVAL, LOG_BACKUP_COUNT),
+        logging.StreamHandler(),
+    ]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    if LOG_ASYNC:
+        front = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _listener = logging.handlers.QueueListener(front.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        metrics.callback('log_queue_size', 'Записей лога в очереди на запись', 'gauge', lambda: front.queue.qsize())
+        # Оставшиеся в очереди записи дописываются при завершении процесса
+        atexit.register(stop_logging)
+        front_handlers = [front]
+    else:
+        front_handlers = handlers
+    # Фильтры выполняются в потоке, который пишет в лог: там доступен update_id текущего обновления
+    for handler in front_handlers:
+        handler.addFilter(CorrelationFilter())
+        handler.addFilter(RepeatFilter(*LOG_RATE_LIMIT))
+        root.addHandler(handler)
+
+
+def stop_logging() -> None:
+    """Дописывает записи из очереди и останавливает фоновый поток логирования."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,294 @@
+import asyncio
+import bisect
+import logging
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from aiohttp import web
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import LOOP_LAG_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм длительности по умолчанию, сек
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Value:
+    """Значение счетчика или индикатора для одного набора меток."""
+
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class _HistogramValue:
+    """Гистограмма для одного набора меток: число наблюдений по корзинам, сумма и количество."""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metric:
+    """Метрика с метками; значения для каждого набора меток создаются при первом обращении."""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _new_child(self):
+        return _Value()
+
+    def labels(self, *values) -> object:
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получено {key}")
+            child = self._children[key] = self._new_child()
+        return child
+
+    def samples(self) -> Iterable[Tuple[str, Tuple[str, ...], str, float]]:
+        """(суффикс имени, значения меток, дополнительная метка, значение) для вывода."""
+        for key, child in self._children.items():
+            yield '', key, '', child.value
+
+
+class Counter(Metric):
+    """Монотонно растущий счетчик."""
+
+    kind = 'counter'
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """Индикатор: значение, которое может расти и уменьшаться."""
+
+    kind = 'gauge'
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class Histogram(Metric):
+    """Распределение значений (обычно длительностей) по корзинам."""
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def samples(self):
+        for key, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.bounds + (math.inf,), child.counts):
+                cumulative += count
+                yield '_bucket', key, f'le="{_format_value(bound)}"', cumulative
+            yield '_sum', key, '', child.sum
+            yield '_count', key, '', child.count
+
+    def quantile(self, q: float, *values) -> Optional[float]:
+        """
+        Оценка квантиля q по корзинам (линейная интерполяция внутри корзины), как histogram_quantile
+        в Prometheus. Без меток объединяет все наборы меток. None, если наблюдений нет.
+        """
+        if values:
+            child = self._children.get(tuple(map(str, values)))
+            children = [child] if child is not None else []
+        else:
+            children = list(self._children.values())
+        counts = [sum(child.counts[i] for child in children) for i in range(len(self.bounds) + 1)]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        cumulative = 0
+        for i, count in enumerate(counts):
+            if cumulative + count >= rank and count:
+                if i == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[i - 1] if i else 0.0
+                return lower + (self.bounds[i] - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.bounds[-1]
+
+
+class CallbackMetric(Metric):
+    """Метрика, значение которой вычисляется функцией при каждом чтении (размеры очередей, счетчики кэшей)."""
+
+    def __init__(self, name: str, documentation: str, kind: str,
+                 func: Callable[[], Union[float, Dict[Tuple[str, ...], float]]],
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.func = func
+
+    def samples(self):
+        values = self.func()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield '', tuple(map(str, key)), '', value
+
+
+class MetricsRegistry:
+    """Реестр метрик бота с выводом в текстовом формате Prometheus."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """Регистрирует метрику; метрика с тем же именем заменяется (например, при повторном запуске)."""
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str, func: Callable,
+                 labelnames: Sequence[str] = ()) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, kind, func, labelnames))
+
+    def get(self, name: str) -> Optional[Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus (версия 0.0.4)."""
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Ошибка чтения метрики {metric.name}: {e!r}")
+                continue
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, values, extra, value in samples:
+                labels = _format_labels(metric.labelnames, values, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+class LoopLagMonitor:
+    """Измеряет задержку цикла событий: насколько позже запланированного просыпается sleep(interval)."""
+
+    def __init__(self, registry: 'MetricsRegistry', interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.histogram = registry.histogram(
+            'event_loop_lag_seconds', 'Задержка цикла событий asyncio',
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+        self.max_lag = 0.0
+        registry.callback('event_loop_lag_max_seconds', 'Максимальная задержка цикла событий с момента запуска',
+                          'gauge', lambda: self.max_lag)
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.histogram.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий метрики на /metrics."""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._runner: Optional[web.AppRunner] = None
+
+    async def start(self, host: str, port: int) -> None:
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        return web.Response(body=self.registry.render().encode('utf-8'),
+                            headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+
+# Глобальный реестр метрик для использования в проекте
+metrics = MetricsRegistry()
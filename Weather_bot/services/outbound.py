@@ -0,0 +1,134 @@
+import asyncio
+import contextvars
+import logging
+import time
+from typing import Awaitable, Set
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import TELEGRAM_RATE, BROADCAST_RATE, REPLY_PROGRESS, REPLY_PROGRESS_DELAY
+from services.metrics import metrics
+from services.rate_limit import ChatRateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+OUTBOUND_WAIT = metrics.histogram('telegram_outbound_wait_seconds', 'Ожидание разрешения на отправку в Telegram',
+                                  ['lane'])
+REPLIES = metrics.counter('bot_replies_total', 'Ответов на запросы погоды по способу отправки', ['mode'])
+
+# Полоса отправки для текущей задачи: рассылки выставляют BULK, все остальное - ответы пользователям
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+outbound_lane: contextvars.ContextVar[str] = contextvars.ContextVar('outbound_lane', default=INTERACTIVE)
+
+
+class OutboundLimiter:
+    """
+    Общий лимит Telegram на отправку сообщений ботом с двумя полосами приоритета.
+
+    Все запросы к чатам проходят через middleware сессии бота и берут токен из общего ведра.
+    Ответы пользователям (INTERACTIVE) получают токен первыми; рассылки (BULK) ждут, пока
+    ответы не разобраны, не забирают последние global_rate - bulk_rate токенов ведра и дополнительно
+    ограничены своей скоростью и интервалом на один чат, поэтому во время рассылки ответы
+    отправляются без ожидания.
+    """
+
+    def __init__(self, global_rate: float = TELEGRAM_RATE, bulk_rate: float = BROADCAST_RATE,
+                 per_chat_interval: float = 1.0):
+        """
+        Args:
+            global_rate: Сообщений в секунду для всего бота.
+            bulk_rate: Сообщений в секунду для рассылок (меньше global_rate).
+            per_chat_interval: Минимальный интервал между сообщениями рассылки в один чат, сек.
+        """
+        self.bucket = TokenBucket(global_rate)
+        self.bulk = ChatRateLimiter(bulk_rate, per_chat_interval)
+        # Запас токенов, который рассылка оставляет ответам пользователям
+        self.reserve = max(global_rate - bulk_rate, 1.0)
+        self.waiting = {INTERACTIVE: 0, BULK: 0}
+        self._bots: Set[int] = set()
+
+    def install(self, bot: Bot) -> None:
+        """Подключает ограничитель к сессии бота (один раз для каждого бота)."""
+        if id(bot) not in self._bots:
+            self._bots.add(id(bot))
+            bot.session.middleware(self.middleware)
+
+    async def acquire(self, chat_id: int, lane: str = INTERACTIVE) -> None:
+        """Ждет разрешения отправить сообщение в чат chat_id по полосе lane."""
+        started = time.monotonic()
+        self.waiting[lane] += 1
+        try:
+            if lane == BULK:
+                await self.bulk.acquire(chat_id)
+                # Пока ждут ответы пользователям, рассылка токены не забирает
+                while self.waiting[INTERACTIVE] or not self.bucket.try_acquire(reserve=self.reserve):
+                    await asyncio.sleep(max(self.bucket.delay(reserve=self.reserve), 0.005))
+            else:
+                await self.bucket.acquire()
+        finally:
+            self.waiting[lane] -= 1
+        OUTBOUND_WAIT.labels(lane).observe(time.monotonic() - started)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает все отправки на seconds секунд (после RetryAfter от Telegram)."""
+        self.bucket.pause(seconds)
+        self.bulk.pause(seconds)
+
+    async def middleware(self, make_request, bot: Bot, method):
+        """Middleware сессии: запросы к чатам (отправка, изменение сообщений, действия) проходят через лимит."""
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None:
+            await self.acquire(chat_id, outbound_lane.get())
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control Telegram ({type(method).__name__}), пауза {e.retry_after} с")
+            self.pause(e.retry_after)
+            raise
+
+
+async def reply_with_progress(message: types.Message, result: Awaitable[str], progress_text: str,
+                              mode: str = REPLY_PROGRESS, delay: float = REPLY_PROGRESS_DELAY) -> None:
+    """
+    Отвечает на сообщение текстом из result одним сообщением.
+
+    Если ответ не готов за delay секунд (данных нет в кэше и API отвечает медленно), пользователь
+    видит, что запрос выполняется: в режиме edit отправляется progress_text, который затем заменяется
+    ответом, в режиме action - действие «печатает». Ответ из кэша отправляется сразу одним запросом.
+    """
+    task = asyncio.ensure_future(result)
+    try:
+        try:
+            text = await asyncio.wait_for(asyncio.shield(task), delay)
+        except asyncio.TimeoutError:
+            pass
+        else:
+            REPLIES.labels('direct').inc()
+            await message.answer(text)
+            return
+
+        if mode == 'action':
+            REPLIES.labels('action').inc()
+            await message.bot.send_chat_action(message.chat.id, 'typing')
+            await message.answer(await task)
+            return
+
+        REPLIES.labels('edit').inc()
+        placeholder = await message.answer(progress_text)
+        text = await task
+        try:
+            await placeholder.edit_text(text)
+        except TelegramBadRequest as e:
+            # Сообщение могли удалить; тогда ответ отправляется отдельно
+            logger.warning(f"Не удалось заменить сообщение о запросе ответом: {e}")
+            await message.answer(text)
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import PREFETCH_TOP_N, PREFETCH_INTERVAL, PREFETCH_MAX_CALLS
+from services.cache import TTLCache
+from services.geogrid import GeoGrid
+from services.weather_api import CityQuery, WeatherAPI
+from storage.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Периодически обновляет в кэше погоду и прогноз для самых популярных городов
+    и погоду в самых популярных ячейках геосетки, чтобы запросы пользователей
+    обслуживались из кэша без ожидания API.
+    """
+
+    def __init__(self, weather_api: WeatherAPI, storage: Storage,
+                 grid: Optional[GeoGrid] = None,
+                 top_n: int = PREFETCH_TOP_N,
+                 interval: float = PREFETCH_INTERVAL,
+                 max_calls: int = PREFETCH_MAX_CALLS):
+        """
+        Args:
+            weather_api: Клиент API, кэш которого прогревается.
+            storage: Хранилище, по которому определяются популярные города.
+            grid: Геосетка запросов по местоположению, популярные ячейки которой обновляются.
+            top_n: Сколько самых популярных пар (город, язык) и (ячейка, язык) обновлять.
+            interval: Период между циклами обновления, сек.
+            max_calls: Бюджет запросов к API на один цикл.
+        """
+        self.weather_api = weather_api
+        self.storage = storage
+        self.grid = grid
+        self.top_n = top_n
+        self.interval = interval
+        self.max_calls = max_calls
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self) -> None:
+        while True:
+            try:
+                calls = await self.run_once()
+                logger.info(f"Прогрев кэша: {calls} запросов к API")
+            except Exception as e:
+                logger.error(f"Ошибка прогрева кэша: {e!r}")
+            await asyncio.sleep(self.interval)
+
+    def _is_due(self, cache: TTLCache, city: CityQuery, lang: str) -> bool:
+        """Запись нужно обновить, если ее нет или она устареет до следующего цикла."""
+        age = cache.age(WeatherAPI._cache_key(city, lang))
+        return age is None or age > cache.ttl - self.interval
+
+    async def run_once(self) -> int:
+        """Выполняет один цикл обновления и возвращает число сделанных запросов к API."""
+        api = self.weather_api
+        if api.breaker.state == api.breaker.OPEN:
+            # API недоступен: пользователи пока получают устаревшие данные, пробный запрос сделает первый из них
+            return 0
+        popular = self.storage.get_popular_cities(self.top_n)
+        budget = self.max_calls
+
+        # Текущая погода: сначала пачками через group по известным ID, затем по одному
+        due: Dict[str, List[str]] = {}
+        for city, lang, _ in popular:
+            if self._is_due(api.weather_cache, city, lang):
+                due.setdefault(lang, []).append(city)
+        for lang, cities in due.items():
+            calls, unknown = await api.refresh_weather_group(cities, lang, max_calls=budget)
+            budget -= calls
+            for city in unknown:
+                if budget <= 0:
+                    break
+                await api.get_weather(city, lang, force_refresh=True, background=True)
+                budget -= 1
+
+        # Прогноз: для него нет пакетного запроса
+        for city, lang, _ in popular:
+            if budget <= 0:
+                break
+            if self._is_due(api.forecast_cache, city, lang):
+                await api.get_forecast(city, lang, force_refresh=True, background=True)
+                budget -= 1
+
+        # Погода по местоположению: ячейки, из которых ее чаще всего запрашивали с прошлого цикла
+        if self.grid is not None:
+            for cell, lang, _ in self.grid.popular(self.top_n):
+                if budget <= 0:
+                    break
+                if self._is_due(api.weather_cache, cell, lang):
+                    await api.get_weather(cell, lang, force_refresh=True, background=True)
+                    budget -= 1
+            self.grid.decay()
+
+        return self.max_calls - budget
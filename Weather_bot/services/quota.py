@@ -0,0 +1,139 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import aiohttp
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    WEATHER_API_KEYS,
+    WEATHER_API_CALLS_PER_MINUTE,
+    WEATHER_API_CALLS_PER_DAY,
+    WEATHER_API_BACKGROUND_RESERVE,
+    WEATHER_API_QUOTA_WAIT,
+    WORKERS,
+)
+from services.rate_limit import TokenBucket
+
+
+class QuotaExceededError(aiohttp.ClientError):
+    """Запрос не отправлен: квота всех ключей API исчерпана."""
+
+
+class KeyQuota:
+    """Расход квоты одного ключа API: ведро на минутный лимит и счетчик за текущие сутки (UTC)."""
+
+    def __init__(self, key: str, per_minute: float, per_day: int):
+        self.key = key
+        # Ведро настроено так, чтобы за любые 60 секунд не выйти за per_minute вызовов
+        capacity = max(1.0, per_minute / 6)
+        self.bucket = TokenBucket(max(per_minute - capacity, 1.0) / 60, capacity)
+        self.per_day = per_day
+        self.day = self._today()
+        self.day_calls = 0
+        self.calls = 0
+
+    @staticmethod
+    def _today() -> str:
+        return datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    def day_left(self) -> Optional[int]:
+        """Остаток суточной квоты или None, если суточного лимита нет."""
+        if self.day != self._today():
+            self.day = self._today()
+            self.day_calls = 0
+        return None if not self.per_day else max(0, self.per_day - self.day_calls)
+
+    def try_acquire(self, reserve: float) -> bool:
+        if self.day_left() == 0 or not self.bucket.try_acquire(reserve=reserve):
+            return False
+        self.day_calls += 1
+        self.calls += 1
+        return True
+
+
+class QuotaManager:
+    """
+    Распределяет запросы к API между ключами с учетом их квот.
+
+    Запросы пользователей ждут освободившуюся квоту до max_wait секунд. Фоновые запросы
+    (упреждающее обновление кэша) не ждут, уступают ожидающим запросам пользователей
+    и не трогают долю background_reserve минутной квоты, оставленную для пользователей.
+    """
+
+    def __init__(self, keys: List[str] = WEATHER_API_KEYS,
+                 per_minute: float = WEATHER_API_CALLS_PER_MINUTE / WORKERS,
+                 per_day: int = WEATHER_API_CALLS_PER_DAY // WORKERS,
+                 background_reserve: float = WEATHER_API_BACKGROUND_RESERVE,
+                 max_wait: float = WEATHER_API_QUOTA_WAIT):
+        self.keys = [KeyQuota(key, per_minute, per_day) for key in keys or ['']]
+        self.max_wait = max_wait
+        self.background_reserve = background_reserve
+        self.rejected = 0  # запросов, не отправленных из-за квоты
+        self._waiting = 0  # запросов пользователей, ожидающих квоту
+
+    def _reserve(self, quota: KeyQuota, background: bool) -> float:
+        return quota.bucket.capacity * self.background_reserve if background else 0.0
+
+    def _try_acquire(self, background: bool) -> Optional[str]:
+        # Ключ с наибольшим запасом токенов: нагрузка распределяется между ключами равномерно
+        for quota in sorted(self.keys, key=lambda q: q.bucket.tokens, reverse=True):
+            if quota.try_acquire(self._reserve(quota, background)):
+                return quota.key
+        return None
+
+    def _delay(self) -> Optional[float]:
+        """Через сколько секунд освободится квота хотя бы у одного ключа (None - суточные квоты исчерпаны)."""
+        delays = [quota.bucket.delay() for quota in self.keys if quota.day_left() != 0]
+        return min(delays) if delays else None
+
+    async def acquire(self, background: bool = False) -> str:
+        """Возвращает ключ, по которому можно сделать запрос, или выбрасывает QuotaExceededError."""
+        if background and self._waiting:
+            self.rejected += 1
+            raise QuotaExceededError("Квота API занята запросами пользователей")
+        key = self._try_acquire(background)
+        if key is not None:
+            return key
+        if background:
+            self.rejected += 1
+            raise QuotaExceededError("Квота API для фоновых запросов исчерпана")
+        deadline = time.monotonic() + self.max_wait
+        self._waiting += 1
+        try:
+            while True:
+                delay = self._delay()
+                if delay is None or time.monotonic() + delay > deadline:
+                    self.rejected += 1
+                    raise QuotaExceededError("Квота API исчерпана")
+                await asyncio.sleep(delay)
+                key = self._try_acquire(background=False)
+                if key is not None:
+                    return key
+        finally:
+            self._waiting -= 1
+
+    def report_rate_limited(self, key: str, retry_after: float) -> None:
+        """API ответил 429 для ключа: не используем его retry_after секунд."""
+        for quota in self.keys:
+            if quota.key == key:
+                quota.bucket.pause(retry_after)
+
+    def get_stats(self) -> List[Dict]:
+        """Расход и остаток квоты по каждому ключу (ключ показан последними символами)."""
+        stats = []
+        for quota in self.keys:
+            quota.bucket.delay()  # пересчитывает накопившиеся токены
+            stats.append({
+                'key': f"…{quota.key[-4:]}",
+                'calls': quota.calls,
+                'minute_left': int(quota.bucket.tokens),
+                'day_used': quota.day_calls,
+                'day_left': quota.day_left(),
+            })
+        return stats
@@ -0,0 +1,89 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class TokenBucket:
+    """Ограничитель частоты «ведро с токенами»: rate токенов в секунду, не больше capacity подряд."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_acquire(self, tokens: float = 1, reserve: float = 0) -> bool:
+        """
+        Забирает токены, если они есть; иначе возвращает False без ожидания.
+
+        Args:
+            reserve: Сколько токенов должно остаться после выдачи (запас для более важных запросов).
+        """
+        now = time.monotonic()
+        if now < self.paused_until:
+            return False
+        self._refill(now)
+        if self.tokens >= tokens + reserve:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def delay(self, tokens: float = 1, reserve: float = 0) -> float:
+        """Сколько секунд ждать, пока накопится нужное число токенов (сверх reserve)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, (tokens + reserve - self.tokens) / self.rate)
+        return max(wait, self.paused_until - now)
+
+    async def acquire(self, tokens: float = 1) -> None:
+        """Ждет, пока не появятся токены, и забирает их."""
+        while not self.try_acquire(tokens):
+            await asyncio.sleep(self.delay(tokens))
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов (например, после RetryAfter от Telegram)."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+        self.updated = self.paused_until
+
+
+class ChatRateLimiter:
+    """Общий лимит Telegram на отправку сообщений ботом плюс лимит на один чат."""
+
+    def __init__(self, global_rate: float, per_chat_interval: float = 1.0, max_chats: int = 10000):
+        """
+        Args:
+            global_rate: Сообщений в секунду для всего бота.
+            per_chat_interval: Минимальный интервал между сообщениями в один чат, сек.
+            max_chats: Сколько последних чатов помнить для соблюдения per_chat_interval.
+        """
+        self.bucket = TokenBucket(global_rate)
+        self.per_chat_interval = per_chat_interval
+        self.max_chats = max_chats
+        self._last_sent: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    async def acquire(self, chat_id: Hashable) -> None:
+        """Ждет разрешения отправить сообщение в чат chat_id."""
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            wait = last + self.per_chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        await self.bucket.acquire()
+        self._last_sent[chat_id] = time.monotonic()
+        self._last_sent.move_to_end(chat_id)
+        while len(self._last_sent) > self.max_chats:
+            self._last_sent.popitem(last=False)
+
+    def pause(self, seconds: float) -> None:
+        """Приостанавливает все отправки на seconds секунд."""
+        self.bucket.pause(seconds)
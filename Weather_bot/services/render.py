@@ -0,0 +1,172 @@
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+
+import sys
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    LOCALES_DIR,
+    DEFAULT_LANGUAGE,
+    RENDER_CACHE_SIZE,
+    WEATHER_CACHE_TTL,
+    FORECAST_CACHE_TTL,
+    SUBSCRIPTION_PRESETS,
+)
+from services.cache import TTLCache
+from services.forecast import Forecast
+
+
+class Renderer:
+    """
+    Тексты и клавиатуры бота на всех языках.
+
+    Локализации загружаются из файлов locales/<язык>.json, клавиатуры строятся один раз при загрузке,
+    а отформатированные ответы с погодой кэшируются по (город, язык, время данных).
+    Чтобы добавить язык, достаточно добавить файл локализации.
+    """
+
+    def __init__(self, locales_dir: Path = LOCALES_DIR, default_language: str = DEFAULT_LANGUAGE,
+                 cache_size: int = RENDER_CACHE_SIZE):
+        self.default_language = default_language
+        self.locales: Dict[str, Dict] = {}
+        for path in sorted(Path(locales_dir).glob('*.json')):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.locales[path.stem] = json.load(f)
+        if default_language not in self.locales:
+            raise ValueError(f"Нет файла локализации для языка по умолчанию: {default_language}")
+        # Язык по умолчанию первым, остальные по алфавиту
+        self.languages: List[str] = sorted(self.locales, key=lambda lang: (lang != default_language, lang))
+        self.main_keyboards = {lang: self._build_main_keyboard(texts['buttons'])
+                               for lang, texts in self.locales.items()}
+        self.location_keyboards = {lang: self._build_location_keyboard(texts['buttons'])
+                                   for lang, texts in self.locales.items()}
+        self.language_keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=self.locales[lang]['language_name'], callback_data=f"lang_{lang}")
+            for lang in self.languages
+        ]])
+        self.subscription_keyboards = {lang: self._build_subscription_keyboard(texts)
+                                       for lang, texts in self.locales.items()}
+        # Отформатированный текст живет не дольше данных, из которых он получен
+        self.weather_cache = TTLCache(WEATHER_CACHE_TTL, cache_size)
+        self.forecast_cache = TTLCache(FORECAST_CACHE_TTL, cache_size)
+        logging.info(f"Загружены локализации: {', '.join(self.languages)}")
+
+    @staticmethod
+    def _build_main_keyboard(buttons: Dict[str, str]) -> ReplyKeyboardMarkup:
+        return ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text=buttons['weather']), KeyboardButton(text=buttons['forecast'])],
+                [KeyboardButton(text=buttons['change_city']), KeyboardButton(text=buttons['change_language'])],
+                [KeyboardButton(text=buttons['subscription']), KeyboardButton(text=buttons['help'])],
+                [KeyboardButton(text=buttons['location'], request_location=True)]
+            ],
+            resize_keyboard=True
+        )
+
+    @staticmethod
+    def _build_location_keyboard(buttons: Dict[str, str]) -> ReplyKeyboardMarkup:
+        return ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text=buttons['send_location'], request_location=True)]],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+
+    @staticmethod
+    def _build_subscription_keyboard(texts: Dict) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=preset, callback_data=f"sub_{preset}") for preset in SUBSCRIPTION_PRESETS],
+            [InlineKeyboardButton(text=texts['subscription_cancel'], callback_data="sub_off")],
+        ])
+
+    def texts(self, lang: str) -> Dict:
+        """Тексты на языке lang (или на языке по умолчанию, если такого нет)."""
+        return self.locales.get(lang) or self.locales[self.default_language]
+
+    def text(self, lang: str, key: str, **kwargs) -> str:
+        """Текст по ключу; если переданы параметры, подставляет их в шаблон."""
+        template = self.texts(lang)[key]
+        return template.format(**kwargs) if kwargs else template
+
+    def main_keyboard(self, lang: str) -> ReplyKeyboardMarkup:
+        """Основная клавиатура на языке lang."""
+        return self.main_keyboards.get(lang) or self.main_keyboards[self.default_language]
+
+    def location_keyboard(self, lang: str) -> ReplyKeyboardMarkup:
+        """Клавиатура при вводе города: кнопка отправки местоположения вместо названия."""
+        return self.location_keyboards.get(lang) or self.location_keyboards[self.default_language]
+
+    def subscription_keyboard(self, lang: str) -> InlineKeyboardMarkup:
+        """Кнопки выбора времени ежедневной рассылки и отмены подписки на языке lang."""
+        return self.subscription_keyboards.get(lang) or self.subscription_keyboards[self.default_language]
+
+    def button_texts(self, button: str, command: Optional[str] = None) -> List[str]:
+        """Надписи кнопки на всех языках (и команда, если указана) для фильтров обработчиков."""
+        texts = [locale['buttons'][button] for locale in self.locales.values()]
+        return texts + [command] if command else texts
+
+    def weather(self, data: Optional[Dict], lang: str) -> str:
+        """Текст с текущей погодой; для одних и тех же данных форматируется один раз."""
+        if not data:
+            return self.text(lang, 'weather_missing')
+        # Ответ по координатам ячейки геосетки несет ID ближайшего города, но погоду в другой точке:
+        # координаты в ключе отделяют его от ответа для самого города
+        coord = data.get('coord') or {}
+        key = (data.get('id') or data['name'], coord.get('lat'), coord.get('lon'), lang, data.get('dt'))
+        text = self.weather_cache.get(key) if key[-1] is not None else None
+        if text is None:
+            main = data['main']
+            text = self.text(
+                lang, 'weather',
+                name=data['name'],
+                temp=main['temp'],
+                feels_like=main['feels_like'],
+                description=data['weather'][0]['description'].capitalize(),
+                humidity=main['humidity'],
+                wind=data['wind']['speed'],
+            )
+            if key[-1] is not None:
+                self.weather_cache.set(key, text)
+        return text + self._stale_note(data.get('stale_age'), lang)
+
+    def forecast(self, forecast: Optional[Forecast], lang: str) -> str:
+        """Прогноз погоды по дням; для одних и тех же данных форматируется один раз."""
+        if not forecast:
+            return self.text(lang, 'forecast_missing')
+        key = (forecast.city_id or forecast.city_name, lang, forecast.dt)
+        text = self.forecast_cache.get(key)
+        if text is None:
+            texts = self.texts(lang)
+            result = [texts['forecast_header'].format(city=forecast.city_name)]
+            item_template = texts['forecast_item']
+            for day in forecast.daily():
+                result.append(item_template.format(
+                    date=f"{texts['weekdays'][day.date.weekday()]}, {day.date:%d.%m}",
+                    temp_min=day.temp_min,
+                    temp_max=day.temp_max,
+                    temp_mean=day.temp_mean,
+                    description=day.description,
+                    humidity=day.humidity,
+                    wind=day.wind_max,
+                ))
+            text = "\n".join(result)
+            self.forecast_cache.set(key, text)
+        return text + self._stale_note(forecast.stale_age, lang)
+
+    def _stale_note(self, age: Optional[float], lang: str) -> str:
+        """Предупреждение для устаревших данных, отданных из-за сбоя API (age - их возраст, сек)."""
+        if age is None:
+            return ''
+        return self.text(lang, 'stale_note', minutes=max(1, round(age / 60)))
+
+    def get_cache_stats(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает статистику кэшей отформатированных ответов."""
+        return {'weather': self.weather_cache.get_stats(), 'forecast': self.forecast_cache.get_stats()}
+
+
+# Глобальный экземпляр для использования в проекте
+renderer = Renderer()
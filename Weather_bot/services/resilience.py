@@ -0,0 +1,83 @@
+import random
+import time
+from typing import Optional
+
+import aiohttp
+
+
+class CircuitOpenError(aiohttp.ClientError):
+    """Запрос не отправлен: внешний API недавно не отвечал, и автомат разомкнут."""
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель для внешнего API.
+
+    После failure_threshold неудач подряд автомат размыкается и запросы сразу завершаются ошибкой.
+    Через reset_timeout секунд пропускается один пробный запрос: успех замыкает автомат, неудача снова размыкает.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0  # сколько раз автомат размыкался
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос (в полуоткрытом состоянии - только один пробный)."""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release(self) -> None:
+        """Пробный запрос, разрешенный allow(), не был отправлен: следующий запрос сможет стать пробным."""
+        self._probing = False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (self._opened_at is None and self.failures >= self.failure_threshold):
+            self.opened += 1
+            self._opened_at = time.monotonic()
+        self._probing = False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах или None, если его нет или оно не число."""
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def backoff_delay(attempt: int, base: float, cap: float, retry_after: Optional[str] = None) -> float:
+    """
+    Пауза перед повтором номер attempt (с нуля): экспонента со случайным разбросом ("full jitter"),
+    чтобы повторы многих запросов не приходили к API одновременно. Retry-After от сервера имеет приоритет.
+    """
+    seconds = parse_retry_after(retry_after)
+    if seconds is not None:
+        return min(cap, seconds)
+    return random.uniform(0, min(cap, base * 2 ** attempt))
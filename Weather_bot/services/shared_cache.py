@@ -0,0 +1,92 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Optional, Tuple
+
+
+class SharedCache:
+    """Кэш ответов API, общий для нескольких процессов бота (второй уровень после TTLCache)."""
+
+    async def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        """Возвращает (значение, возраст в секундах) или None, если записи нет или она устарела."""
+        raise NotImplementedError
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        """Сохраняет значение на ttl секунд."""
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        """Освобождает ресурсы кэша."""
+
+
+class SQLiteSharedCache(SharedCache):
+    """Общий кэш в файле SQLite для процессов на одном сервере."""
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(str(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS api_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    async def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        now = time.time()
+        row = self.conn.execute(
+            "SELECT value, stored_at FROM api_cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return (json.loads(row[0]), now - row[1]) if row else None
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO api_cache (key, value, stored_at, expires_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now, now + ttl)
+            )
+            # Заодно удаляем устаревшие записи, чтобы файл не рос бесконечно
+            self.conn.execute("DELETE FROM api_cache WHERE expires_at <= ?", (now,))
+
+    async def close(self) -> None:
+        self.conn.close()
+
+
+class RedisSharedCache(SharedCache):
+    """Общий кэш в Redis (или совместимом сервере) для процессов на разных серверах."""
+
+    def __init__(self, url: str, prefix: str = 'weather:'):
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise RuntimeError("Для SHARED_CACHE=redis установите пакет redis") from None
+        self.redis = Redis.from_url(url)
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Tuple[Any, float]]:
+        raw = await self.redis.get(self.prefix + key)
+        if raw is None:
+            return None
+        entry = json.loads(raw)
+        return entry['value'], time.time() - entry['stored_at']
+
+    async def set(self, key: str, value: Any, ttl: float) -> None:
+        entry = json.dumps({'value': value, 'stored_at': time.time()}, ensure_ascii=False)
+        await self.redis.set(self.prefix + key, entry, px=int(ttl * 1000))
+
+    async def close(self) -> None:
+        await self.redis.aclose()
+
+
+def create_shared_cache(kind: str, db_path: str, redis_url: str) -> Optional[SharedCache]:
+    """Создает общий кэш по названию из конфигурации; пустое название - без общего кэша."""
+    if not kind:
+        return None
+    if kind == 'sqlite':
+        return SQLiteSharedCache(db_path)
+    if kind == 'redis':
+        return RedisSharedCache(redis_url)
+    raise ValueError(f"Неизвестный общий кэш: {kind}")
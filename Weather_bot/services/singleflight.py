@@ -0,0 +1,36 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """Объединение одновременных одинаковых запросов в один вызов (single-flight)."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self.shared = 0  # сколько вызовов получили результат чужого запроса
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func для ключа key, если такой вызов еще не выполняется,
+        иначе дожидается уже запущенного. Все ожидающие получают один и тот же
+        результат или одно и то же исключение.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.shared += 1
+        # shield: отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        """Удаляет завершенный вызов, чтобы следующий запрос ушел в API заново."""
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # помечаем исключение как полученное
+
+    def __len__(self) -> int:
+        return len(self._calls)
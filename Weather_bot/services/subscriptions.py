@@ -0,0 +1,203 @@
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import SUBSCRIPTION_SLOT, BROADCAST_CONCURRENCY
+from services.broadcast import Broadcaster
+from services.metrics import metrics
+from services.render import renderer
+from services.weather_api import CityQuery, WeatherAPI
+from storage.storage import Storage
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTION_MESSAGES = metrics.counter('subscription_messages_total', 'Сообщений ежедневной рассылки по результату',
+                                        ['result'])
+SUBSCRIPTION_GROUPS = metrics.counter('subscription_groups_total', 'Групп (город, язык) ежедневной рассылки')
+
+_TIME_RE = re.compile(r'^\s*(\d{1,2})[:.](\d{2})\s*$')
+
+
+def parse_notify_time(text: str, slot_minutes: int = SUBSCRIPTION_SLOT) -> Optional[str]:
+    """Разбирает время "ЧЧ:ММ" (или "ЧЧ.ММ") и округляет его вниз до слота рассылки; None, если время неверное."""
+    match = _TIME_RE.match(text or '')
+    if not match:
+        return None
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    if hours > 23 or minutes > 59:
+        return None
+    minutes -= minutes % slot_minutes
+    return f"{hours:02d}:{minutes:02d}"
+
+
+class SubscriptionScheduler:
+    """
+    Ежедневная рассылка погоды подписчикам.
+
+    В начале каждого слота (slot_minutes минут) подписчики слота группируются по (город, язык):
+    погода и прогноз запрашиваются и форматируются один раз на группу, а готовый текст
+    рассылается всем подписчикам группы через ограничитель частоты рассыльщика.
+    """
+
+    def __init__(self, weather_api: WeatherAPI, storage: Storage, broadcaster: Broadcaster,
+                 slot_minutes: int = SUBSCRIPTION_SLOT,
+                 concurrency: int = BROADCAST_CONCURRENCY):
+        """
+        Args:
+            weather_api: Клиент API погоды.
+            storage: Хранилище с подписками пользователей.
+            broadcaster: Рассыльщик, через ограничитель которого отправляются сообщения.
+            slot_minutes: Шаг времени рассылки, мин.
+            concurrency: Одновременных отправок.
+        """
+        self.weather_api = weather_api
+        self.storage = storage
+        self.broadcaster = broadcaster
+        self.slot_seconds = slot_minutes * 60
+        self.slots_per_day = 24 * 60 // slot_minutes
+        self.concurrency = concurrency
+        # Местный день последней отправки каждому подписчику: после смены часового пояса (переход
+        # на летнее время) подписчик может попасть в еще не пройденный слот, но второй раз за день
+        # рассылку не получит
+        self._sent_on: Dict[int, int] = {}
+        self._pruned_day: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _slot_at(self, timestamp: float) -> int:
+        return int(timestamp % 86400 // self.slot_seconds)
+
+    async def _loop(self) -> None:
+        last = self._slot_at(time.time())
+        while True:
+            now = time.time()
+            await asyncio.sleep(self.slot_seconds - now % self.slot_seconds)
+            current = self._slot_at(time.time())
+            # Слоты, пропущенные из-за долгой рассылки, обрабатываются по порядку
+            while last != current:
+                last = (last + 1) % self.slots_per_day
+                try:
+                    sent = await self.run_once(last)
+                    if sent:
+                        logger.info(f"Ежедневная рассылка (слот {last}): отправлено {sent} сообщений")
+                except Exception as e:
+                    logger.error(f"Ошибка ежедневной рассылки (слот {last}): {e!r}")
+
+    def _group(self, user_ids: List[int]) -> Dict[Tuple[CityQuery, str], List[int]]:
+        """Группирует подписчиков по (город, язык); город - ID OpenWeatherMap, если он известен."""
+        groups: Dict[Tuple[CityQuery, str], List[int]] = {}
+        for user_id in user_ids:
+            settings = self.storage.get_user_settings(user_id)
+            if not settings.city:
+                continue
+            city = settings.city_id if settings.city_id is not None else settings.city
+            groups.setdefault((city, settings.language), []).append(user_id)
+        return groups
+
+    async def _render(self, city: CityQuery, lang: str) -> Tuple[Optional[str], Optional[int]]:
+        """Текст рассылки для группы и смещение времени города от UTC (None, если данных нет)."""
+        # Рассылка - фоновая работа: квоту API в первую очередь получают запросы пользователей
+        weather = await self.weather_api.get_weather(city, lang, background=True)
+        forecast = await self.weather_api.get_forecast(city, lang, background=True)
+        if not weather and not forecast:
+            return None, None
+        parts = [renderer.text(lang, 'subscription_header')]
+        if weather:
+            parts.append(renderer.weather(weather, lang))
+        if forecast:
+            parts.append(renderer.forecast(forecast, lang))
+        return "\n\n".join(parts), weather.get('timezone') if weather else None
+
+    def _local_day(self, user_id: int, now: float) -> int:
+        """Номер текущего дня по местному времени подписчика."""
+        user = self.storage.get_user(user_id)
+        utc_offset = user.utc_offset if user is not None and user.utc_offset is not None else 0
+        return int((now + utc_offset) // 86400)
+
+    def _prune_sent(self, now: float) -> None:
+        """
+        Раз в сутки удаляет отметки об отправке, которые уже не могут совпасть с текущим местным днем
+        (местный день отличается от дня по UTC не больше чем на сутки), в том числе отписавшихся.
+        """
+        utc_day = int(now // 86400)
+        if self._pruned_day != utc_day:
+            self._pruned_day = utc_day
+            self._sent_on = {user_id: day for user_id, day in self._sent_on.items() if day >= utc_day - 1}
+
+    async def run_once(self, slot: int) -> int:
+        """
+        Рассылает погоду подписчикам слота и возвращает число отправленных сообщений.
+        Изменения смещения от UTC применяются к расписанию только после рассылки всего слота.
+        """
+        self._prune_sent(time.time())
+        groups = self._group(self.storage.get_subscribers(slot))
+        if not groups:
+            return 0
+
+        # Текущая погода для городов с известным ID обновляется пачками (запросами group)
+        api = self.weather_api
+        stale: Dict[str, List[CityQuery]] = {}
+        for city, lang in groups:
+            age = api.weather_cache.age(api._cache_key(city, lang))
+            if isinstance(city, int) and (age is None or age > api.weather_cache.ttl):
+                stale.setdefault(lang, []).append(city)
+        for lang, cities in stale.items():
+            await api.refresh_weather_group(cities, lang)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user_id: int, text: str) -> str:
+            async with semaphore:
+                return await self.broadcaster.send(user_id, text)
+
+        sent = 0
+        offset_changes: List[Tuple[List[int], int]] = []
+        for (city, lang), user_ids in groups.items():
+            now = time.time()
+            days = {user_id: self._local_day(user_id, now) for user_id in user_ids}
+            user_ids = [user_id for user_id in user_ids if self._sent_on.get(user_id) != days[user_id]]
+            if not user_ids:
+                continue
+            SUBSCRIPTION_GROUPS.inc()
+            text, utc_offset = await self._render(city, lang)
+            if text is None:
+                SUBSCRIPTION_MESSAGES.labels('failed').inc(len(user_ids))
+                continue
+            if utc_offset is not None:
+                offset_changes.append((user_ids, utc_offset))
+            results = await asyncio.gather(*(send(user_id, text) for user_id in user_ids))
+            for user_id, result in zip(user_ids, results):
+                SUBSCRIPTION_MESSAGES.labels(result).inc()
+                if result == 'success':
+                    self._sent_on[user_id] = days[user_id]
+                    sent += 1
+        # Подписчик, перенесенный в другой слот, больше не меняет состав уже запущенной рассылки
+        for user_ids, utc_offset in offset_changes:
+            await self._update_offsets(user_ids, utc_offset)
+        return sent
+
+    async def _update_offsets(self, user_ids: List[int], utc_offset: int) -> None:
+        """Обновляет смещение от UTC у подписчиков, если оно изменилось (например, при переходе на летнее время)."""
+        for user_id in user_ids:
+            user = self.storage.get_user(user_id)
+            if user is not None and user.notify_at and user.utc_offset != utc_offset:
+                await self.storage.set_user_subscription(user_id, user.notify_at, utc_offset)
@@ -0,0 +1,144 @@
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, NamedTuple, Optional, Tuple
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    THROTTLE_LIMITS,
+    THROTTLE_DUPLICATE_WINDOW,
+    THROTTLE_AUTO_BAN,
+    THROTTLE_BAN_THRESHOLD,
+    THROTTLE_BAN_WINDOW,
+    THROTTLE_IDLE_TTL,
+    THROTTLE_MAX_USERS,
+)
+from services.rate_limit import TokenBucket
+
+
+class Decision(NamedTuple):
+    """Решение ограничителя: действие и через сколько секунд пользователь снова может отправить запрос."""
+    action: str
+    retry_after: float = 0.0
+
+
+class _UserState:
+    """Состояние одного пользователя в ограничителе."""
+
+    __slots__ = ('buckets', 'last_key', 'last_time', 'strikes', 'strikes_since', 'warned_until', 'seen')
+
+    def __init__(self, now: float):
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.last_key: Optional[Hashable] = None
+        self.last_time = 0.0
+        self.strikes = 0  # отклоненных запросов с момента strikes_since
+        self.strikes_since = now
+        self.warned_until = 0.0  # до этого момента пользователь уже предупрежден
+        self.seen = now
+
+
+class UserThrottler:
+    """
+    Ограничение частоты запросов каждого пользователя.
+
+    Для каждого типа команды у пользователя свое ведро с токенами (limits: тип -> (запросов, секунд)).
+    Повтор того же нажатия в пределах duplicate_window отбрасывается. Пользователь, превысивший лимит,
+    получает одно предупреждение, дальше его запросы молча отбрасываются; если отклоненных запросов
+    за ban_window набирается ban_threshold, ограничитель предлагает забанить пользователя (при auto_ban).
+    Состояния неактивных пользователей удаляются через idle_ttl, всего хранится не больше max_users.
+    """
+
+    ALLOW = 'allow'
+    DUPLICATE = 'duplicate'  # повтор нажатия: отбросить без ответа
+    WARN = 'warn'  # лимит превышен: предупредить пользователя
+    DROP = 'drop'  # лимит превышен, предупреждение уже было: отбросить без ответа
+    BAN = 'ban'  # пользователь продолжает флуд: забанить
+
+    def __init__(self,
+                 limits: Dict[str, Tuple[float, float]] = THROTTLE_LIMITS,
+                 duplicate_window: float = THROTTLE_DUPLICATE_WINDOW,
+                 auto_ban: bool = THROTTLE_AUTO_BAN,
+                 ban_threshold: int = THROTTLE_BAN_THRESHOLD,
+                 ban_window: float = THROTTLE_BAN_WINDOW,
+                 idle_ttl: float = THROTTLE_IDLE_TTL,
+                 max_users: int = THROTTLE_MAX_USERS):
+        self.limits = limits
+        self.duplicate_window = duplicate_window
+        self.auto_ban = auto_ban
+        self.ban_threshold = ban_threshold
+        self.ban_window = ban_window
+        self.idle_ttl = idle_ttl
+        self.max_users = max_users
+        self._users: "OrderedDict[int, _UserState]" = OrderedDict()
+        self.counts = {self.DUPLICATE: 0, self.WARN: 0, self.DROP: 0, self.BAN: 0}
+
+    def _state(self, user_id: int, now: float) -> _UserState:
+        """Состояние пользователя; заодно удаляет давно неактивных пользователей."""
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState(now)
+        else:
+            self._users.move_to_end(user_id)
+        state.seen = now
+        # Пользователи упорядочены по последней активности, поэтому неактивные - в начале
+        while self._users:
+            oldest_id, oldest = next(iter(self._users.items()))
+            if len(self._users) <= self.max_users and now - oldest.seen <= self.idle_ttl:
+                break
+            del self._users[oldest_id]
+        return state
+
+    def _bucket(self, state: _UserState, kind: str) -> TokenBucket:
+        if kind not in self.limits:
+            kind = 'default'
+        bucket = state.buckets.get(kind)
+        if bucket is None:
+            count, period = self.limits.get(kind, (math.inf, 1.0))
+            bucket = state.buckets[kind] = TokenBucket(count / period, count)
+        return bucket
+
+    def check(self, user_id: int, kind: str, key: Hashable) -> Decision:
+        """
+        Решает, обрабатывать ли запрос пользователя.
+
+        Args:
+            user_id: ID пользователя.
+            kind: Тип команды (ключ в limits; неизвестные типы считаются 'default').
+            key: Содержимое запроса (текст или данные кнопки) для распознавания повторных нажатий.
+        """
+        now = time.monotonic()
+        state = self._state(user_id, now)
+        if key == state.last_key and now - state.last_time < self.duplicate_window:
+            self.counts[self.DUPLICATE] += 1
+            return Decision(self.DUPLICATE)
+        state.last_key, state.last_time = key, now
+
+        bucket = self._bucket(state, kind)
+        if bucket.try_acquire():
+            return Decision(self.ALLOW)
+
+        retry_after = bucket.delay()
+        if now - state.strikes_since > self.ban_window:
+            state.strikes, state.strikes_since = 0, now
+        state.strikes += 1
+        if self.auto_ban and state.strikes >= self.ban_threshold:
+            del self._users[user_id]
+            action = self.BAN
+        elif now >= state.warned_until:
+            state.warned_until = now + retry_after
+            action = self.WARN
+        else:
+            action = self.DROP
+        self.counts[action] += 1
+        return Decision(action, retry_after)
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def get_stats(self) -> Dict[str, int]:
+        """Число отклоненных запросов по причинам и число пользователей в памяти."""
+        return {**self.counts, 'users': len(self._users)}
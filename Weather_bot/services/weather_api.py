@@ -1,115 +1,419 @@
-import requests
+import asyncio
+import aiohttp
 import logging
-from typing import Optional, Dict
+import time
+from typing import Optional, Dict, List, Tuple, Union
 
 import sys
 from pathlib import Path
 
 # Добавляем корень проекта в PYTHONPATH
 sys.path.append(str(Path(__file__).parent.parent))
-from config.config import WEATHER_API_KEY
+from config.config import (
+    WEATHER_API_BASE_URL,
+    WEATHER_API_TIMEOUT,
+    WEATHER_API_MAX_CONNECTIONS,
+    WEATHER_API_MAX_CONCURRENCY,
+    WEATHER_API_KEEPALIVE,
+    WEATHER_API_RETRIES,
+    WEATHER_API_RETRY_BASE,
+    WEATHER_API_RETRY_MAX,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_RESET_TIMEOUT,
+    WEATHER_CACHE_TTL,
+    FORECAST_CACHE_TTL,
+    CACHE_MAX_SIZE,
+    WEATHER_STALE_TTL,
+    WEATHER_STALE_WAIT,
+    SHARED_CACHE,
+    SHARED_DB_PATH,
+    REDIS_URL,
+)
+from services.cache import TTLCache
+from services.resilience import CircuitBreaker, CircuitOpenError, backoff_delay, parse_retry_after
+from services.quota import QuotaManager, QuotaExceededError
+from services.metrics import metrics
+from services.shared_cache import SharedCache, create_shared_cache
+from services.singleflight import SingleFlight
+from services.geocoding import normalize_city_name
+from services.forecast import Forecast
+from services.render import renderer
+
+# Город задается ID OpenWeatherMap или, если ID еще неизвестен, названием;
+# место по координатам - центром ячейки геосетки (широта, долгота), см. services/geogrid.py
+CityQuery = Union[int, str, Tuple[float, float]]
+
+API_SECONDS = metrics.histogram('weather_api_request_seconds', 'Длительность запросов к OpenWeatherMap', ['endpoint'])
+API_REQUESTS = metrics.counter('weather_api_requests_total', 'Запросов к OpenWeatherMap по результату',
+                               ['endpoint', 'status'])
+
 
 class WeatherAPI:
-    """Класс для работы с API OpenWeatherMap."""
+    """Асинхронный клиент API OpenWeatherMap с общим пулом соединений."""
+
+    BASE_URL = WEATHER_API_BASE_URL
+    GROUP_MAX_IDS = 20  # максимум городов в одном запросе group
+
+    def __init__(self,
+                 timeout: float = WEATHER_API_TIMEOUT,
+                 max_connections: int = WEATHER_API_MAX_CONNECTIONS,
+                 max_concurrency: int = WEATHER_API_MAX_CONCURRENCY,
+                 keepalive: float = WEATHER_API_KEEPALIVE,
+                 shared_cache: Optional[SharedCache] = None):
+        """
+        Инициализация клиента.
 
-    BASE_URL = "http://api.openweathermap.org/data/2.5/"
+        Args:
+            timeout: Таймаут одного запроса в секундах.
+            max_connections: Размер пула соединений.
+            max_concurrency: Максимальное число одновременных запросов к API.
+            keepalive: Время жизни простаивающего соединения в секундах.
+            shared_cache: Общий для процессов бота кэш второго уровня; по умолчанию выбирается по SHARED_CACHE.
+        """
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.keepalive = keepalive
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.weather_cache = TTLCache(WEATHER_CACHE_TTL, CACHE_MAX_SIZE)
+        self.forecast_cache = TTLCache(FORECAST_CACHE_TTL, CACHE_MAX_SIZE)
+        self._inflight = SingleFlight()
+        # Общий кэш по SHARED_CACHE создается при первом обращении (см. shared_cache)
+        self._shared_cache = shared_cache
+        self._shared_cache_created = shared_cache is not None
+        self.shared_hits = 0
+        self.retries = WEATHER_API_RETRIES
+        self.breaker = CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT)
+        self.quota = QuotaManager()
+        self.stale_ttl = WEATHER_STALE_TTL
+        self.stale_wait = WEATHER_STALE_WAIT
+        self.retried = 0  # повторных запросов к API
+        self.stale_served = 0  # ответов устаревшими данными из-за сбоя или медленного API
+        self.city_ids: Dict[str, int] = {}  # нормализованное название -> ID города OpenWeatherMap
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        """Счетчики кэшей, очередей и автомата читаются метриками в момент запроса /metrics."""
+        caches = {'weather': self.weather_cache, 'forecast': self.forecast_cache}
+        metrics.callback('weather_cache_hits_total', 'Попаданий в кэш ответов API', 'counter',
+                         lambda: {(name,): cache.hits for name, cache in caches.items()}, ['cache'])
+        metrics.callback('weather_cache_misses_total', 'Промахов кэша ответов API', 'counter',
+                         lambda: {(name,): cache.misses for name, cache in caches.items()}, ['cache'])
+        metrics.callback('weather_cache_entries', 'Записей в кэше ответов API', 'gauge',
+                         lambda: {(name,): len(cache) for name, cache in caches.items()}, ['cache'])
+        metrics.callback('weather_api_inflight', 'Выполняющихся запросов к API (после объединения)', 'gauge',
+                         lambda: len(self._inflight))
+        metrics.callback('weather_api_coalesced_total', 'Вызовов, объединенных с уже идущим запросом', 'counter',
+                         lambda: self._inflight.shared)
+        metrics.callback('weather_api_circuit_open', '1, если автомат разомкнут и запросы к API не отправляются',
+                         'gauge', lambda: int(self.breaker.state == self.breaker.OPEN))
+        metrics.callback('weather_api_stale_served_total', 'Ответов устаревшими данными', 'counter',
+                         lambda: self.stale_served)
+        metrics.callback('weather_api_quota_rejected_total', 'Запросов, не отправленных из-за квоты', 'counter',
+                         lambda: self.quota.rejected)
+        metrics.callback('weather_api_quota_waiting', 'Запросов пользователей, ожидающих квоту', 'gauge',
+                         lambda: self.quota._waiting)
+
+    @property
+    def shared_cache(self) -> Optional[SharedCache]:
+        """Общий кэш процессов бота; создается при первом запросе, поэтому импорт модуля не открывает файлы."""
+        if not self._shared_cache_created:
+            self._shared_cache_created = True
+            self._shared_cache = create_shared_cache(SHARED_CACHE, SHARED_DB_PATH, REDIS_URL)
+        return self._shared_cache
 
     @staticmethod
-    def get_weather(city: str, lang: str = 'ru') -> Optional[Dict]:
-        """Получение текущей погоды для указанного города."""
-        try:
-            response = requests.get(
-                f"{WeatherAPI.BASE_URL}weather",
-                params={
-                    'q': city,
-                    'appid': WEATHER_API_KEY,
-                    'units': 'metric',
-                    'lang': lang
-                },
-                timeout=10
+    def _cache_key(city: CityQuery, lang: str) -> tuple:
+        """Ключ кэша: ID города, нормализованное название или ячейка геосетки + язык."""
+        if isinstance(city, str):
+            return normalize_city_name(city), lang
+        return city, lang
+
+    @staticmethod
+    def _location_params(city: CityQuery) -> Dict:
+        """Параметры запроса, задающие место: ID города, координаты центра ячейки или название."""
+        if isinstance(city, int):
+            return {'id': city}
+        if isinstance(city, tuple):
+            return {'lat': city[0], 'lon': city[1]}
+        return {'q': city}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая её при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive,
             )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Weather API error: {e}")
-            return None
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self) -> None:
+        """Закрывает сессию и освобождает соединения пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._shared_cache is not None:
+            await self._shared_cache.close()
 
     @staticmethod
-    def get_forecast(city: str, lang: str = 'ru') -> Optional[Dict]:
-        """Получение прогноза погоды на 4 дня."""
+    def _shared_key(endpoint: str, key: tuple) -> str:
+        return ':'.join(map(str, (endpoint,) + key))
+
+    async def _shared_get(self, endpoint: str, key: tuple) -> Optional[Tuple[Dict, float]]:
+        """Ищет ответ в общем кэше; ошибки общего кэша не мешают запросу к API."""
+        if self.shared_cache is None:
+            return None
         try:
-            response = requests.get(
-                f"{WeatherAPI.BASE_URL}forecast",
-                params={
-                    'q': city,
-                    'appid': WEATHER_API_KEY,
-                    'units': 'metric',
-                    'lang': lang,
-                    'cnt': 4  # Количество дней прогноза
-                },
-                timeout=10
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Weather forecast API error: {e}")
+            cached = await self.shared_cache.get(self._shared_key(endpoint, key))
+            if cached is not None and endpoint == 'forecast':
+                cached = (Forecast.from_dict(cached[0]), cached[1])
+            return cached
+        except Exception as e:
+            logging.error(f"Shared cache error: {e!r}")
             return None
 
+    async def _shared_set(self, endpoint: str, key: tuple, data: Union[Dict, Forecast], ttl: float) -> None:
+        """Сохраняет ответ в общий кэш, чтобы его не запрашивали другие процессы бота."""
+        if self.shared_cache is None:
+            return
+        try:
+            value = data.to_dict() if isinstance(data, Forecast) else data
+            await self.shared_cache.set(self._shared_key(endpoint, key), value, ttl)
+        except Exception as e:
+            logging.error(f"Shared cache error: {e!r}")
+
+    async def _request(self, endpoint: str, params: Dict, background: bool = False) -> Dict:
+        """
+        Выполняет GET-запрос к API и возвращает декодированный JSON.
+
+        Если API недавно не отвечал, автомат разомкнут и запрос сразу завершается CircuitOpenError,
+        не расходуя квоту. Каждая отправленная попытка расходует квоту одного из ключей API; фоновые
+        запросы (background) уступают квоту запросам пользователей. Если квоты нет, запрос завершается
+        QuotaExceededError. При 429, 5xx, сетевых ошибках и неразборчивом ответе запрос повторяется
+        до self.retries раз с паузами со случайным разбросом.
+        """
+        probe = self.breaker.state != self.breaker.CLOSED
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"Weather API недоступен, повтор через {self.breaker.reset_timeout:.0f} с")
+        try:
+            key = await self.quota.acquire(background)
+        except QuotaExceededError:
+            if probe:
+                self.breaker.release()
+            raise
+        params = {'units': 'metric', **params}
+        settled = False  # результат учтен автоматом (record_success или record_failure)
+        attempt = 0
+        try:
+            while True:
+                retry_after = None
+                status = 'error'
+                started = None
+                try:
+                    async with self._semaphore:
+                        started = time.perf_counter()
+                        async with self._get_session().get(f"{self.BASE_URL}{endpoint}",
+                                                           params={'appid': key, **params}) as response:
+                            status = str(response.status)
+                            response.raise_for_status()
+                            data = await response.json()
+                except (aiohttp.ContentTypeError, ValueError) as e:
+                    # Ответ 200 с обрезанным или испорченным телом - такой же сбой API, как 5xx
+                    error = aiohttp.ClientPayloadError(f"Неверный ответ API ({endpoint}): {e}")
+                    status = 'invalid'
+                except aiohttp.ClientResponseError as e:
+                    if e.status != 429 and e.status < 500:
+                        # API ответил (например, 404 - город не найден), значит, он работает
+                        settled = True
+                        self.breaker.record_success()
+                        raise
+                    error = e
+                    retry_after = e.headers.get('Retry-After') if e.headers else None
+                    if e.status == 429:
+                        # Лимит этого ключа исчерпан: повтор пойдет по другому ключу, если он есть
+                        self.quota.report_rate_limited(key, parse_retry_after(retry_after) or 60)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                    if isinstance(e, asyncio.TimeoutError):
+                        status = 'timeout'
+                else:
+                    settled = True
+                    self.breaker.record_success()
+                    return data
+                finally:
+                    if started is not None:
+                        API_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+                    API_REQUESTS.labels(endpoint, status).inc()
+                if attempt >= self.retries:
+                    settled = True
+                    self.breaker.record_failure()
+                    raise error
+                await asyncio.sleep(backoff_delay(attempt, WEATHER_API_RETRY_BASE, WEATHER_API_RETRY_MAX,
+                                                  retry_after))
+                if not probe and self.breaker.state != self.breaker.CLOSED:
+                    # Пока запрос ждал повтора, автомат разомкнули другие запросы: квоту на повтор не тратим
+                    raise error
+                attempt += 1
+                self.retried += 1
+                try:
+                    key = await self.quota.acquire(background)
+                except QuotaExceededError:
+                    settled = True
+                    self.breaker.record_failure()
+                    raise error
+        finally:
+            if probe and not settled:
+                # Пробный запрос отменен или прерван непредвиденной ошибкой: иначе автомат
+                # ждал бы его результата до перезапуска
+                self.breaker.release()
+
+    async def _fetch(self, endpoint: str, key: tuple, params: Dict, cache: TTLCache,
+                     use_shared: bool = True, background: bool = False) -> Union[Dict, Forecast]:
+        """
+        Запрос к API, общий для всех одновременных вызовов с тем же (endpoint, город, язык).
+        Сначала проверяется общий кэш процессов бота (если use_shared).
+        Успешный ответ один раз кладется в кэш; ошибка передается всем ожидающим.
+        Прогноз сразу разбирается в компактный Forecast.
+        """
+        async def call() -> Union[Dict, Forecast]:
+            shared = await self._shared_get(endpoint, key) if use_shared else None
+            if shared is not None:
+                data, age = shared
+                self.shared_hits += 1
+            else:
+                try:
+                    data = await self._request(endpoint, params, background)
+                except (CircuitOpenError, QuotaExceededError):
+                    raise
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logging.error(f"Weather API error ({endpoint}, {key[0]}): {e!r}")
+                    raise
+                if endpoint == 'forecast':
+                    data = Forecast.from_api(data)
+                age = 0.0
+            cache.set(key, data, age=age)
+            keys = [key]
+            if endpoint == 'weather' and isinstance(key[0], str) and 'id' in data:
+                # Запомним ID города: следующие запросы пойдут по ID и попадут в тот же кэш
+                self.city_ids[key[0]] = data['id']
+                cache.set((data['id'],) + key[1:], data, age=age)
+                keys.append((data['id'],) + key[1:])
+            if shared is None:
+                for cache_key in keys:
+                    await self._shared_set(endpoint, cache_key, data, cache.ttl)
+            return data
+        return await self._inflight.do((endpoint,) + key, call)
+
+    async def _get(self, endpoint: str, city: CityQuery, lang: str, params: Dict, cache: TTLCache,
+                   force_refresh: bool, background: bool) -> Optional[Union[Dict, Forecast]]:
+        """
+        Ответ из кэша или от API. Если API недоступен или отвечает дольше stale_wait, а в кэше есть
+        устаревший ответ (не старше stale_ttl), возвращается его копия с возрастом в поле 'stale_age';
+        запрос к API при этом продолжается в фоне и обновит кэш.
+        """
+        key = self._cache_key(city, lang)
+        if force_refresh:
+            stale = None
+        else:
+            data = cache.get(key)
+            if data is not None:
+                return data
+            stale = cache.get_stale(key, self.stale_ttl)
+        fetch = self._fetch(endpoint, key, {**self._location_params(city), 'lang': lang, **params}, cache,
+                            use_shared=not force_refresh, background=background)
+        try:
+            if stale is None:
+                return await fetch
+            return await asyncio.wait_for(fetch, timeout=self.stale_wait)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if stale is None:
+                return None
+            data, age = stale
+            self.stale_served += 1
+            if isinstance(data, Forecast):
+                return data.with_stale_age(age)
+            return {**data, 'stale_age': age}
+
+    async def get_weather(self, city: CityQuery, lang: str = 'ru', force_refresh: bool = False,
+                          background: bool = False) -> Optional[Dict]:
+        """Получение текущей погоды для указанного города (background - фоновый запрос с низким приоритетом)."""
+        return await self._get('weather', city, lang, {}, self.weather_cache, force_refresh, background)
+
+    async def get_forecast(self, city: CityQuery, lang: str = 'ru', force_refresh: bool = False,
+                           background: bool = False) -> Optional[Forecast]:
+        """
+        Получение прогноза погоды: все 40 трехчасовых интервалов на 5 суток
+        (background - фоновый запрос с низким приоритетом). Сводка по дням - Forecast.daily().
+        """
+        return await self._get('forecast', city, lang, {}, self.forecast_cache, force_refresh, background)
+
+    async def refresh_weather_group(self, cities: List[CityQuery], lang: str = 'ru',
+                                    max_calls: Optional[int] = None) -> Tuple[int, List[str]]:
+        """
+        Обновляет в кэше текущую погоду для нескольких городов запросами group
+        (до GROUP_MAX_IDS городов за вызов) по известным ID городов.
+
+        Returns:
+            Число сделанных запросов и список городов, ID которых еще неизвестен.
+        """
+        by_id: Dict[int, List[tuple]] = {}
+        unknown = []
+        for city in cities:
+            key = self._cache_key(city, lang)
+            city_id = city if isinstance(city, int) else self.city_ids.get(key[0])
+            if city_id is None:
+                unknown.append(city)
+            else:
+                by_id.setdefault(city_id, []).append(key)
+
+        ids = list(by_id)
+        calls = 0
+        for start in range(0, len(ids), self.GROUP_MAX_IDS):
+            if max_calls is not None and calls >= max_calls:
+                break
+            batch = ids[start:start + self.GROUP_MAX_IDS]
+            calls += 1
+            try:
+                data = await self._request('group', {'id': ','.join(map(str, batch)), 'lang': lang},
+                                           background=True)
+            except (CircuitOpenError, QuotaExceededError):
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.error(f"Weather API error (group): {e!r}")
+                continue
+            for item in data.get('list', []):
+                # Элемент group приводится к виду ответа weather: у городов нет кода ответа,
+                # а смещение от UTC лежит в sys.timezone, а не в timezone
+                item.setdefault('cod', 200)
+                if 'timezone' not in item and 'timezone' in item.get('sys', {}):
+                    item['timezone'] = item['sys']['timezone']
+                for key in by_id.get(item.get('id'), []):
+                    self.weather_cache.set(key, item)
+                    await self._shared_set('weather', key, item, self.weather_cache.ttl)
+        return calls, unknown
+
+    def get_cache_stats(self) -> Dict[str, Dict]:
+        """Возвращает статистику кэшей погоды и прогноза."""
+        return {
+            'weather': self.weather_cache.get_stats(),
+            'forecast': self.forecast_cache.get_stats(),
+            'inflight': {'shared': self._inflight.shared, 'pending': len(self._inflight)},
+            'shared_cache': {'hits': self.shared_hits, 'enabled': int(self.shared_cache is not None)},
+            'upstream': {'state': self.breaker.state, 'opened': self.breaker.opened,
+                         'retries': self.retried, 'stale_served': self.stale_served},
+            'quota': {'keys': self.quota.get_stats(), 'rejected': self.quota.rejected},
+        }
+
     @staticmethod
     def format_weather(data: Dict, lang: str = 'ru') -> str:
         """Форматирование данных о текущей погоде в читаемый текст."""
-        if not data:
-            return "Не удалось получить данные о погоде" if lang == 'ru' else "Failed to get weather data"
-
-        weather = data['weather'][0]
-        main = data['main']
-
-        if lang == 'ru':
-            return (
-                f"Погода в {data['name']}:\n"
-                f"🌡 Температура: {main['temp']}°C (ощущается как {main['feels_like']}°C)\n"
-                f"☁ {weather['description'].capitalize()}\n"
-                f"💧 Влажность: {main['humidity']}%\n"
-                f"🌬 Ветер: {data['wind']['speed']} м/с"
-            )
-        else:
-            return (
-                f"Weather in {data['name']}:\n"
-                f"🌡 Temperature: {main['temp']}°C (feels like {main['feels_like']}°C)\n"
-                f"☁ {weather['description'].capitalize()}\n"
-                f"💧 Humidity: {main['humidity']}%\n"
-                f"🌬 Wind: {data['wind']['speed']} m/s"
-            )
+        return renderer.weather(data, lang)
 
     @staticmethod
-    def format_forecast(data: Dict, lang: str = 'ru') -> str:
+    def format_forecast(data: Forecast, lang: str = 'ru') -> str:
         """Форматирование данных прогноза погоды в читаемый текст."""
-        if not data or 'list' not in data:
-            return "Не удалось получить прогноз погоды" if lang == 'ru' else "Failed to get weather forecast"
-
-        city = data['city']['name']
-
-        if lang == 'ru':
-            result = [f"Прогноз погоды в {city} на ближайшие дни:\n"]
-            for item in data['list']:
-                date = item['dt_txt']
-                weather = item['weather'][0]
-                main = item['main']
-                result.append(
-                    f"\n📅 {date}\n"
-                    f"🌡 {main['temp']}°C, {weather['description']}\n"
-                    f"💧 Влажность: {main['humidity']}%"
-                )
-        else:
-            result = [f"Weather forecast in {city} for upcoming days:\n"]
-            for item in data['list']:
-                date = item['dt_txt']
-                weather = item['weather'][0]
-                main = item['main']
-                result.append(
-                    f"\n📅 {date}\n"
-                    f"🌡 {main['temp']}°C, {weather['description']}\n"
-                    f"💧 Humidity: {main['humidity']}%"
-                )
-
-        return "\n".join(result)
+        return renderer.forecast(data, lang)
+
+# Глобальный экземпляр клиента для использования в проекте
+weather_api = WeatherAPI()
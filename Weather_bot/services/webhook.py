@@ -0,0 +1,110 @@
+import asyncio
+import hmac
+import logging
+from typing import List, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+import sys
+from pathlib import Path
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    WEBHOOK_SHUTDOWN_TIMEOUT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookServer:
+    """
+    HTTP-сервер для приема обновлений Telegram через webhook.
+
+    Обновления кладутся в ограниченную очередь и обрабатываются пулом воркеров.
+    Если очередь заполнена, сервер отвечает 503 и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot,
+                 path: str = WEBHOOK_PATH,
+                 secret: Optional[str] = WEBHOOK_SECRET,
+                 queue_size: int = WEBHOOK_QUEUE_SIZE,
+                 workers: int = WEBHOOK_WORKERS):
+        self.dp = dp
+        self.bot = bot
+        self.path = path
+        self.secret = secret
+        self.workers = workers
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.rejected = 0  # обновлений, отклоненных из-за переполнения очереди
+        self._runner: Optional[web.AppRunner] = None
+        self._workers: List[asyncio.Task] = []
+
+    def _create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self._handle_update)
+        app.router.add_get('/healthz', self._handle_health)
+        return app
+
+    async def start(self, host: str, port: int, reuse_port: bool = False) -> None:
+        """
+        Запускает воркеры и HTTP-сервер.
+
+        Args:
+            reuse_port: Разрешить нескольким процессам слушать один порт (SO_REUSEPORT),
+                ядро само распределяет между ними входящие соединения.
+        """
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self._create_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port, reuse_port=reuse_port or None).start()
+        logger.info(f"Webhook-сервер запущен на {host}:{port}{self.path}")
+
+    async def stop(self, timeout: float = WEBHOOK_SHUTDOWN_TIMEOUT) -> None:
+        """Перестает принимать обновления, дожидается обработки очереди и останавливает воркеры."""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не дождались обработки {self.queue.qsize()} обновлений при остановке")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def _handle_update(self, request: web.Request) -> web.Response:
+        if self.secret:
+            token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(token, self.secret):
+                return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({'queue': self.queue.qsize(), 'rejected': self.rejected})
+
+    async def _worker(self) -> None:
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления {update.update_id}: {e!r}")
+            finally:
+                self.queue.task_done()
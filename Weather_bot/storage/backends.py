@@ -0,0 +1,502 @@
+import json
+import logging
+import math
+import os
+import sqlite3
+import struct
+import sys
+import tempfile
+import threading
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from storage.records import UserRecord, share
+from storage.stats import RESOLUTIONS, SeriesRow
+
+Users = Dict[int, UserRecord]
+
+
+def atomic_write_json(file_path: str, data: Any) -> None:
+    """
+    Записывает JSON во временный файл рядом с целевым и атомарно подменяет его,
+    чтобы падение во время записи не оставило обрезанный файл.
+    """
+    directory = os.path.dirname(file_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.json')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+class StorageBackend:
+    """Базовый класс бэкенда, в котором Storage хранит пользовательские данные."""
+
+    # Может ли база одновременно использоваться несколькими процессами бота
+    supports_sharing = False
+    # Сохраняет ли бэкенд всех пользователей целиком (тогда до полной загрузки сохранять нельзя)
+    saves_all_users = False
+
+    def load_users(self) -> Users:
+        """Загружает всех пользователей в виде {user_id: UserRecord}."""
+        users = {}
+        for batch in self.iter_users(sys.maxsize):
+            users.update(batch)
+        return users
+
+    def iter_users(self, batch_size: int) -> Iterator[Users]:
+        """Загружает всех пользователей пачками не больше batch_size (для постепенной загрузки при запуске)."""
+        raise NotImplementedError
+
+    def save_users(self, users: Users, all_users: Users) -> int:
+        """
+        Сохраняет измененных пользователей.
+
+        Args:
+            users: Пользователи, данные которых изменились.
+            all_users: Все пользователи (нужны бэкендам, которые не умеют обновлять записи по одной).
+
+        Returns:
+            Примерный объем записанных данных в байтах.
+        """
+        raise NotImplementedError
+
+    def load_user(self, user_id: int) -> Optional[UserRecord]:
+        """Загружает одного пользователя (только для бэкендов с supports_sharing, без загрузки остальных)."""
+        raise NotImplementedError
+
+    def get_version(self) -> int:
+        """Номер последнего изменения пользователей (только для бэкендов с supports_sharing)."""
+        raise NotImplementedError
+
+    def load_changed_users(self, since: int) -> Tuple[Users, int]:
+        """
+        Загружает пользователей, измененных после изменения с номером since
+        (только для бэкендов с supports_sharing).
+
+        Returns:
+            Измененные пользователи и номер последнего из загруженных изменений.
+        """
+        raise NotImplementedError
+
+    def load_stats(self) -> Tuple[Dict[str, int], List[SeriesRow]]:
+        """Загружает сохраненные счетчики статистики и их временные ряды."""
+        return {}, []
+
+    def save_stats(self, deltas: Dict[str, int], series: List[SeriesRow]) -> None:
+        """Добавляет приращения к сохраненным счетчикам и временным рядам."""
+
+    def close(self) -> None:
+        """Освобождает ресурсы бэкенда."""
+
+
+class JSONBackend(StorageBackend):
+    """Хранение всех пользователей в одном JSON-файле (файл перезаписывается целиком)."""
+
+    saves_all_users = True
+
+    def __init__(self, file_path: str):
+        self.file_path = str(file_path)
+        # Статистика хранится отдельно, чтобы ее сохранение не переписывало данные пользователей
+        root, _ = os.path.splitext(self.file_path)
+        self.stats_path = root + '_stats.json'
+        self._stats: Dict[str, Any] = {'values': {}, 'series': []}
+
+    def iter_users(self, batch_size: int) -> Iterator[Users]:
+        """Загружает данные из JSON-файла; если файл не существует, пользователей нет."""
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        data = {}
+        try:
+            if os.path.exists(self.file_path):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+        except ValueError as e:
+            # Поврежденный файл не перезаписываем при следующем сохранении: данные можно будет восстановить
+            os.replace(self.file_path, self.file_path + '.corrupt')
+            logging.error(f"Ошибка чтения файла {self.file_path} ({e}), он сохранен как .corrupt, создан новый файл")
+        # Файл разбирается целиком, а записи создаются пачками
+        users = {}
+        for user_id, user in data.items():
+            users[int(user_id)] = UserRecord.from_dict(user)
+            if len(users) >= batch_size:
+                yield users
+                users = {}
+        if users:
+            yield users
+
+    def save_users(self, users: Users, all_users: Users) -> int:
+        atomic_write_json(self.file_path, {str(user_id): user.to_dict() for user_id, user in all_users.items()})
+        return os.path.getsize(self.file_path)
+
+    def load_stats(self) -> Tuple[Dict[str, int], List[SeriesRow]]:
+        try:
+            if os.path.exists(self.stats_path):
+                with open(self.stats_path, 'r', encoding='utf-8') as f:
+                    self._stats = json.load(f)
+        except json.JSONDecodeError:
+            logging.error(f"Ошибка чтения файла {self.stats_path}, статистика сброшена")
+        return dict(self._stats['values']), [tuple(row) for row in self._stats['series']]
+
+    def save_stats(self, deltas: Dict[str, int], series: List[SeriesRow]) -> None:
+        values = self._stats['values']
+        for name, amount in deltas.items():
+            values[name] = values.get(name, 0) + amount
+        merged = {tuple(row[:3]): row[3] for row in self._stats['series']}
+        for name, resolution, bucket, count in series:
+            merged[(name, resolution, bucket)] = merged.get((name, resolution, bucket), 0) + count
+        latest = {}
+        for name, resolution, bucket in merged:
+            latest[resolution] = max(latest.get(resolution, bucket), bucket)
+        self._stats['series'] = [
+            [*key, count] for key, count in merged.items()
+            if key[2] > latest[key[1]] - RESOLUTIONS[key[1]][1]
+        ]
+        atomic_write_json(self.stats_path, self._stats)
+
+
+class SQLiteBackend(StorageBackend):
+    """Хранение пользователей в SQLite (режим WAL), по одной строке на пользователя."""
+
+    supports_sharing = True
+
+    # Поле записи пользователя -> (колонка, SQL-тип)
+    COLUMNS = {
+        'city': ('city', 'TEXT'),
+        'city_id': ('city_id', 'INTEGER'),
+        'lat': ('lat', 'REAL'),
+        'lon': ('lon', 'REAL'),
+        'language': ('language', 'TEXT'),
+        'banned': ('banned', 'INTEGER NOT NULL DEFAULT 0'),
+        'blocked': ('blocked', 'INTEGER NOT NULL DEFAULT 0'),
+        'notify_at': ('notify_at', 'TEXT'),
+        'utc_offset': ('utc_offset', 'INTEGER'),
+    }
+    # Флаги хранятся как 0/1, а в записи пользователя присутствуют только со значением True
+    FLAGS = ('banned', 'blocked')
+
+    def __init__(self, db_path: str, json_path: Optional[str] = None):
+        """
+        Инициализация бэкенда.
+
+        Args:
+            db_path: Путь к файлу базы данных.
+            json_path: Путь к старому user_data.json; если база пуста, данные из него переносятся один раз.
+        """
+        self.db_path = str(db_path)
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        # timeout: при работе нескольких процессов запись ждет, пока другой процесс освободит базу
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=10)
+        # В общем режиме хранилище обращается к базе и из цикла событий, и из потока записи:
+        # транзакции одного соединения не должны перемешиваться
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_schema()
+        if json_path:
+            self._migrate_from_json(str(json_path))
+
+    def _create_schema(self) -> None:
+        """Создает таблицу и индексы, добавляя недостающие колонки в существующую таблицу."""
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY)")
+            existing = {row[1] for row in self.conn.execute("PRAGMA table_info(users)")}
+            for column, sql_type in self.COLUMNS.values():
+                if column not in existing:
+                    self.conn.execute(f"ALTER TABLE users ADD COLUMN {column} {sql_type}")
+            if 'version' not in existing:
+                # Номер последнего изменения строки: по нему процессы бота находят чужие изменения
+                self.conn.execute("ALTER TABLE users ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_version ON users (version)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_city ON users (city)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_users_banned ON users (banned) WHERE banned = 1")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS stats_series ("
+                "name TEXT, resolution TEXT, bucket INTEGER, count INTEGER NOT NULL, "
+                "PRIMARY KEY (name, resolution, bucket))"
+            )
+
+    def _migrate_from_json(self, json_path: str) -> None:
+        """Однократно переносит пользователей из JSON-файла в пустую базу."""
+        if not os.path.exists(json_path):
+            return
+        if self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            return
+        users = JSONBackend(json_path).load_users()
+        self.save_users(users, users)
+        if os.path.exists(json_path):  # поврежденный файл уже переименован в .corrupt
+            os.replace(json_path, json_path + '.migrated')
+        logging.info(f"Перенесено {len(users)} пользователей из {json_path} в {self.db_path}")
+
+    def _to_row(self, user_id: int, user: UserRecord) -> tuple:
+        values = []
+        for field in self.COLUMNS:
+            value = getattr(user, field)
+            if field in self.FLAGS:
+                value = int(bool(value))
+            values.append(value)
+        return (int(user_id), *values)
+
+    def _from_row(self, row: tuple) -> UserRecord:
+        # Колонки - в порядке COLUMNS; запись создается напрямую, без промежуточного словаря
+        _, city, city_id, lat, lon, language, banned, blocked, notify_at, utc_offset = row
+        flags = (UserRecord.BANNED if banned else 0) | (UserRecord.BLOCKED if blocked else 0)
+        return UserRecord(city, city_id, lat, lon, language, flags, notify_at, utc_offset)
+
+    def _select(self) -> str:
+        columns = ', '.join(column for column, _ in self.COLUMNS.values())
+        return f"SELECT user_id, {columns}, version FROM users"
+
+    def load_users(self) -> Users:
+        with self._lock:
+            rows = self.conn.execute(self._select()).fetchall()
+        return {row[0]: self._from_row(row[:-1]) for row in rows}
+
+    def iter_users(self, batch_size: int) -> Iterator[Users]:
+        with self._lock:
+            cursor = self.conn.execute(self._select())
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(batch_size)
+            if not rows:
+                return
+            yield {row[0]: self._from_row(row[:-1]) for row in rows}
+
+    def load_user(self, user_id: int) -> Optional[UserRecord]:
+        with self._lock:
+            row = self.conn.execute(f"{self._select()} WHERE user_id = ?", (int(user_id),)).fetchone()
+        return None if row is None else self._from_row(row[:-1])
+
+    def get_version(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM users").fetchone()[0]
+
+    def load_changed_users(self, since: int) -> Tuple[Users, int]:
+        users = {}
+        with self._lock:
+            rows = self.conn.execute(f"{self._select()} WHERE version > ? ORDER BY version", (since,)).fetchall()
+        for row in rows:
+            users[row[0]] = self._from_row(row[:-1])
+            since = row[-1]
+        return users, since
+
+    def save_users(self, users: Users, all_users: Users) -> int:
+        """
+        Обновляет только переданных пользователей одной транзакцией.
+        Каждая записанная строка получает следующий номер изменения.
+        """
+        if not users:
+            return 0
+        rows = [self._to_row(user_id, user) for user_id, user in users.items()]
+        columns = [column for column, _ in self.COLUMNS.values()]
+        placeholders = ', '.join('?' * (len(columns) + 1))
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns + ['version'])
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO users (user_id, {', '.join(columns)}, version) VALUES ({placeholders}, "
+                f"(SELECT COALESCE(MAX(version), 0) + 1 FROM users)) "
+                f"ON CONFLICT(user_id) DO UPDATE SET {updates}",
+                rows
+            )
+        return sum(len(str(value)) for row in rows for value in row if value is not None)
+
+    def load_stats(self) -> Tuple[Dict[str, int], List[SeriesRow]]:
+        with self._lock:
+            values = dict(self.conn.execute("SELECT name, value FROM stats"))
+            series = self.conn.execute("SELECT name, resolution, bucket, count FROM stats_series").fetchall()
+        return values, series
+
+    def save_stats(self, deltas: Dict[str, int], series: List[SeriesRow]) -> None:
+        """Прибавляет приращения к счетчикам (а не перезаписывает их) и удаляет устаревшие корзины."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO stats (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                deltas.items()
+            )
+            self.conn.executemany(
+                "INSERT INTO stats_series (name, resolution, bucket, count) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name, resolution, bucket) DO UPDATE SET count = count + excluded.count",
+                series
+            )
+            latest = {}
+            for _, resolution, bucket, _ in series:
+                latest[resolution] = max(latest.get(resolution, bucket), bucket)
+            for resolution, bucket in latest.items():
+                self.conn.execute(
+                    "DELETE FROM stats_series WHERE resolution = ? AND bucket <= ?",
+                    (resolution, bucket - RESOLUTIONS[resolution][1])
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+class SnapshotBackend(JSONBackend):
+    """
+    Хранение всех пользователей в двоичном снимке: каждое поле - столбец-массив фиксированной
+    ширины, строки (города, языки, время рассылки) - в общей таблице строк. Загружается
+    и сохраняется быстрее JSON; файл, как и JSON, перезаписывается целиком.
+    Статистика хранится в JSON-файле рядом, как у JSONBackend.
+    """
+
+    MAGIC = b'WBUS'
+    VERSION = 1
+    # Заголовок: сигнатура, версия формата, число пользователей, длина таблицы строк
+    HEADER = struct.Struct('<4sHII')
+    NONE_INT = -1  # нет значения в целочисленных столбцах
+    NONE_OFFSET = -2 ** 31  # нет смещения от UTC (0 - допустимое смещение)
+    # Столбец -> код типа array
+    COLUMNS = (
+        ('user_id', 'q'), ('city', 'i'), ('city_id', 'q'), ('lat', 'd'), ('lon', 'd'),
+        ('language', 'h'), ('flags', 'B'), ('notify_at', 'h'), ('utc_offset', 'i'),
+    )
+
+    def __init__(self, file_path: str, json_path: Optional[str] = None):
+        """
+        Args:
+            file_path: Путь к файлу снимка.
+            json_path: Путь к user_data.json; если снимка еще нет, пользователи из него переносятся один раз.
+        """
+        super().__init__(file_path)
+        self.json_path = str(json_path) if json_path else None
+
+    def iter_users(self, batch_size: int) -> Iterator[Users]:
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        if not os.path.exists(self.file_path):
+            if self.json_path and os.path.exists(self.json_path):
+                users = JSONBackend(self.json_path).load_users()
+                self.save_users(users, users)
+                if os.path.exists(self.json_path):  # поврежденный файл уже переименован в .corrupt
+                    os.replace(self.json_path, self.json_path + '.migrated')
+                logging.info(f"Перенесено {len(users)} пользователей из {self.json_path} в {self.file_path}")
+                yield users
+            return
+        with open(self.file_path, 'rb') as f:
+            raw = f.read()
+        try:
+            strings, columns = self._decode_columns(raw)
+        except (ValueError, struct.error) as e:
+            # Поврежденный снимок не перезаписываем при следующем сохранении: данные можно будет восстановить
+            os.replace(self.file_path, self.file_path + '.corrupt')
+            logging.error(f"Ошибка чтения файла {self.file_path} ({e}), он сохранен как .corrupt, создан новый файл")
+            return
+        yield from self._decode_users(strings, columns, batch_size)
+
+    def _decode_columns(self, raw: bytes) -> Tuple[Dict[str, List[str]], List[array]]:
+        """Проверяет снимок целиком и разбирает таблицу строк и столбцы."""
+        magic, version, count, strings_size = self.HEADER.unpack_from(raw)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError("неизвестный формат снимка")
+        offset = self.HEADER.size
+        strings = json.loads(raw[offset:offset + strings_size].decode('utf-8'))
+        if not isinstance(strings, dict) or any(not isinstance(strings.get(table), list)
+                                                for table in ('cities', 'languages', 'times')):
+            raise ValueError("поврежденная таблица строк")
+        offset += strings_size
+        columns = []
+        for _, code in self.COLUMNS:
+            column = array(code)
+            size = column.itemsize * count
+            if offset + size > len(raw):
+                raise ValueError("файл снимка обрезан")
+            column.frombytes(raw[offset:offset + size])
+            if sys.byteorder != 'little':
+                column.byteswap()
+            columns.append(column)
+            offset += size
+        if offset != len(raw):
+            raise ValueError("лишние данные в конце файла")
+        # Ссылки на таблицу строк проверяются сразу: ошибка не должна прервать загрузку на середине
+        names = [name for name, _ in self.COLUMNS]
+        for name, table in (('city', 'cities'), ('language', 'languages'), ('notify_at', 'times')):
+            column = columns[names.index(name)]
+            if column and (min(column) < self.NONE_INT or max(column) >= len(strings[table])):
+                raise ValueError(f"неверная ссылка на таблицу строк в столбце {name}")
+        return strings, columns
+
+    def _decode_users(self, strings: Dict[str, List[str]], columns: List[array], batch_size: int) -> Iterator[Users]:
+        """Создает записи пользователей из столбцов снимка пачками по batch_size."""
+        # Строки таблицы интернируются один раз, записи ссылаются на них
+        cities = [sys.intern(city) for city in strings['cities']]
+        languages = [sys.intern(language) for language in strings['languages']]
+        times = [sys.intern(value) for value in strings['times']]
+        none_int, none_offset = self.NONE_INT, self.NONE_OFFSET
+        users = {}
+        for user_id, city, city_id, lat, lon, language, flags, notify_at, utc_offset in zip(*columns):
+            user = UserRecord()
+            user.city = cities[city] if city != none_int else None
+            user.city_id = share(city_id) if city_id != none_int else None
+            user.lat = share(lat) if lat == lat else None  # NaN - нет значения
+            user.lon = share(lon) if lon == lon else None
+            user.language = languages[language] if language != none_int else None
+            user.flags = flags
+            user.notify_at = times[notify_at] if notify_at != none_int else None
+            user.utc_offset = share(utc_offset) if utc_offset != none_offset else None
+            users[user_id] = user
+            if len(users) >= batch_size:
+                yield users
+                users = {}
+        if users:
+            yield users
+
+    def _encode(self, users: Users) -> bytes:
+        tables: Dict[str, Dict[str, int]] = {'cities': {}, 'languages': {}, 'times': {}}
+
+        def index(table: str, value: Optional[str]) -> int:
+            if value is None:
+                return self.NONE_INT
+            return tables[table].setdefault(value, len(tables[table]))
+
+        columns = {name: array(code) for name, code in self.COLUMNS}
+        for user_id, user in users.items():
+            columns['user_id'].append(user_id)
+            columns['city'].append(index('cities', user.city))
+            columns['city_id'].append(self.NONE_INT if user.city_id is None else user.city_id)
+            columns['lat'].append(math.nan if user.lat is None else user.lat)
+            columns['lon'].append(math.nan if user.lon is None else user.lon)
+            columns['language'].append(index('languages', user.language))
+            columns['flags'].append(user.flags)
+            columns['notify_at'].append(index('times', user.notify_at))
+            columns['utc_offset'].append(self.NONE_OFFSET if user.utc_offset is None else user.utc_offset)
+        strings = json.dumps({name: list(table) for name, table in tables.items()},
+                             ensure_ascii=False).encode('utf-8')
+        parts = [self.HEADER.pack(self.MAGIC, self.VERSION, len(users), len(strings)), strings]
+        for name, _ in self.COLUMNS:
+            column = columns[name]
+            if sys.byteorder != 'little':
+                column.byteswap()
+            parts.append(column.tobytes())
+        return b''.join(parts)
+
+    def save_users(self, users: Users, all_users: Users) -> int:
+        data = self._encode(all_users)
+        directory = os.path.dirname(self.file_path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.bin')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.file_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return len(data)
+
+
+def create_backend(kind: str, json_path: str, db_path: str, snapshot_path: Optional[str] = None) -> StorageBackend:
+    """Создает бэкенд по названию из конфигурации."""
+    if kind == 'json':
+        return JSONBackend(json_path)
+    if kind == 'sqlite':
+        return SQLiteBackend(db_path, json_path=json_path)
+    if kind == 'snapshot':
+        return SnapshotBackend(snapshot_path or os.path.splitext(str(json_path))[0] + '.bin', json_path=json_path)
+    raise ValueError(f"Неизвестный бэкенд хранилища: {kind}")
@@ -0,0 +1,70 @@
+import json
+import os
+import sqlite3
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+
+class SQLiteFSMStorage(BaseStorage):
+    """
+    Хранилище состояний FSM в SQLite (режим WAL).
+
+    Файл базы может использоваться несколькими процессами бота на одном сервере,
+    поэтому состояние диалога не теряется, если следующее сообщение попадет в другой процесс.
+    """
+
+    def __init__(self, db_path: str):
+        os.makedirs(os.path.dirname(str(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)")
+        self.key_builder = DefaultKeyBuilder(with_destiny=True)
+
+    def _key(self, key: StorageKey) -> str:
+        return self.key_builder.build(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+                (self._key(key), state)
+            )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self.conn.execute("SELECT state FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                (self._key(key), json.dumps(data, ensure_ascii=False))
+            )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self.conn.execute("SELECT data FROM fsm WHERE key = ?", (self._key(key),)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        self.conn.close()
+
+
+def create_fsm_storage(kind: str, db_path: str, redis_url: str) -> BaseStorage:
+    """Создает хранилище состояний FSM по названию из конфигурации."""
+    if kind == 'memory':
+        return MemoryStorage()
+    if kind == 'sqlite':
+        return SQLiteFSMStorage(db_path)
+    if kind == 'redis':
+        try:
+            from aiogram.fsm.storage.redis import RedisStorage
+        except ImportError:
+            raise RuntimeError("Для FSM_STORAGE=redis установите пакет redis") from None
+        return RedisStorage.from_url(redis_url)
+    raise ValueError(f"Неизвестное хранилище FSM: {kind}")
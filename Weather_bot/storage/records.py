@@ -0,0 +1,86 @@
+import sys
+from typing import Any, Dict, Optional
+
+# Общие объекты для значений, которые повторяются у многих пользователей (ID и координаты городов).
+# Ключ включает тип, чтобы 1 и 1.0 не считались одним значением.
+_shared_values: Dict[tuple, Any] = {}
+
+
+def share(value: Any) -> Any:
+    """Возвращает общий объект, равный value: у пользователей одного города ID и координаты не дублируются."""
+    if value is None:
+        return None
+    return _shared_values.setdefault((type(value), value), value)
+
+
+class UserRecord:
+    """
+    Данные одного пользователя в памяти.
+
+    Вместо словаря на каждого пользователя - объект со __slots__: названия городов интернированы,
+    а ID и координаты города - общие объекты для всех его пользователей; флаги banned и blocked
+    хранятся битами в flags.
+    """
+
+    __slots__ = ('city', 'city_id', 'lat', 'lon', 'language', 'flags', 'notify_at', 'utc_offset')
+
+    BANNED = 1
+    BLOCKED = 2
+    # Поля, которые хранятся как есть (флаги - отдельно, в flags)
+    FIELDS = ('city', 'city_id', 'lat', 'lon', 'language', 'notify_at', 'utc_offset')
+    FLAGS = {'banned': BANNED, 'blocked': BLOCKED}
+
+    def __init__(self, city: Optional[str] = None, city_id: Optional[int] = None,
+                 lat: Optional[float] = None, lon: Optional[float] = None,
+                 language: Optional[str] = None, flags: int = 0,
+                 notify_at: Optional[str] = None, utc_offset: Optional[int] = None):
+        self.city = sys.intern(city) if city else city
+        self.city_id = share(city_id)
+        self.lat = share(lat)
+        self.lon = share(lon)
+        self.language = sys.intern(language) if language else language
+        self.flags = flags
+        self.notify_at = sys.intern(notify_at) if notify_at else notify_at
+        self.utc_offset = share(utc_offset)
+
+    @property
+    def banned(self) -> bool:
+        return bool(self.flags & self.BANNED)
+
+    @banned.setter
+    def banned(self, value: bool) -> None:
+        self.flags = self.flags | self.BANNED if value else self.flags & ~self.BANNED
+
+    @property
+    def blocked(self) -> bool:
+        return bool(self.flags & self.BLOCKED)
+
+    @blocked.setter
+    def blocked(self, value: bool) -> None:
+        self.flags = self.flags | self.BLOCKED if value else self.flags & ~self.BLOCKED
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'UserRecord':
+        """Запись из словаря в прежнем формате ({'city': ..., 'banned': True, ...})."""
+        flags = 0
+        for name, bit in cls.FLAGS.items():
+            if data.get(name):
+                flags |= bit
+        return cls(data.get('city'), data.get('city_id'), data.get('lat'), data.get('lon'),
+                   data.get('language'), flags, data.get('notify_at'), data.get('utc_offset'))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Словарь в прежнем формате: только заданные поля, флаги - только со значением True."""
+        data = {field: getattr(self, field) for field in self.FIELDS if getattr(self, field) is not None}
+        for name, bit in self.FLAGS.items():
+            if self.flags & bit:
+                data[name] = True
+        return data
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, UserRecord):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        return f"UserRecord({self.to_dict()})"
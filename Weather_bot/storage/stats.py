@@ -0,0 +1,107 @@
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Разрешения временных рядов: название -> (ширина корзины в секундах, число хранимых корзин)
+RESOLUTIONS = {
+    'minute': (60, 60),
+    'hour': (3600, 24),
+    'day': (86400, 30),
+}
+
+# Строка временного ряда для сохранения: (счетчик, разрешение, номер корзины, значение)
+SeriesRow = Tuple[str, str, int, int]
+
+
+class TimeSeries:
+    """Кольцевой буфер счетчиков по корзинам фиксированной ширины."""
+
+    __slots__ = ('bucket_seconds', 'size', '_buckets', '_counts')
+
+    def __init__(self, bucket_seconds: int, size: int):
+        self.bucket_seconds = bucket_seconds
+        self.size = size
+        self._buckets = [-1] * size  # номер корзины, которой принадлежит слот
+        self._counts = [0] * size
+
+    def bucket(self, now: float) -> int:
+        """Номер корзины для момента времени now."""
+        return int(now // self.bucket_seconds)
+
+    def add(self, amount: int, bucket: int) -> None:
+        """Добавляет amount к корзине bucket, переиспользуя слот устаревшей корзины."""
+        slot = bucket % self.size
+        if self._buckets[slot] != bucket:
+            self._buckets[slot] = bucket
+            self._counts[slot] = 0
+        self._counts[slot] += amount
+
+    def total(self, now: float, last: int = 1) -> int:
+        """Сумма за last последних корзин, включая текущую."""
+        current = self.bucket(now)
+        return sum(count for bucket, count in zip(self._buckets, self._counts)
+                   if current - last < bucket <= current)
+
+
+class StatsCounters:
+    """Счетчики статистики с временными рядами и накоплением изменений для пакетного сохранения."""
+
+    PERSISTENT = ('weather_requests', 'forecast_requests')
+
+    def __init__(self, names: Iterable[str] = PERSISTENT):
+        self.values: Dict[str, int] = {name: 0 for name in names}
+        self.series: Dict[str, Dict[str, TimeSeries]] = {
+            name: {res: TimeSeries(*params) for res, params in RESOLUTIONS.items()}
+            for name in self.values
+        }
+        self._pending: Dict[str, int] = {}
+        self._pending_series: Dict[Tuple[str, str, int], int] = {}
+
+    def load(self, values: Dict[str, int], series: Iterable[SeriesRow]) -> None:
+        """Восстанавливает сохраненные значения счетчиков и рядов."""
+        for name, value in values.items():
+            if name in self.values:
+                self.values[name] = value
+        for name, resolution, bucket, count in series:
+            if name in self.series and resolution in RESOLUTIONS:
+                self.series[name][resolution].add(count, bucket)
+
+    def increment(self, name: str, amount: int = 1, now: Optional[float] = None) -> bool:
+        """Увеличивает счетчик; возвращает False для неизвестного счетчика."""
+        if name not in self.values:
+            return False
+        now = time.time() if now is None else now
+        self.values[name] += amount
+        self._pending[name] = self._pending.get(name, 0) + amount
+        for resolution, ts in self.series[name].items():
+            bucket = ts.bucket(now)
+            ts.add(amount, bucket)
+            key = (name, resolution, bucket)
+            self._pending_series[key] = self._pending_series.get(key, 0) + amount
+        return True
+
+    def has_pending(self) -> bool:
+        return bool(self._pending)
+
+    def take_pending(self) -> Tuple[Dict[str, int], List[SeriesRow]]:
+        """Забирает накопленные приращения для сохранения."""
+        deltas, self._pending = self._pending, {}
+        series, self._pending_series = self._pending_series, {}
+        return deltas, [(*key, count) for key, count in series.items()]
+
+    def restore_pending(self, deltas: Dict[str, int], series: List[SeriesRow]) -> None:
+        """Возвращает приращения в очередь, если сохранить их не удалось."""
+        for name, amount in deltas.items():
+            self._pending[name] = self._pending.get(name, 0) + amount
+        for name, resolution, bucket, count in series:
+            key = (name, resolution, bucket)
+            self._pending_series[key] = self._pending_series.get(key, 0) + count
+
+    def rates(self, name: str, now: Optional[float] = None) -> Dict[str, int]:
+        """Число событий за последнюю минуту, час и сутки."""
+        now = time.time() if now is None else now
+        series = self.series[name]
+        return {
+            'minute': series['minute'].total(now),
+            'hour': series['minute'].total(now, last=60),
+            'day': series['hour'].total(now, last=24),
+        }
@@ -1,104 +1,575 @@
-import json
-import os
+import asyncio
+import copy
+import gc
+import logging
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, List, NamedTuple, Optional, Any, Set, Tuple, Union
+
+import sys
 from pathlib import Path
-from typing import Dict, Optional, Any
+
+# Добавляем корень проекта в PYTHONPATH
+sys.path.append(str(Path(__file__).parent.parent))
+from config.config import (
+    STORAGE_BACKEND,
+    STORAGE_JSON_PATH,
+    STORAGE_DB_PATH,
+    STORAGE_SNAPSHOT_PATH,
+    STORAGE_LOAD_BATCH,
+    STORAGE_FLUSH_INTERVAL,
+    STORAGE_FLUSH_MAX_CHANGES,
+    SETTINGS_CACHE_SIZE,
+    STORAGE_SHARED,
+    STORAGE_SYNC_INTERVAL,
+    SUBSCRIPTION_SLOT,
+)
+from storage.backends import StorageBackend, JSONBackend, Users, create_backend
+from storage.records import UserRecord, share
+from storage.stats import StatsCounters
+from services.geocoding import normalize_city_name
+from services.metrics import metrics
+
+FLUSH_SECONDS = metrics.histogram('storage_flush_seconds', 'Длительность сохранения пользователей', ['kind'])
+FLUSH_ROWS = metrics.counter('storage_flush_rows_total', 'Сохранено записей пользователей')
+FLUSH_BYTES = metrics.counter('storage_flush_bytes_total', 'Примерный объем записанных данных пользователей, байт')
+FLUSH_ERRORS = metrics.counter('storage_flush_errors_total', 'Ошибок сохранения', ['kind'])
+LOAD_SECONDS = metrics.gauge('storage_load_seconds', 'Длительность загрузки пользователей при запуске')
+
+
+def subscription_slot(notify_at: str, utc_offset: int, slot_minutes: int = SUBSCRIPTION_SLOT) -> int:
+    """
+    Номер слота рассылки в сутках по UTC для местного времени notify_at ("ЧЧ:ММ")
+    в городе со смещением utc_offset секунд от UTC.
+    """
+    hours, minutes = map(int, notify_at.split(':'))
+    return (hours * 60 + minutes - utc_offset // 60) % (24 * 60) // slot_minutes
+
+
+class UserSettings(NamedTuple):
+    """Настройки пользователя, которые нужны обработчикам на каждом сообщении."""
+    city: Optional[str]
+    city_id: Optional[int]
+    language: str
+    blocked: bool
 
 
 class Storage:
-    """Класс для хранения и управления пользовательскими данными в JSON-файле."""
+    """
+    Класс для хранения и управления пользовательскими данными.
 
-    def __init__(self, file_path: str = None):
+    Создание хранилища ничего не загружает: бэкенд открывается в open(), а пользователи загружаются
+    целиком в load() или постепенно в фоне (start_loading()). Пока идет фоновая загрузка, данные
+    пользователя, пишущего боту, подгружаются отдельно в ensure_user().
+    """
+    def __init__(self, file_path: str = None, backend: Optional[StorageBackend] = None,
+                 shared: bool = STORAGE_SHARED):
         """
         Инициализация хранилища.
 
         Args:
-            file_path: Путь к файлу данных. Если не указан, используется user_data.json в корне проекта.
+            file_path: Путь к JSON-файлу данных. Если указан, используется JSON-бэкенд с этим файлом.
+            backend: Бэкенд хранения. Если не указан, выбирается по STORAGE_BACKEND из конфигурации.
+            shared: База используется несколькими процессами бота: изменения пользователей пишутся сразу,
+                а чужие изменения подхватываются раз в sync_interval.
         """
-        BASE_DIR = Path(__file__).parent.parent
-        self.file_path = file_path or str(BASE_DIR / 'user_data.json')
-        self.data: Dict[str, Dict] = self._load_data()
-        self.stats = {
-            'total_users': len(self.data),
-            'active_users': sum(1 for user in self.data.values() if not user.get('banned', False)),
-            'weather_requests': 0,
-            'forecast_requests': 0
-        }
+        self.file_path = file_path or str(STORAGE_JSON_PATH)
+        self._json_only = file_path is not None
+        self.backend: Optional[StorageBackend] = backend
+        self._opened = False
+        self.shared = shared
+        self.sync_interval = STORAGE_SYNC_INTERVAL
+        self._sync_task: Optional[asyncio.Task] = None
+        self._version = 0
+        self.load_batch = STORAGE_LOAD_BATCH
+        self.loaded = False
+        self.load_seconds: Optional[float] = None
+        self.load_error: Optional[Exception] = None
+        self._load_task: Optional[asyncio.Task] = None
+        self._loaded_event: Optional[asyncio.Event] = None
+        self._dirty: Set[int] = set()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_needed: Optional[asyncio.Event] = None
+        self.flush_interval = STORAGE_FLUSH_INTERVAL
+        self.flush_max_changes = STORAGE_FLUSH_MAX_CHANGES
+        metrics.callback('storage_dirty_users', 'Измененных пользователей, ожидающих сохранения', 'gauge',
+                         lambda: len(self._dirty))
+        self.data: Users = {}
+        # Индекс заблокированных строится при загрузке и дальше поддерживается в ban_user/unban_user
+        self.banned_users: Set[int] = set()
+        # Подписчики по слотам рассылки: слот -> ID пользователей (и обратный индекс для переиндексации)
+        self.subscriptions: Dict[int, Set[int]] = {}
+        self._subscription_slots: Dict[int, int] = {}
+        self.settings_cache_size = SETTINGS_CACHE_SIZE
+        self._settings: "OrderedDict[int, UserSettings]" = OrderedDict()
+        self.counters = StatsCounters()
 
-    def _load_data(self) -> Dict[str, Dict]:
-        """Загружает данные из JSON-файла или возвращает пустой словарь, если файл не существует."""
-        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+    def open(self) -> None:
+        """Открывает бэкенд (если он еще не открыт) и загружает статистику, но не пользователей."""
+        if self._opened:
+            return
+        if self.backend is None:
+            self.backend = JSONBackend(self.file_path) if self._json_only else create_backend(
+                STORAGE_BACKEND, STORAGE_JSON_PATH, STORAGE_DB_PATH, STORAGE_SNAPSHOT_PATH)
+        if self.shared and not self.backend.supports_sharing:
+            raise ValueError(f"{type(self.backend).__name__} не поддерживает работу нескольких процессов")
+        # Номер изменения запоминается до загрузки, чтобы не пропустить записи, сделанные во время нее
+        self._version = self.backend.get_version() if self.shared else 0
+        self.counters.load(*self.backend.load_stats())
+        self._opened = True
+
+    def load(self) -> None:
+        """Загружает всех пользователей сразу (для скриптов и тестов; бот загружает их в фоне)."""
+        self.open()
+        started = time.perf_counter()
+        for batch in self.backend.iter_users(self.load_batch):
+            self._merge_users(batch)
+        gc.freeze()
+        self._set_loaded(time.perf_counter() - started)
+
+    def start_loading(self) -> None:
+        """Открывает бэкенд и начинает фоновую загрузку пользователей."""
+        self.open()
+        if self._loaded_event is None:
+            self._loaded_event = asyncio.Event()
+        if self.loaded:
+            self._loaded_event.set()
+        elif self._load_task is None:
+            self._load_task = asyncio.create_task(self._load_loop())
+
+    async def _load_loop(self) -> None:
+        """Загружает пользователей пачками, уступая цикл событий обработке обновлений между пачками."""
+        started = time.perf_counter()
         try:
-            if os.path.exists(self.file_path):
-                with open(self.file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-        except json.JSONDecodeError:
-            logging.error(f"Ошибка чтения файла {self.file_path}, создан новый файл")
-        return {}
+            for batch in self.backend.iter_users(self.load_batch):
+                self._merge_users(batch)
+                # Записи пользователей живут до остановки бота: убираем их из сборки мусора,
+                # иначе полные проходы сборщика по всем записям надолго останавливают цикл событий
+                gc.freeze()
+                await asyncio.sleep(0)
+        except Exception as e:
+            # Без полной загрузки бот работал бы с неполными данными, а JSON-бэкенд затер бы файл
+            logging.critical(f"Ошибка загрузки данных пользователей: {e!r}")
+            self.load_error = e
+            if self._loaded_event is not None:
+                # Будим ожидающих: wait_loaded передаст им ошибку
+                self._loaded_event.set()
+            raise
+        self._set_loaded(time.perf_counter() - started)
+
+    def _set_loaded(self, seconds: float) -> None:
+        self.loaded = True
+        LOAD_SECONDS.set(seconds)
+        self.load_seconds = seconds
+        if self._loaded_event is not None:
+            self._loaded_event.set()
+        logging.info(f"Загружено пользователей: {len(self.data)} за {seconds:.2f} с")
+
+    def _merge_users(self, users: Users) -> None:
+        """
+        Добавляет загруженных пользователей. Пользователи, которые уже есть в памяти
+        (загружены в ensure_user или изменены во время загрузки), не перезаписываются.
+        """
+        data = self.data
+        for user_id, user in users.items():
+            if user_id in data:
+                continue
+            data[user_id] = user
+            if user.banned:
+                self.banned_users.add(user_id)
+            if user.notify_at:
+                self._index_subscription(user_id, user)
+            if self._settings:
+                self._settings.pop(user_id, None)
+
+    async def wait_loaded(self) -> None:
+        """
+        Ждет окончания загрузки пользователей.
+
+        Raises:
+            RuntimeError: Загрузка завершилась ошибкой.
+        """
+        if not self.loaded:
+            if self._loaded_event is None:
+                self._loaded_event = asyncio.Event()
+            await self._loaded_event.wait()
+        if self.load_error is not None:
+            raise RuntimeError("Данные пользователей не загружены") from self.load_error
+
+    async def ensure_user(self, user_id: int) -> None:
+        """
+        Гарантирует, что данные пользователя в памяти. Во время фоновой загрузки бэкенды с чтением
+        по одному пользователю (SQLite) отдают его сразу, для остальных ждем окончания загрузки.
+        """
+        if self.loaded or user_id in self.data:
+            return
+        if self.backend is not None and self.backend.supports_sharing:
+            user = await asyncio.to_thread(self.backend.load_user, user_id)
+            if user is not None and user_id not in self.data:
+                self._merge_users({user_id: user})
+            return
+        await self.wait_loaded()
+
+    def _lookup_user(self, user_id: int) -> None:
+        """Во время загрузки читает одного пользователя из бэкенда, если он еще не загружен."""
+        user = self.backend.load_user(user_id)
+        if user is not None and user_id not in self.data:
+            self._merge_users({user_id: user})
 
     def save_data(self) -> None:
-        """Сохраняет текущие данные в JSON-файл."""
-        with open(self.file_path, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=4)
+        """Сохраняет данные всех пользователей."""
+        self._dirty.clear()
+        self.backend.save_users(self.data, self.data)
+
+    async def _save_user(self, user_id: int) -> None:
+        """
+        Отмечает пользователя измененным. Без фоновой записи данные сохраняются сразу,
+        иначе изменения копятся и сбрасываются фоновой задачей.
+        """
+        self._settings.pop(user_id, None)
+        self._dirty.add(user_id)
+        if self._flush_task is None:
+            self.flush()
+        elif self.shared:
+            # Другие процессы должны увидеть изменение при ближайшей синхронизации
+            await self._write_through()
+        elif len(self._dirty) >= self.flush_max_changes:
+            self._flush_needed.set()
+
+    async def _refresh_user(self, user_id: int) -> None:
+        """В общем режиме перечитывает пользователя перед изменением, чтобы не затереть чужую запись."""
+        if self.shared:
+            user = await asyncio.to_thread(self.backend.load_user, user_id)
+            if user is not None:
+                self._apply_user(user_id, user)
+
+    def _apply_user(self, user_id: int, user: UserRecord) -> None:
+        """Подменяет данные пользователя загруженными из базы и обновляет индексы."""
+        self.data[user_id] = user
+        self._settings.pop(user_id, None)
+        if user.banned:
+            self.banned_users.add(user_id)
+        else:
+            self.banned_users.discard(user_id)
+        self._index_subscription(user_id, user)
+
+    def _user(self, user_id: int) -> UserRecord:
+        """Запись пользователя; создается, если ее еще нет."""
+        user = self.data.get(user_id)
+        if user is None and not self.loaded and self.backend is not None and self.backend.supports_sharing:
+            # Пользователь может быть еще не загружен: новая пустая запись затерла бы сохраненную
+            self._lookup_user(user_id)
+            user = self.data.get(user_id)
+        if user is None:
+            user = self.data[user_id] = UserRecord()
+        return user
+
+    def _index_subscription(self, user_id: int, user: UserRecord) -> None:
+        """Переносит пользователя в слот рассылки, соответствующий его подписке."""
+        old_slot = self._subscription_slots.pop(user_id, None)
+        if old_slot is not None:
+            self.subscriptions[old_slot].discard(user_id)
+            if not self.subscriptions[old_slot]:
+                del self.subscriptions[old_slot]
+        if user.notify_at:
+            slot = subscription_slot(user.notify_at, user.utc_offset or 0)
+            self.subscriptions.setdefault(slot, set()).add(user_id)
+            self._subscription_slots[user_id] = slot
+
+    def flush(self) -> None:
+        """Сохраняет статистику и всех измененных пользователей."""
+        self.flush_stats()
+        self.flush_users()
+
+    def flush_users(self) -> None:
+        """Сохраняет всех измененных пользователей одной пачкой."""
+        if not self._dirty or self.backend is None:
+            return
+        if not self.loaded and self.backend.saves_all_users:
+            # Файл перезаписывается целиком: до полной загрузки в нем потерялись бы незагруженные пользователи
+            return
+        dirty, self._dirty = self._dirty, set()
+        batch = {user_id: self.data[user_id] for user_id in dirty if user_id in self.data}
+        started = time.perf_counter()
+        try:
+            written = self.backend.save_users(batch, self.data)
+        except Exception as e:
+            self._flush_failed(dirty, e)
+            return
+        self._flushed(batch, started, written)
+
+    async def _write_through(self) -> None:
+        """
+        Сохраняет измененных пользователей в общем режиме. Запись идет в потоке, чтобы ожидание
+        блокировки базы другим процессом не останавливало цикл событий, а обработчик ждет ее окончания.
+        """
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        # Поток пишет копии: пока идет запись, обработчики могут изменить те же записи
+        batch = {user_id: copy.copy(self.data[user_id]) for user_id in dirty if user_id in self.data}
+        started = time.perf_counter()
+        try:
+            written = await asyncio.to_thread(self.backend.save_users, batch, batch)
+        except Exception as e:
+            self._flush_failed(dirty, e)
+            return
+        self._flushed(batch, started, written)
+
+    def _flush_failed(self, dirty: Set[int], error: Exception) -> None:
+        logging.error(f"Ошибка сохранения данных пользователей: {error}")
+        FLUSH_ERRORS.labels('users').inc()
+        self._dirty |= dirty
+
+    def _flushed(self, batch: Users, started: float, written: Optional[int]) -> None:
+        FLUSH_SECONDS.labels('users').observe(time.perf_counter() - started)
+        FLUSH_ROWS.inc(len(batch))
+        FLUSH_BYTES.inc(written or 0)
+
+    def flush_stats(self) -> None:
+        """Сохраняет накопленные приращения счетчиков статистики."""
+        if not self.counters.has_pending() or self.backend is None:
+            return
+        deltas, series = self.counters.take_pending()
+        started = time.perf_counter()
+        try:
+            self.backend.save_stats(deltas, series)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения статистики: {e}")
+            FLUSH_ERRORS.labels('stats').inc()
+            self.counters.restore_pending(deltas, series)
+            return
+        FLUSH_SECONDS.labels('stats').observe(time.perf_counter() - started)
+
+    async def sync(self) -> None:
+        """Подхватывает изменения пользователей и статистики, сделанные другими процессами бота."""
+        users, self._version = await asyncio.to_thread(self.backend.load_changed_users, self._version)
+        for user_id, user in users.items():
+            if user_id not in self._dirty:
+                self._apply_user(user_id, user)
+        self.flush_stats()
+        if not self.counters.has_pending():
+            # Счетчики в базе - сумма приращений всех процессов; берем их вместо локальных
+            counters = StatsCounters()
+            counters.load(*self.backend.load_stats())
+            self.counters = counters
+
+    def start_write_behind(self) -> None:
+        """Включает отложенную запись: изменения сбрасываются не реже flush_interval или после flush_max_changes."""
+        if self._flush_task is None:
+            self._flush_needed = asyncio.Event()
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if self.shared and self._sync_task is None:
+            self._sync_task = asyncio.create_task(self._sync_loop())
+
+    async def _sync_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logging.error(f"Ошибка синхронизации хранилища: {e}")
+
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            self.flush()
+
+    async def stop_write_behind(self) -> None:
+        """Останавливает фоновую запись и сохраняет накопленные изменения (дождавшись окончания загрузки)."""
+        if self._load_task is not None:
+            try:
+                await self._load_task
+            except Exception:
+                pass
+            self._load_task = None
+        for task in (self._flush_task, self._sync_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._flush_task = self._sync_task = None
+        self.flush()
+
+    def close(self) -> None:
+        """Сохраняет накопленные изменения и закрывает бэкенд хранилища."""
+        self.flush()
+        if self.backend is not None:
+            self.backend.close()
+
+    def get_user(self, user_id: int) -> Optional[UserRecord]:
+        """Возвращает запись пользователя или None, если пользователя нет."""
+        return self.data.get(int(user_id))
 
     def get_user_data(self, user_id: int) -> Dict[str, Any]:
-        """Возвращает все данные пользователя."""
-        return self.data.get(str(user_id), {})
+        """Возвращает все данные пользователя в виде словаря (копию)."""
+        user = self.data.get(int(user_id))
+        return user.to_dict() if user is not None else {}
+
+    def get_user_settings(self, user_id: int) -> UserSettings:
+        """Возвращает город, ID города, язык и флаг blocked пользователя из кэша настроек."""
+        user_id = int(user_id)
+        settings = self._settings.get(user_id)
+        if settings is not None:
+            self._settings.move_to_end(user_id)
+            return settings
+        user = self.data.get(user_id) or UserRecord()
+        settings = UserSettings(
+            city=user.city,
+            city_id=user.city_id,
+            language=user.language or 'ru',
+            blocked=user.blocked,
+        )
+        self._settings[user_id] = settings
+        if len(self._settings) > self.settings_cache_size:
+            self._settings.popitem(last=False)
+        return settings
 
     def get_user_city(self, user_id: int) -> Optional[str]:
         """Возвращает сохраненный город пользователя."""
-        return self.get_user_data(user_id).get('city')
+        user = self.data.get(int(user_id))
+        return user.city if user is not None else None
+
+    def get_user_city_id(self, user_id: int) -> Optional[int]:
+        """Возвращает ID города пользователя в OpenWeatherMap, если город уже определен."""
+        user = self.data.get(int(user_id))
+        return user.city_id if user is not None else None
 
-    def set_user_city(self, user_id: int, city: str) -> None:
-        """Устанавливает город для пользователя."""
-        user_id = str(user_id)
-        if user_id not in self.data:
-            self.data[user_id] = {}
-            self.stats['total_users'] = len(self.data)
-        self.data[user_id]['city'] = city
-        self.save_data()
+    async def set_user_city(self, user_id: int, city: str, city_id: Optional[int] = None,
+                      lat: Optional[float] = None, lon: Optional[float] = None) -> None:
+        """Устанавливает город для пользователя, а также его ID и координаты, если они известны."""
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        user = self._user(user_id)
+        user.city = sys.intern(city)
+        user.city_id, user.lat, user.lon = share(city_id), share(lat), share(lon)
+        await self._save_user(user_id)
 
     def get_user_language(self, user_id: int) -> str:
         """Возвращает язык пользователя (по умолчанию 'ru')."""
-        return self.get_user_data(user_id).get('language', 'ru')
+        user = self.data.get(int(user_id))
+        return user.language if user is not None and user.language else 'ru'
 
-    def set_user_language(self, user_id: int, language: str) -> None:
+    async def set_user_language(self, user_id: int, language: str) -> None:
         """Устанавливает язык для пользователя."""
-        user_id = str(user_id)
-        if user_id not in self.data:
-            self.data[user_id] = {}
-            self.stats['total_users'] = len(self.data)
-        self.data[user_id]['language'] = language
-        self.save_data()
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        self._user(user_id).language = sys.intern(language)
+        await self._save_user(user_id)
 
     def increment_stat(self, stat_name: str) -> None:
-        """Увеличивает счетчик статистики на 1."""
-        if stat_name in self.stats:
-            self.stats[stat_name] += 1
-            self.save_data()
+        """Увеличивает счетчик статистики на 1. Сохраняется вместе со следующим сбросом изменений."""
+        self.counters.increment(stat_name)
 
-    def ban_user(self, user_id: int) -> None:
+    async def ban_user(self, user_id: int) -> None:
         """Блокирует пользователя."""
-        user_id = str(user_id)
-        self.data.setdefault(user_id, {})['banned'] = True
-        self.save_data()
-        self.stats['active_users'] = sum(1 for user in self.data.values() if not user.get('banned', False))
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        self._user(user_id).banned = True
+        self.banned_users.add(user_id)
+        await self._save_user(user_id)
 
-    def unban_user(self, user_id: int) -> None:
+    async def unban_user(self, user_id: int) -> None:
         """Разблокирует пользователя."""
-        user_id = str(user_id)
-        if user_id in self.data and 'banned' in self.data[user_id]:
-            del self.data[user_id]['banned']
-            self.save_data()
-            self.stats['active_users'] = sum(1 for user in self.data.values() if not user.get('banned', False))
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        user = self.data.get(user_id)
+        if user is not None and user.banned:
+            user.banned = False
+            self.banned_users.discard(user_id)
+            await self._save_user(user_id)
 
     def is_banned(self, user_id: int) -> bool:
         """Проверяет, заблокирован ли пользователь."""
-        return self.get_user_data(user_id).get('banned', False)
+        return int(user_id) in self.banned_users
+
+    def is_blocked(self, user_id: int) -> bool:
+        """Проверяет, заблокировал ли пользователь бота (отмечается при неудачной рассылке)."""
+        user = self.data.get(int(user_id))
+        return user is not None and user.blocked
+
+    async def set_user_blocked(self, user_id: int, blocked: bool = True) -> None:
+        """Отмечает, что пользователь заблокировал бота или снова им пользуется."""
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        user = self.data.get(user_id)
+        if user is None or user.blocked == blocked:
+            return
+        user.blocked = blocked
+        await self._save_user(user_id)
+
+    def get_user_subscription(self, user_id: int) -> Optional[str]:
+        """Возвращает время ежедневной рассылки пользователя ("ЧЧ:ММ" по времени его города) или None."""
+        user = self.data.get(int(user_id))
+        return user.notify_at if user is not None else None
+
+    async def set_user_subscription(self, user_id: int, notify_at: Optional[str], utc_offset: int = 0) -> None:
+        """
+        Подписывает пользователя на ежедневную рассылку или отменяет подписку (notify_at=None).
+
+        Args:
+            notify_at: Местное время рассылки "ЧЧ:ММ".
+            utc_offset: Смещение времени города пользователя от UTC, сек.
+        """
+        user_id = int(user_id)
+        await self._refresh_user(user_id)
+        user = self._user(user_id)
+        if notify_at is None:
+            if user.notify_at is None:
+                return
+            user.notify_at = user.utc_offset = None
+        else:
+            user.notify_at, user.utc_offset = sys.intern(notify_at), share(utc_offset)
+        self._index_subscription(user_id, user)
+        await self._save_user(user_id)
+
+    def get_subscribers(self, slot: int) -> List[int]:
+        """Возвращает отсортированные ID подписчиков слота рассылки, которым можно отправлять сообщения."""
+        return sorted(user_id for user_id in self.subscriptions.get(slot, ())
+                      if user_id not in self.banned_users and not self.is_blocked(user_id))
+
+    def get_broadcast_recipients(self) -> List[int]:
+        """Возвращает отсортированные ID пользователей, которым можно отправлять рассылку."""
+        return sorted(user_id for user_id, user in self.data.items() if not user.blocked)
+
+    def get_popular_cities(self, limit: int) -> List[Tuple[Union[int, str], str, int]]:
+        """
+        Возвращает самые популярные пары (город, язык) по числу пользователей.
+
+        Returns:
+            Список (город, язык, число пользователей) по убыванию популярности,
+            где город - ID OpenWeatherMap, если он известен, иначе название.
+        """
+        counter = Counter()
+        names = {}
+        for user in self.data.values():
+            city = user.city
+            if city and not user.banned:
+                # Пользователи с известным ID города считаются вместе, даже если писали его по-разному
+                key = (user.city_id or normalize_city_name(city), user.language or 'ru')
+                counter[key] += 1
+                names.setdefault(key, user.city_id or city.strip())
+        return [(names[key], key[1], count) for key, count in counter.most_common(limit)]
 
     def get_stats(self) -> Dict[str, int]:
         """Возвращает текущую статистику."""
-        return self.stats
+        return {
+            'total_users': len(self.data),
+            'active_users': len(self.data) - len(self.banned_users),
+            'subscribers': len(self._subscription_slots),
+            **self.counters.values
+        }
+
+    def get_stat_rates(self) -> Dict[str, Dict[str, int]]:
+        """Возвращает число запросов за последнюю минуту, час и сутки для каждого счетчика."""
+        return {name: self.counters.rates(name) for name in self.counters.values}
 
 
-# Глобальный экземпляр хранилища для использования в проекте
+# Глобальный экземпляр хранилища для использования в проекте (данные загружаются при запуске бота)
 user_storage = Storage()
\ No newline at end of file
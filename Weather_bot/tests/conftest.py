@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Модули бота импортируются от корня проекта, как в bot.py
+sys.path.insert(0, str(Path(__file__).parent.parent))
@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from services.broadcast import Broadcaster
+from services.outbound import OutboundLimiter
+from storage.storage import Storage
+
+ADMIN_ID = 1
+
+
+class FakeSession:
+    def middleware(self, middleware):
+        pass
+
+
+class FakeBot:
+    """Бот, запоминающий отправленные сообщения; отправка пользователю hold_user ждет события release."""
+
+    def __init__(self, hold_user=None):
+        self.session = FakeSession()
+        self.sent = []
+        self.hold_user = hold_user
+        self.release = asyncio.Event()
+
+    async def send_message(self, chat_id, text):
+        if chat_id == self.hold_user:
+            await self.release.wait()
+        self.sent.append((chat_id, text))
+
+    async def edit_message_text(self, text, chat_id, message_id):
+        pass
+
+
+def make_storage(tmp_path, users: int) -> Storage:
+    storage = Storage(str(tmp_path / 'user_data.json'), shared=False)
+    storage.load()
+    for user_id in range(100, 100 + users):
+        asyncio.run(storage.set_user_language(user_id, 'ru'))
+    return storage
+
+
+def make_broadcaster(bot, storage, tmp_path) -> Broadcaster:
+    return Broadcaster(bot, storage, limiter=OutboundLimiter(), state_path=str(tmp_path / 'broadcast.json'),
+                       concurrency=1)
+
+
+def received(bot):
+    return [chat_id for chat_id, _ in bot.sent if chat_id != ADMIN_ID]
+
+
+def test_resume_continues_after_cursor(tmp_path):
+    storage = make_storage(tmp_path, 10)
+    state = {'text': 'привет', 'admin_chat_id': ADMIN_ID, 'cursor': 104,
+             'success': 4, 'failed': 0, 'blocked': 1, 'started_at': 0}
+    (tmp_path / 'broadcast.json').write_text(json.dumps(state), encoding='utf-8')
+
+    async def run():
+        bot = FakeBot()
+        broadcaster = make_broadcaster(bot, storage, tmp_path)
+        assert broadcaster.resume()
+        await broadcaster._task
+        return bot
+
+    bot = asyncio.run(run())
+    assert received(bot) == list(range(105, 110))
+    assert 'Успешно: 9' in bot.sent[-1][1]
+    assert not (tmp_path / 'broadcast.json').exists()
+
+
+def test_stopped_broadcast_resumes_from_last_saved_chunk(tmp_path):
+    storage = make_storage(tmp_path, 12)
+
+    async def run():
+        bot = FakeBot(hold_user=107)
+        broadcaster = make_broadcaster(bot, storage, tmp_path)
+        assert broadcaster.start('привет', ADMIN_ID)
+        while len(received(bot)) < 7:  # первая пачка (5 сообщений) сохранена, вторая ждет на 107
+            await asyncio.sleep(0.01)
+        await broadcaster.stop()
+        first = received(bot)
+        assert json.loads((tmp_path / 'broadcast.json').read_text(encoding='utf-8'))['cursor'] == 104
+
+        bot = FakeBot()
+        broadcaster = make_broadcaster(bot, storage, tmp_path)
+        assert broadcaster.resume()
+        await broadcaster._task
+        return first, received(bot)
+
+    first, second = asyncio.run(run())
+    assert first == list(range(100, 107))
+    # Незавершенная пачка отправляется заново целиком, завершенные - нет
+    assert second == list(range(105, 112))
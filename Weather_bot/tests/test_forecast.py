@@ -0,0 +1,50 @@
+from datetime import date, datetime, timezone
+
+import pytest
+
+from services.forecast import Forecast
+
+HOUR = 3600
+
+
+def make_forecast(start: datetime, slots: int, utc_offset: int) -> Forecast:
+    """Прогноз по трехчасовым интервалам начиная с start (UTC); температура равна номеру интервала."""
+    items = []
+    for i in range(slots):
+        code, description = (800, 'ясно') if i % 3 else (500, 'дождь')
+        items.append({'dt': int(start.timestamp()) + i * 3 * HOUR,
+                      'main': {'temp': float(i), 'humidity': 50 + i},
+                      'wind': {'speed': float(i % 4)},
+                      'weather': [{'id': code, 'description': description}]})
+    return Forecast.from_api({'city': {'id': 1850147, 'name': 'Токио', 'timezone': utc_offset}, 'list': items})
+
+
+def test_days_follow_city_local_time():
+    # 15:00 UTC - уже полночь в Токио (UTC+9)
+    forecast = make_forecast(datetime(2026, 1, 1, 15, tzinfo=timezone.utc), 16, 9 * HOUR)
+    days = forecast.daily(days=5)
+    assert [day.date for day in days] == [date(2026, 1, 2), date(2026, 1, 3)]
+    first = days[0]
+    assert (first.temp_min, first.temp_max, first.temp_mean) == (0, 7, pytest.approx(3.5))
+    assert first.humidity == 54
+    assert first.wind_max == 3
+    assert (first.code, first.description) == (800, 'ясно')
+
+
+def test_same_moments_split_differently_in_utc():
+    forecast = make_forecast(datetime(2026, 1, 1, 15, tzinfo=timezone.utc), 16, 0)
+    assert [day.date for day in forecast.daily(days=5)] == [date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 3)]
+
+
+def test_short_first_day_is_skipped_only_when_days_are_cut():
+    # 18:00 и 21:00 местного времени: остаток дня из двух интервалов
+    forecast = make_forecast(datetime(2026, 1, 1, 18, tzinfo=timezone.utc), 20, 0)
+    assert [day.date for day in forecast.daily(days=2)] == [date(2026, 1, 2), date(2026, 1, 3)]
+    assert len(forecast.daily(days=5)) == 4
+
+
+def test_dict_round_trip_keeps_daily_summary():
+    forecast = make_forecast(datetime(2026, 1, 1, tzinfo=timezone.utc), 40, -5 * HOUR)
+    restored = Forecast.from_dict(forecast.to_dict())
+    assert restored.daily() == forecast.daily()
+    assert restored.utc_offset == -5 * HOUR and len(restored) == 40
@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from services.geocoding import CityResolver
+
+
+class FakeWeatherAPI:
+    """Отвечает на запрос погоды любым городом как London (id 2643743)."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def get_weather(self, city, lang='ru', **kwargs):
+        self.calls.append(city)
+        return {'cod': 200, 'id': 2643743, 'name': 'London', 'coord': {'lat': 51.5085, 'lon': -0.1257},
+                'sys': {'country': 'GB'}}
+
+
+def make_resolver(tmp_path, api):
+    cities = [
+        {'id': 524901, 'name': 'Москва', 'coord': {'lat': 55.7522, 'lon': 37.6156}, 'country': 'RU'},
+        {'id': 2643743, 'name': 'London', 'coord': {'lat': 51.5085, 'lon': -0.1257}, 'country': 'GB'},
+        {'id': 6058560, 'name': 'London', 'coord': {'lat': 42.9834, 'lon': -81.233}, 'country': 'CA'},
+    ]
+    (tmp_path / 'city.list.json').write_text(json.dumps(cities), encoding='utf-8')
+    index = {'париж': {'id': 2988507, 'name': 'Paris', 'lat': 48.8534, 'lon': 2.3488, 'country': 'FR'}}
+    (tmp_path / 'city_index.json').write_text(json.dumps(index), encoding='utf-8')
+    return CityResolver(api, str(tmp_path / 'city_index.json'), str(tmp_path / 'city.list.json'))
+
+
+def test_resolve_waits_for_startup_load(tmp_path):
+    async def run():
+        api = FakeWeatherAPI()
+        resolver = make_resolver(tmp_path, api)
+        resolver.start_loading()
+        # Поиск сразу после запуска видит загруженные таблицы целиком
+        assert (await resolver.resolve('москва'))['id'] == 524901
+        assert (await resolver.resolve('Париж'))['id'] == 2988507
+        assert api.calls == []
+        # Неоднозначное название определяет API
+        assert (await resolver.resolve('London'))['id'] == 2643743
+        assert api.calls == ['London']
+    asyncio.run(run())
+
+
+def test_load_does_not_touch_files_on_creation(tmp_path):
+    resolver = make_resolver(tmp_path, FakeWeatherAPI())
+    assert resolver.index == {} and resolver.offline == {}
+    resolver.load()
+    assert set(resolver.offline) == {'москва'}
+    assert set(resolver.index) == {'париж'}
+
+
+def test_resolved_cities_are_saved_in_background(tmp_path):
+    async def run():
+        resolver = make_resolver(tmp_path, FakeWeatherAPI())
+        await resolver.resolve('Лондон')
+        await resolver.resolve('London')
+        await resolver.flush()
+        saved = json.loads((tmp_path / 'city_index.json').read_text(encoding='utf-8'))
+        assert set(saved) == {'париж', 'лондон', 'london'}
+    asyncio.run(run())
@@ -0,0 +1,56 @@
+import math
+
+import pytest
+
+from services.geogrid import KM_PER_DEGREE, GeoGrid
+
+
+def distance_km(a, b) -> float:
+    """Расстояние по равноугольной проекции (достаточно для соседних точек)."""
+    dlat = a[0] - b[0]
+    dlon = (a[1] - b[1] + 180) % 360 - 180
+    return KM_PER_DEGREE * math.hypot(dlat, dlon * math.cos(math.radians((a[0] + b[0]) / 2)))
+
+
+@pytest.mark.parametrize('lat, lon', [
+    (55.7522, 37.6156), (-33.8688, 151.2093), (0.0, 0.0),
+    (69.6492, 18.9553), (78.2232, 15.6267), (-77.8419, 166.6863),  # Тромсё, Шпицберген, Мак-Мердо
+    (65.0, 179.999), (65.0, -179.999), (-16.5, 180.0),  # у линии перемены дат
+    (89.99, 45.0), (-89.99, -100.0), (90.0, 0.0),  # у полюсов ячейки полосы сходятся к полюсу
+])
+def test_point_is_near_its_cell_center(lat, lon):
+    grid = GeoGrid(cell_km=10)
+    center = grid.cell(lat, lon)
+    # Ячейка почти квадратная на любой широте: центр не дальше половины диагонали
+    assert distance_km((lat, lon), center) <= 10 * math.sqrt(2) / 2 + 0.5
+    assert -90 <= center[0] <= 90 and -180 <= center[1] <= 180
+
+
+def test_cells_at_high_latitude_are_not_squeezed():
+    grid = GeoGrid(cell_km=10)
+    # На 78° градус долготы короче 25 км: соседние точки в 0.2° (~4.6 км) попадают в одну или соседние ячейки
+    centers = {grid.cell(78.22, 15.0 + i * 0.2) for i in range(10)}
+    assert 3 <= len(centers) <= 5
+
+
+def test_antimeridian_sides_are_different_cells():
+    grid = GeoGrid(cell_km=10)
+    east, west = grid.cell(65.0, 179.99), grid.cell(65.0, -179.99)
+    assert east != west
+    assert distance_km(east, west) <= 10 * 1.5
+    assert grid.cell(65.0, 180.0) == grid.cell(65.0, -180.0)
+
+
+def test_popularity_decays_and_evicts_least_popular():
+    grid = GeoGrid(cell_km=10, max_cells=4)
+    cells = [grid.cell(55.0 + i, 37.0) for i in range(5)]
+    for count, cell in enumerate(cells[:4], start=1):
+        for _ in range(count):
+            grid.record(cell, 'ru')
+    grid.record(cells[4], 'ru')  # место освобождает наименее популярная ячейка
+    assert len(grid) == 4 and (cells[0], 'ru') not in grid.counts
+    assert [cell for cell, _, _ in grid.popular(2)] == [cells[3], cells[2]]
+    grid.decay()
+    assert (cells[4], 'ru') in grid.counts and grid.counts[(cells[4], 'ru')] == 0.5
+    grid.decay()
+    assert (cells[4], 'ru') not in grid.counts
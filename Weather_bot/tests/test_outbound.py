@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+from services.outbound import BULK, INTERACTIVE, OutboundLimiter
+
+
+async def timed(awaitable) -> float:
+    started = time.monotonic()
+    await awaitable
+    return time.monotonic() - started
+
+
+def test_reply_does_not_wait_behind_broadcast():
+    async def run():
+        # Рассылка могла бы выбрать весь общий лимит: 200 чатов при 10 сообщениях в секунду
+        limiter = OutboundLimiter(global_rate=10, bulk_rate=100, per_chat_interval=1.0)
+        bulk = [asyncio.create_task(limiter.acquire(chat_id, BULK)) for chat_id in range(200)]
+        await asyncio.sleep(0.55)  # между пополнениями ведра
+        wait = await timed(limiter.acquire(1000, INTERACTIVE))
+        for task in bulk:
+            task.cancel()
+        await asyncio.gather(*bulk, return_exceptions=True)
+        return wait
+
+    # Ответ берет токен из запаса, который рассылка оставляет ответам
+    assert asyncio.run(run()) < 0.02
+
+
+def test_broadcast_yields_to_waiting_replies():
+    async def run():
+        limiter = OutboundLimiter(global_rate=20, bulk_rate=10)
+        limiter.waiting[INTERACTIVE] = 1  # ответ пользователю ждет токен
+        bulk = asyncio.create_task(limiter.acquire(1, BULK))
+        await asyncio.sleep(0.1)
+        assert not bulk.done()
+        limiter.waiting[INTERACTIVE] = 0
+        await asyncio.wait_for(bulk, timeout=1)
+    asyncio.run(run())
+
+
+def test_broadcast_keeps_per_chat_interval():
+    async def run():
+        limiter = OutboundLimiter(global_rate=100, bulk_rate=50, per_chat_interval=0.2)
+        await limiter.acquire(1, BULK)
+        return await timed(limiter.acquire(1, BULK)), await timed(limiter.acquire(2, BULK))
+
+    same_chat, other_chat = asyncio.run(run())
+    assert same_chat == pytest.approx(0.2, abs=0.05)
+    assert other_chat < 0.05
@@ -0,0 +1,44 @@
+import asyncio
+
+from services.singleflight import SingleFlight
+
+
+def test_single_flight_shares_result_and_error():
+    async def run():
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return calls
+
+        assert await asyncio.gather(*(flight.do('a', fetch) for _ in range(5))) == [1] * 5
+        assert calls == 1 and flight.shared == 4 and len(flight) == 0
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError('API')
+
+        results = await asyncio.gather(*(flight.do('b', fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        # После завершения следующий вызов снова идет в API
+        assert await flight.do('a', fetch) == 2
+    asyncio.run(run())
+
+
+def test_single_flight_survives_cancelled_waiter():
+    async def run():
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return 'ok'
+
+        first = asyncio.create_task(flight.do('a', fetch))
+        second = asyncio.create_task(flight.do('a', fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == 'ok'
+    asyncio.run(run())
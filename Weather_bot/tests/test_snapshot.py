@@ -0,0 +1,100 @@
+import os
+import struct
+
+import pytest
+
+from storage.backends import SnapshotBackend
+from storage.records import UserRecord
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / 'user_data.bin')
+
+
+def sample_users():
+    """Пользователи со всеми полями, без полей и с граничными значениями."""
+    return {
+        1: UserRecord('Москва', 524901, 55.7522, 37.6156, 'ru', UserRecord.BANNED, '07:30', 10800),
+        2: UserRecord(),
+        3: UserRecord('London', None, None, None, 'en', UserRecord.BANNED | UserRecord.BLOCKED, None, None),
+        4: UserRecord('', 0, 0.0, -0.0, '', 0, '00:00', 0),
+        5: UserRecord('Anchorage', 5879400, 61.2181, -149.9003, 'en', UserRecord.BLOCKED, '23:45', -32400),
+        2 ** 40: UserRecord('Москва', 524901, 55.7522, 37.6156, 'en', 0, '07:30', 10800),
+    }
+
+
+def test_round_trip_keeps_all_fields(snapshot_path):
+    users = sample_users()
+    backend = SnapshotBackend(snapshot_path)
+    backend.save_users(users, users)
+
+    loaded = SnapshotBackend(snapshot_path).load_users()
+
+    assert loaded == users
+    assert loaded[2].city is None and loaded[2].utc_offset is None
+    assert loaded[4].utc_offset == 0 and loaded[4].city_id == 0
+    assert loaded[3].banned and loaded[3].blocked
+
+
+def test_round_trip_of_empty_snapshot(snapshot_path):
+    backend = SnapshotBackend(snapshot_path)
+    backend.save_users({}, {})
+
+    assert SnapshotBackend(snapshot_path).load_users() == {}
+    assert not os.path.exists(snapshot_path + '.corrupt')
+
+
+def test_users_are_loaded_in_batches(snapshot_path):
+    users = sample_users()
+    SnapshotBackend(snapshot_path).save_users(users, users)
+
+    batches = list(SnapshotBackend(snapshot_path).iter_users(2))
+
+    assert [len(batch) for batch in batches] == [2, 2, 2]
+    assert {user_id: user for batch in batches for user_id, user in batch.items()} == users
+
+
+def damage_truncate(raw: bytes) -> bytes:
+    return raw[:len(raw) - 5]
+
+
+def damage_header(raw: bytes) -> bytes:
+    return raw[:6]
+
+
+def damage_magic(raw: bytes) -> bytes:
+    return b'XXXX' + raw[4:]
+
+
+def damage_strings(raw: bytes) -> bytes:
+    size = SnapshotBackend.HEADER.size
+    return raw[:size] + b'#' + raw[size + 1:]
+
+
+def damage_string_index(raw: bytes) -> bytes:
+    # Первое значение столбца city указывает за пределы таблицы строк
+    _, _, count, strings_size = SnapshotBackend.HEADER.unpack_from(raw)
+    offset = SnapshotBackend.HEADER.size + strings_size + 8 * count
+    return raw[:offset] + struct.pack('<i', 1000) + raw[offset + 4:]
+
+
+def damage_trailing(raw: bytes) -> bytes:
+    return raw + b'\0' * 8
+
+
+@pytest.mark.parametrize('damage', [damage_truncate, damage_header, damage_magic, damage_strings,
+                                    damage_string_index, damage_trailing])
+def test_damaged_snapshot_is_set_aside(snapshot_path, damage):
+    users = sample_users()
+    SnapshotBackend(snapshot_path).save_users(users, users)
+    with open(snapshot_path, 'rb') as f:
+        raw = f.read()
+    with open(snapshot_path, 'wb') as f:
+        f.write(damage(raw))
+
+    assert SnapshotBackend(snapshot_path).load_users() == {}
+    # Поврежденный файл не перезаписывается следующим сохранением
+    assert not os.path.exists(snapshot_path)
+    with open(snapshot_path + '.corrupt', 'rb') as f:
+        assert f.read() == damage(raw)
@@ -0,0 +1,144 @@
+import asyncio
+import json
+
+import pytest
+
+from storage.backends import JSONBackend, SQLiteBackend
+from storage.records import UserRecord
+from storage.storage import Storage
+
+
+class BrokenBackend(JSONBackend):
+    """JSON-бэкенд, файл которого не читается."""
+
+    def iter_users(self, batch_size: int):
+        raise OSError('диск недоступен')
+
+
+def test_load_error_wakes_waiters(tmp_path):
+    async def run():
+        storage = Storage(backend=BrokenBackend(str(tmp_path / 'user_data.json')), shared=False)
+        waiter = asyncio.create_task(storage.ensure_user(1))
+        storage.start_loading()
+        with pytest.raises(RuntimeError):
+            await asyncio.wait_for(waiter, timeout=1)
+        with pytest.raises(RuntimeError):
+            await storage.wait_loaded()
+        assert isinstance(storage.load_error, OSError)
+        await storage.stop_write_behind()
+    asyncio.run(run())
+
+
+def test_corrupt_json_is_kept_aside(tmp_path):
+    path = tmp_path / 'user_data.json'
+    path.write_text('{"1": {"city": "Моск', encoding='utf-8')
+    storage = Storage(str(path), shared=False)
+    storage.load()
+    assert storage.data == {}
+    assert (tmp_path / 'user_data.json.corrupt').read_text(encoding='utf-8') == '{"1": {"city": "Моск'
+    # Новые данные пишутся в новый файл, поврежденный остается для восстановления
+    asyncio.run(storage.set_user_city(1, 'Москва'))
+    storage.flush()
+    assert (tmp_path / 'user_data.json.corrupt').exists()
+
+
+def test_shared_mode_writes_through(tmp_path):
+    async def run():
+        db_path = str(tmp_path / 'users.db')
+        storage = Storage(backend=SQLiteBackend(db_path), shared=True)
+        storage.start_loading()
+        storage.start_write_behind()
+        await storage.wait_loaded()
+        await storage.set_user_city(1, 'Москва', 524901)
+        # Изменение видно другому процессу сразу, без ожидания фоновой записи
+        other = SQLiteBackend(db_path)
+        assert other.load_user(1).city_id == 524901
+        other.close()
+        await storage.stop_write_behind()
+        storage.close()
+    asyncio.run(run())
+
+
+def test_json_users_are_migrated_to_sqlite_once(tmp_path):
+    json_path = tmp_path / 'user_data.json'
+    json_path.write_text(json.dumps({
+        '1': {'city': 'Москва', 'city_id': 524901, 'language': 'ru', 'banned': True},
+        '2': {'language': 'en', 'notify_at': '07:30', 'utc_offset': 3600},
+    }), encoding='utf-8')
+    backend = SQLiteBackend(str(tmp_path / 'users.db'), str(json_path))
+    users = backend.load_users()
+    assert users[1] == UserRecord('Москва', 524901, language='ru', flags=UserRecord.BANNED)
+    assert users[2].notify_at == '07:30' and users[2].utc_offset == 3600
+    assert not json_path.exists() and (tmp_path / 'user_data.json.migrated').exists()
+    backend.close()
+
+    # Непустая база повторно не заполняется, даже если JSON-файл появился снова
+    json_path.write_text(json.dumps({'3': {'city': 'Париж'}}), encoding='utf-8')
+    backend = SQLiteBackend(str(tmp_path / 'users.db'), str(json_path))
+    assert set(backend.load_users()) == {1, 2}
+    backend.close()
+
+
+def test_sqlite_saves_only_changed_users(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / 'users.db'))
+    users = {user_id: UserRecord('Москва', language='ru') for user_id in range(1, 4)}
+    backend.save_users(users, users)
+    version = backend.get_version()
+    users[2].city = 'Казань'
+    backend.save_users({2: users[2]}, users)
+    changed, new_version = backend.load_changed_users(version)
+    assert changed == {2: users[2]} and new_version == version + 1
+    assert backend.load_user(1).city == 'Москва' and backend.load_user(2).city == 'Казань'
+    assert backend.load_user(10) is None
+    backend.close()
+
+
+class CountingBackend(SQLiteBackend):
+    """SQLite-бэкенд, запоминающий размер каждой записанной пачки."""
+
+    def __init__(self, db_path: str):
+        super().__init__(db_path)
+        self.batches = []
+
+    def save_users(self, users, all_users):
+        self.batches.append(len(users))
+        return super().save_users(users, all_users)
+
+
+def test_write_behind_batches_changes(tmp_path):
+    async def run():
+        backend = CountingBackend(str(tmp_path / 'users.db'))
+        storage = Storage(backend=backend, shared=False)
+        storage.flush_interval = 60
+        storage.flush_max_changes = 3
+        storage.load()
+        storage.start_write_behind()
+        await storage.set_user_language(1, 'en')
+        await storage.set_user_city(1, 'London')
+        await storage.set_user_city(2, 'Москва')
+        assert backend.batches == []  # изменения копятся
+        await storage.set_user_city(3, 'Казань')  # третий измененный пользователь: пора сбросить
+        await asyncio.sleep(0.01)
+        assert backend.batches == [3]
+        await storage.set_user_city(4, 'Сочи')
+        await storage.stop_write_behind()  # остаток сохраняется при остановке
+        assert backend.batches == [3, 1]
+        assert backend.load_user(1) == UserRecord('London', language='en')
+        storage.close()
+    asyncio.run(run())
+
+
+def test_write_behind_flushes_by_interval(tmp_path):
+    async def run():
+        backend = CountingBackend(str(tmp_path / 'users.db'))
+        storage = Storage(backend=backend, shared=False)
+        storage.flush_interval = 0.05
+        storage.load()
+        storage.start_write_behind()
+        await storage.set_user_city(1, 'Москва')
+        await asyncio.sleep(0.2)
+        assert backend.batches == [1]
+        await storage.stop_write_behind()
+        assert backend.batches == [1]  # сохранять больше нечего
+        storage.close()
+    asyncio.run(run())
@@ -0,0 +1,113 @@
+import asyncio
+import time
+
+import pytest
+
+from services.subscriptions import SubscriptionScheduler, parse_notify_time
+from storage.storage import Storage, subscription_slot
+
+DAY = 86400
+
+
+class FakeWeatherAPI:
+    def __init__(self, timezone=None):
+        self.timezone = timezone
+        self.calls = []
+        self.weather_cache = self
+
+    ttl = 300
+
+    def age(self, key):
+        return 0  # кэш свежий: групповое обновление не нужно
+
+    def _cache_key(self, city, lang):
+        return city, lang
+
+    async def get_weather(self, city, lang='ru', force_refresh=False, background=False):
+        self.calls.append(('weather', background))
+        if self.timezone is None:
+            return None
+        return {'id': 524901, 'name': 'Москва', 'dt': 1700000000, 'timezone': self.timezone,
+                'coord': {'lat': 55.7522, 'lon': 37.6156}, 'sys': {'country': 'RU'},
+                'main': {'temp': 1.0, 'feels_like': -2.0, 'humidity': 80, 'pressure': 1010},
+                'weather': [{'description': 'снег', 'icon': '13d'}], 'wind': {'speed': 3.0}}
+
+    async def get_forecast(self, city, lang='ru', force_refresh=False, background=False):
+        self.calls.append(('forecast', background))
+        return None
+
+
+def test_sent_marks_are_pruned_once_a_day():
+    scheduler = SubscriptionScheduler(FakeWeatherAPI(), None, None)
+    now = 100 * DAY + 3600
+    scheduler._sent_on = {1: 100, 2: 99, 3: 98, 4: 101}
+    scheduler._prune_sent(now)
+    assert scheduler._sent_on == {1: 100, 2: 99, 4: 101}
+    scheduler._sent_on[5] = 50
+    scheduler._prune_sent(now + 60)  # в тот же день повторно не чистим
+    assert 5 in scheduler._sent_on
+
+
+def test_render_uses_background_quota():
+    api = FakeWeatherAPI()
+    scheduler = SubscriptionScheduler(api, None, None)
+    assert asyncio.run(scheduler._render(524901, 'ru')) == (None, None)
+    assert api.calls == [('weather', True), ('forecast', True)]
+
+
+class FakeBroadcaster:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, user_id, text):
+        self.sent.append(user_id)
+        return 'success'
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('07:30', '07:30'), ('7.44', '07:30'), (' 23:59 ', '23:45'), ('00:00', '00:00'),
+    ('24:00', None), ('12:60', None), ('7', None), ('', None), (None, None),
+])
+def test_parse_notify_time(text, expected):
+    assert parse_notify_time(text, 15) == expected
+
+
+def test_subscription_slot_is_in_utc():
+    assert subscription_slot('07:30', 3 * 3600, 15) == 4 * 4 + 2  # 04:30 UTC
+    assert subscription_slot('01:00', 3 * 3600, 15) == 22 * 4  # 22:00 UTC предыдущего дня
+    assert subscription_slot('23:00', -5 * 3600, 15) == 4 * 4  # 04:00 UTC следующего дня
+    assert subscription_slot('12:00', 5 * 3600 + 1800, 15) == 6 * 4 + 2  # смещение с получасом
+
+
+def test_subscription_moves_between_slots(tmp_path):
+    async def run():
+        storage = Storage(str(tmp_path / 'user_data.json'), shared=False)
+        storage.load()
+        await storage.set_user_city(1, 'Москва', 524901)
+        await storage.set_user_subscription(1, '07:00', 3 * 3600)
+        assert storage.get_subscribers(16) == [1]
+        await storage.set_user_subscription(1, '07:00', 2 * 3600)
+        assert storage.get_subscribers(16) == [] and storage.get_subscribers(20) == [1]
+        await storage.set_user_subscription(1, None)
+        assert storage.subscriptions == {}
+    asyncio.run(run())
+
+
+def test_offset_change_is_applied_after_the_slot_without_resending(tmp_path, monkeypatch):
+    monkeypatch.setattr(time, 'time', lambda: 100 * DAY + 4 * 3600)  # начало слота 16 (04:00 UTC)
+
+    async def run():
+        storage = Storage(str(tmp_path / 'user_data.json'), shared=False)
+        storage.load()
+        await storage.set_user_city(1, 'Москва', 524901)
+        await storage.set_user_subscription(1, '07:00', 3 * 3600)
+        broadcaster = FakeBroadcaster()
+        # Город перешел на другое смещение: подписчик переезжает в более поздний слот
+        scheduler = SubscriptionScheduler(FakeWeatherAPI(timezone=2 * 3600), storage, broadcaster, slot_minutes=15)
+        assert await scheduler.run_once(16) == 1
+        assert storage.get_user(1).utc_offset == 2 * 3600
+        assert storage.get_subscribers(20) == [1]
+        # В новом слоте в тот же день рассылка не повторяется
+        assert await scheduler.run_once(20) == 0
+        assert broadcaster.sent == [1]
+    asyncio.run(run())
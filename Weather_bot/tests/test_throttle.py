@@ -0,0 +1,87 @@
+import time
+
+import pytest
+
+from services.throttle import UserThrottler
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, 'monotonic', clock)
+    return clock
+
+
+def make_throttler(**kwargs) -> UserThrottler:
+    options = {'limits': {'default': (3, 3.0), 'weather': (1, 10.0)}, 'duplicate_window': 1.0,
+               'auto_ban': False, 'ban_threshold': 5, 'ban_window': 60.0, 'idle_ttl': 600.0, 'max_users': 100}
+    return UserThrottler(**{**options, **kwargs})
+
+
+def test_each_kind_has_its_own_bucket(clock):
+    throttler = make_throttler()
+    assert throttler.check(1, 'weather', 'a').action == throttler.ALLOW
+    clock.now += 2
+    decision = throttler.check(1, 'weather', 'b')
+    assert decision.action == throttler.WARN and decision.retry_after == pytest.approx(8)
+    # Другой тип команды и другой пользователь ограничиваются отдельно
+    assert throttler.check(1, 'help', 'c').action == throttler.ALLOW
+    assert throttler.check(2, 'weather', 'a').action == throttler.ALLOW
+    clock.now += 8
+    assert throttler.check(1, 'weather', 'd').action == throttler.ALLOW
+
+
+def test_repeated_press_is_dropped_within_window(clock):
+    throttler = make_throttler()
+    assert throttler.check(1, 'default', ('callback', 'x')).action == throttler.ALLOW
+    clock.now += 0.5
+    assert throttler.check(1, 'default', ('callback', 'x')).action == throttler.DUPLICATE
+    clock.now += 1.0
+    assert throttler.check(1, 'default', ('callback', 'x')).action == throttler.ALLOW
+    assert throttler.counts[throttler.DUPLICATE] == 1
+
+
+def test_warns_once_then_drops(clock):
+    throttler = make_throttler()
+    assert throttler.check(1, 'weather', 'a').action == throttler.ALLOW
+    assert throttler.check(1, 'weather', 'b').action == throttler.WARN
+    assert throttler.check(1, 'weather', 'c').action == throttler.DROP
+    clock.now += 10
+    assert throttler.check(1, 'weather', 'd').action == throttler.ALLOW
+
+
+def test_flood_leads_to_auto_ban(clock):
+    throttler = make_throttler(auto_ban=True, ban_threshold=3)
+    throttler.check(1, 'weather', 0)
+    actions = [throttler.check(1, 'weather', i).action for i in range(1, 4)]
+    assert actions == [throttler.WARN, throttler.DROP, throttler.BAN]
+    # Состояние забаненного удаляется: дальше его отсекает проверка бана
+    assert len(throttler) == 0
+
+
+def test_strikes_reset_after_ban_window(clock):
+    throttler = make_throttler(auto_ban=True, ban_threshold=3)
+    throttler.check(1, 'weather', 0)
+    throttler.check(1, 'weather', 1)
+    throttler.check(1, 'weather', 2)
+    clock.now += 61
+    throttler.check(1, 'weather', 3)  # лимит восстановился
+    assert throttler.check(1, 'weather', 4).action != throttler.BAN
+
+
+def test_idle_users_are_forgotten(clock):
+    throttler = make_throttler(max_users=2)
+    for user_id in range(3):
+        throttler.check(user_id, 'default', 'a')
+    assert len(throttler) == 2
+    clock.now += 601
+    throttler.check(10, 'default', 'a')
+    assert len(throttler) == 1
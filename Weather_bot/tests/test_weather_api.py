@@ -0,0 +1,165 @@
+import asyncio
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import services.weather_api as weather_api_module
+from benchmarks.fake_servers import FakeOpenWeatherMap
+from services.quota import QuotaExceededError, QuotaManager
+from services.resilience import CircuitBreaker, CircuitOpenError
+from services.weather_api import WeatherAPI
+
+
+def make_api(url: str = 'http://127.0.0.1:9/', **quota) -> WeatherAPI:
+    api = WeatherAPI()
+    api.BASE_URL = url
+    api.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    api.quota = QuotaManager(['key'], **{'per_minute': 600, 'per_day': 0, 'max_wait': 1, **quota})
+    return api
+
+
+def open_breaker(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+
+
+def quota_calls(api: WeatherAPI) -> int:
+    return sum(key['calls'] for key in api.quota.get_stats())
+
+
+def test_open_breaker_does_not_spend_quota():
+    async def run():
+        api = make_api(per_minute=1)  # квоты на один запрос: ожидание квоты было бы заметно
+        open_breaker(api.breaker)
+        for _ in range(5):
+            with pytest.raises(CircuitOpenError):
+                await asyncio.wait_for(api._request('weather', {'q': 'Москва'}), timeout=0.5)
+        assert quota_calls(api) == 0
+        assert api.quota._waiting == 0
+    asyncio.run(run())
+
+
+def test_probe_without_quota_is_released():
+    async def run():
+        api = make_api(per_minute=1, max_wait=0)
+        await api.quota.acquire()  # квота исчерпана
+        open_breaker(api.breaker)
+        api.breaker.reset_timeout = 0  # автомат сразу полуоткрыт
+        with pytest.raises(QuotaExceededError):
+            await api._request('weather', {'q': 'Москва'})
+        # Пробный запрос не был отправлен, следующий запрос может стать пробным
+        assert api.breaker.allow()
+    asyncio.run(run())
+
+
+def test_retry_does_not_spend_quota_after_breaker_opened(monkeypatch):
+    async def run():
+        owm = FakeOpenWeatherMap(latency=0, jitter=0, error_rate=1.0)
+        api = make_api(await owm.start())
+        api.retries = 3
+
+        def backoff(*args, **kwargs):
+            # Пока запрос ждет повтора, другие запросы размыкают автомат
+            open_breaker(api.breaker)
+            return 0
+        monkeypatch.setattr(weather_api_module, 'backoff_delay', backoff)
+        try:
+            with pytest.raises(Exception):
+                await api._request('weather', {'q': 'Москва'})
+            assert owm.calls['weather'] == 1
+            assert quota_calls(api) == 1
+        finally:
+            await api.close()
+            await owm.stop()
+    asyncio.run(run())
+
+
+def test_breaker_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == breaker.CLOSED and breaker.allow()
+
+
+def test_background_requests_do_not_wait_for_quota():
+    async def run():
+        quota = QuotaManager(['key'], per_minute=6, per_day=0, background_reserve=0.0, max_wait=5)
+        await quota.acquire()  # единственный токен ведра
+        with pytest.raises(QuotaExceededError):
+            await asyncio.wait_for(quota.acquire(background=True), timeout=0.1)
+        assert quota.rejected == 1
+    asyncio.run(run())
+
+
+def test_daily_quota_is_not_exceeded():
+    async def run():
+        quota = QuotaManager(['key'], per_minute=600, per_day=2, max_wait=1)
+        await quota.acquire()
+        await quota.acquire()
+        with pytest.raises(QuotaExceededError):
+            await quota.acquire()
+    asyncio.run(run())
+
+
+async def start_server(handler) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get('/{endpoint}', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 8765).start()
+    return runner
+
+
+def test_garbage_body_during_probe_is_a_failure():
+    async def run():
+        calls = 0
+
+        async def garbage(request: web.Request) -> web.Response:
+            nonlocal calls
+            calls += 1
+            return web.Response(text='{"main": {"te', content_type='application/json')
+
+        runner = await start_server(garbage)
+        api = make_api('http://127.0.0.1:8765/')
+        api.retries = 1
+        open_breaker(api.breaker)
+        api.breaker.reset_timeout = 0  # автомат сразу полуоткрыт
+        try:
+            with pytest.raises(aiohttp.ClientError):
+                await api._request('weather', {'q': 'Москва'})
+            assert calls == 2  # испорченный ответ повторяется как 5xx
+            assert api.breaker.state == api.breaker.HALF_OPEN
+            assert not api.breaker._probing
+            assert api.breaker.allow()
+        finally:
+            await api.close()
+            await runner.cleanup()
+    asyncio.run(run())
+
+
+def test_cancelled_probe_is_released():
+    async def run():
+        done = asyncio.Event()
+
+        async def slow(request: web.Request) -> web.Response:
+            await done.wait()
+            return web.json_response({})
+
+        runner = await start_server(slow)
+        api = make_api('http://127.0.0.1:8765/')
+        open_breaker(api.breaker)
+        api.breaker.reset_timeout = 0
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(api._request('weather', {'q': 'Москва'}), timeout=0.1)
+            # Отмененный пробный запрос не блокирует следующий
+            assert api.breaker.allow()
+        finally:
+            done.set()
+            await api.close()
+            await runner.cleanup()
+    asyncio.run(run())